@@ -1,5 +1,42 @@
 from .djb_hash import djb_hash
-from .cdblib import Reader, Reader64, Writer, Writer64
+from .hashes import murmur3_hash, xxh32_hash
+from .cdblib import Reader, Reader48, Reader64, Writer, Writer48, Writer64
+from .cached import CachedReader
+from .reloading import ReloadingReader
+from .parallel import parallel_build, parallel_build_shards
+from .sharded import ShardedReader, ShardedWriter
+from .layered import LayeredReader
+from .perfect import (
+    PerfectReader,
+    PerfectReader48,
+    PerfectReader64,
+    PerfectWriter,
+    PerfectWriter48,
+    PerfectWriter64,
+)
 
 
-__all__ = ['djb_hash', 'Reader', 'Reader64', 'Writer', 'Writer64']
+__all__ = [
+    'djb_hash',
+    'murmur3_hash',
+    'xxh32_hash',
+    'Reader',
+    'Reader48',
+    'Reader64',
+    'Writer',
+    'Writer48',
+    'Writer64',
+    'CachedReader',
+    'ReloadingReader',
+    'parallel_build',
+    'parallel_build_shards',
+    'ShardedReader',
+    'ShardedWriter',
+    'LayeredReader',
+    'PerfectReader',
+    'PerfectReader48',
+    'PerfectReader64',
+    'PerfectWriter',
+    'PerfectWriter48',
+    'PerfectWriter64',
+]
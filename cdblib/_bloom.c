@@ -0,0 +1,110 @@
+#include "_cdb.h"
+
+#define MOD_RETURN(mod) return mod;
+#define MODINIT_NAME PyInit__bloom
+
+
+/* CRC-32 (as computed by zlib.crc32), for the Bloom filter key hash. */
+static unsigned long crc_table[256];
+
+static void
+init_crc_table(void)
+{
+    unsigned long c;
+    int n, k;
+
+    for(n = 0; n < 256; n++) {
+        c = (unsigned long) n;
+        for(k = 0; k < 8; k++)
+            c = (c & 1) ? 0xedb88320UL ^ (c >> 1) : c >> 1;
+        crc_table[n] = c;
+    }
+}
+
+static unsigned long long
+crc32(const unsigned char *s, Py_ssize_t len)
+{
+    unsigned long c = 0xffffffffUL;
+
+    while(len--)
+        c = crc_table[(c ^ *s++) & 0xff] ^ (c >> 8);
+
+    return (c ^ 0xffffffffUL) & 0xffffffffUL;
+}
+
+
+/* Equivalent to cdblib.bloom.might_contain_key(): return False if the key is
+ * definitely not in the Bloom filter, and True if it may be. */
+static PyObject *
+bloom_might_contain_key(PyObject *self, PyObject *args)
+{
+    Py_buffer bits_view;
+    const unsigned char *bits;
+    unsigned long long block_count;
+    unsigned int k, i;
+    const unsigned char *key;
+    Py_ssize_t key_len;
+    unsigned long long hashed_key;
+    unsigned long long z, base, a, b, pos;
+
+    if(! PyArg_ParseTuple(args, "y*KIy#K", &bits_view, &block_count, &k,
+                          &key, &key_len, &hashed_key))
+        return NULL;
+
+    if(! block_count ||
+       (unsigned long long) bits_view.len < block_count * 64) {
+        PyBuffer_Release(&bits_view);
+        PyErr_SetString(PyExc_ValueError, "invalid Bloom filter");
+        return NULL;
+    }
+    bits = (const unsigned char *) bits_view.buf;
+
+    /* cdblib.bloom.key_hash(): splitmix64 finalizer over CRC-32 and cdb
+     * hash. */
+    z = (crc32(key, key_len) << 32) | (hashed_key & 0xffffffffULL);
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    z ^= z >> 31;
+
+    base = (z % block_count) * 512;
+    a = z >> 32;
+    b = (z >> 41) | 1;
+    for(i = 0; i < k; i++) {
+        pos = base + ((a + i * b) & 511);
+        if(! (bits[pos >> 3] & (1 << (pos & 7)))) {
+            PyBuffer_Release(&bits_view);
+            Py_RETURN_FALSE;
+        }
+    }
+    PyBuffer_Release(&bits_view);
+    Py_RETURN_TRUE;
+}
+
+
+static /*const*/ PyMethodDef module_methods[] = {
+    {"might_contain_key", bloom_might_contain_key, METH_VARARGS,
+     "might_contain_key(bits, block_count, k, key, hashed_key)\n\n"
+     "Return False if key is definitely not in the Bloom filter."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef moduledef = {
+    PyModuleDef_HEAD_INIT,
+    "_bloom",
+    NULL,
+    -1,
+    module_methods,
+    NULL,
+    NULL,
+    NULL,
+    NULL
+};
+
+PyMODINIT_FUNC
+MODINIT_NAME(void)
+{
+    PyObject *mod = PyModule_Create(&moduledef);
+
+    init_crc_table();
+    MOD_RETURN(mod);
+}
@@ -0,0 +1,194 @@
+/* Helpers shared by the C extensions that read and write cdb files. */
+#ifndef CDBLIB_CDB_H
+#define CDBLIB_CDB_H
+
+#define PY_SSIZE_T_CLEAN
+#include "Python.h"
+#include <stdint.h>
+#include <string.h>
+
+/* Read a little-endian unsigned integer of the given width (4, 6 or 8
+ * bytes). */
+Py_LOCAL_INLINE(unsigned long long)
+read_le(const unsigned char *p, Py_ssize_t width)
+{
+    unsigned long long v = 0;
+
+    while(width--)
+        v = (v << 8) | p[width];
+
+    return v;
+}
+
+
+/* Write a little-endian unsigned integer of the given width (4, 6 or 8
+ * bytes). */
+Py_LOCAL_INLINE(void)
+write_le(unsigned char *p, unsigned long long v, Py_ssize_t width)
+{
+    Py_ssize_t i;
+
+    for(i = 0; i < width; i++) {
+        p[i] = (unsigned char) (v & 0xff);
+        v >>= 8;
+    }
+}
+
+
+/* Read a native-endian unsigned integer of the given width (4 or 8 bytes),
+ * as stored in an array.array. */
+Py_LOCAL_INLINE(unsigned long long)
+read_native(const unsigned char *p, Py_ssize_t width)
+{
+    uint32_t v4;
+    uint64_t v8;
+
+    if(width == 4) {
+        memcpy(&v4, p, 4);
+        return v4;
+    }
+    memcpy(&v8, p, 8);
+    return v8;
+}
+
+
+/* What probe() should do with the records that match a key. */
+enum probe_mode {
+    PROBE_FIRST,   /* Return the first value, or None */
+    PROBE_ALL,     /* Return a list of all the values */
+    PROBE_COUNT,   /* Return the number of values */
+    PROBE_LENGTH   /* Return the length of the first value, or None */
+};
+
+
+/* Return the value of size bytes at pos in data (whose buffer is buf), as a
+ * bytes object, or as a slice of data if it's a memoryview. */
+Py_LOCAL_INLINE(PyObject *)
+value_at(PyObject *data, const unsigned char *buf, unsigned long long pos,
+         unsigned long long size)
+{
+    if(PyMemoryView_Check(data))
+        /* Zero-copy mode: return a view of the data. */
+        return PySequence_GetSlice(data, (Py_ssize_t) pos,
+                                   (Py_ssize_t) (pos + size));
+    return PyBytes_FromStringAndSize((const char *) buf + pos,
+                                     (Py_ssize_t) size);
+}
+
+
+/* Walk the probe sequence for key, as described at
+ * https://cr.yp.to/cdb/cdb.txt. Keys are compared in place, and values are
+ * only read in PROBE_FIRST and PROBE_ALL modes. They are returned as bytes
+ * objects, or as slices of data if it's a memoryview. Returns NULL with an
+ * exception set on error. */
+Py_LOCAL_INLINE(PyObject *)
+probe_tables(PyObject *data, PyObject *index, Py_ssize_t pair_size,
+             const char *key, Py_ssize_t key_len,
+             unsigned long long hashed_key, enum probe_mode mode)
+{
+    PyObject *entry;
+    unsigned long long table_pos, table_len, slot, i;
+    unsigned long long hash_value, byte_pos, key_size, value_size;
+    unsigned long long count = 0;
+    const unsigned char *buf;
+    Py_buffer view;
+    PyObject *value;
+    PyObject *result = NULL;
+
+    /* "The hash value modulo 256 is the number of a hash table." */
+    entry = PySequence_GetItem(index, (Py_ssize_t) (hashed_key & 0xff));
+    if(entry == NULL)
+        return NULL;
+    if(! PyArg_ParseTuple(entry, "KK", &table_pos, &table_len)) {
+        Py_DECREF(entry);
+        return NULL;
+    }
+    Py_DECREF(entry);
+
+    if(mode == PROBE_ALL && (result = PyList_New(0)) == NULL)
+        return NULL;
+
+    if(PyObject_GetBuffer(data, &view, PyBUF_SIMPLE) < 0) {
+        Py_XDECREF(result);
+        return NULL;
+    }
+    buf = (const unsigned char *) view.buf;
+
+    /* "The hash value divided by 256, modulo the length of that table, is a
+     * slot number. Probe that slot, the next higher slot, and so on, until
+     * you find the record or run into an empty slot." No table can hold more
+     * than table_len records, so that bounds the search. */
+    slot = table_len ? (hashed_key >> 8) % table_len : 0;
+    for(i = 0; i < table_len; i++) {
+        unsigned long long slot_pos = table_pos + (slot * pair_size);
+
+        if(slot_pos + pair_size > (unsigned long long) view.len)
+            goto corrupt;
+
+        hash_value = read_le(buf + slot_pos, pair_size / 2);
+        byte_pos = read_le(buf + slot_pos + (pair_size / 2), pair_size / 2);
+        if(! byte_pos)
+            break;
+
+        if(hash_value == hashed_key) {
+            if(byte_pos + pair_size > (unsigned long long) view.len)
+                goto corrupt;
+
+            key_size = read_le(buf + byte_pos, pair_size / 2);
+            value_size = read_le(buf + byte_pos + (pair_size / 2),
+                                 pair_size / 2);
+            byte_pos += pair_size;
+
+            if(key_size > (unsigned long long) view.len - byte_pos ||
+               value_size > (unsigned long long) view.len - byte_pos -
+                            key_size)
+                goto corrupt;
+
+            if(key_size == (unsigned long long) key_len &&
+               memcmp(buf + byte_pos, key, (size_t) key_len) == 0) {
+                byte_pos += key_size;
+
+                if(mode == PROBE_COUNT) {
+                    count++;
+                } else if(mode == PROBE_LENGTH) {
+                    PyBuffer_Release(&view);
+                    return PyLong_FromUnsignedLongLong(value_size);
+                } else {
+                    value = value_at(data, buf, byte_pos, value_size);
+                    if(value == NULL)
+                        goto error;
+
+                    if(mode == PROBE_FIRST) {
+                        PyBuffer_Release(&view);
+                        return value;
+                    }
+
+                    if(PyList_Append(result, value) < 0) {
+                        Py_DECREF(value);
+                        goto error;
+                    }
+                    Py_DECREF(value);
+                }
+            }
+        }
+
+        if(++slot == table_len)
+            slot = 0;
+    }
+
+    PyBuffer_Release(&view);
+    if(mode == PROBE_ALL)
+        return result;
+    if(mode == PROBE_COUNT)
+        return PyLong_FromUnsignedLongLong(count);
+    Py_RETURN_NONE;
+
+corrupt:
+    PyErr_SetString(PyExc_OSError, "CDB corrupt");
+error:
+    PyBuffer_Release(&view);
+    Py_XDECREF(result);
+    return NULL;
+}
+
+#endif /* CDBLIB_CDB_H */
@@ -0,0 +1,151 @@
+#define PY_SSIZE_T_CLEAN
+#include "Python.h"
+#include <stdint.h>
+
+#define MOD_RETURN(mod) return mod;
+#define MODINIT_NAME PyInit__hashes
+#define BUFFERLIKE_FMT "y#"
+
+#define ROTL32(x, r) (((x) << (r)) | ((x) >> (32 - (r))))
+
+#define XXH_PRIME32_1 0x9E3779B1U
+#define XXH_PRIME32_2 0x85EBCA77U
+#define XXH_PRIME32_3 0xC2B2AE3DU
+#define XXH_PRIME32_4 0x27D4EB2FU
+#define XXH_PRIME32_5 0x165667B1U
+
+
+/* Read a little-endian 32-bit unsigned integer. */
+static uint32_t
+read_le32(const unsigned char *p)
+{
+    return (uint32_t) p[0] | ((uint32_t) p[1] << 8) |
+           ((uint32_t) p[2] << 16) | ((uint32_t) p[3] << 24);
+}
+
+
+/* Return a Python long instance containing the 32-bit MurmurHash3 (x86
+ * variant, with a seed of 0) of the given string. */
+static PyObject *
+murmur3_hash(PyObject *self, PyObject *args)
+{
+    const unsigned char *s;
+    Py_ssize_t len, i;
+    uint32_t h = 0, k;
+
+    if(! PyArg_ParseTuple(args, BUFFERLIKE_FMT, &s, &len))
+        return NULL;
+
+    for(i = 0; i + 4 <= len; i += 4) {
+        k = read_le32(s + i);
+        k *= 0xcc9e2d51U;
+        k = ROTL32(k, 15);
+        k *= 0x1b873593U;
+        h ^= k;
+        h = ROTL32(h, 13);
+        h = (h * 5) + 0xe6546b64U;
+    }
+
+    k = 0;
+    switch(len & 3) {
+    case 3:
+        k ^= (uint32_t) s[i + 2] << 16;
+        /* fall through */
+    case 2:
+        k ^= (uint32_t) s[i + 1] << 8;
+        /* fall through */
+    case 1:
+        k ^= s[i];
+        k *= 0xcc9e2d51U;
+        k = ROTL32(k, 15);
+        k *= 0x1b873593U;
+        h ^= k;
+    }
+
+    h ^= (uint32_t) len;
+    h ^= h >> 16;
+    h *= 0x85ebca6bU;
+    h ^= h >> 13;
+    h *= 0xc2b2ae35U;
+    h ^= h >> 16;
+
+    return PyLong_FromUnsignedLong((unsigned long) h);
+}
+
+
+/* Return a Python long instance containing the 32-bit xxHash (XXH32, with a
+ * seed of 0) of the given string. */
+static PyObject *
+xxh32_hash(PyObject *self, PyObject *args)
+{
+    const unsigned char *s;
+    Py_ssize_t len, i = 0;
+    uint32_t h;
+
+    if(! PyArg_ParseTuple(args, BUFFERLIKE_FMT, &s, &len))
+        return NULL;
+
+    if(len >= 16) {
+        uint32_t v1 = XXH_PRIME32_1 + XXH_PRIME32_2;
+        uint32_t v2 = XXH_PRIME32_2;
+        uint32_t v3 = 0;
+        uint32_t v4 = 0U - XXH_PRIME32_1;
+
+        for(; i + 16 <= len; i += 16) {
+            v1 = ROTL32(v1 + read_le32(s + i) * XXH_PRIME32_2, 13);
+            v1 *= XXH_PRIME32_1;
+            v2 = ROTL32(v2 + read_le32(s + i + 4) * XXH_PRIME32_2, 13);
+            v2 *= XXH_PRIME32_1;
+            v3 = ROTL32(v3 + read_le32(s + i + 8) * XXH_PRIME32_2, 13);
+            v3 *= XXH_PRIME32_1;
+            v4 = ROTL32(v4 + read_le32(s + i + 12) * XXH_PRIME32_2, 13);
+            v4 *= XXH_PRIME32_1;
+        }
+        h = ROTL32(v1, 1) + ROTL32(v2, 7) + ROTL32(v3, 12) + ROTL32(v4, 18);
+    } else {
+        h = XXH_PRIME32_5;
+    }
+
+    h += (uint32_t) len;
+    for(; i + 4 <= len; i += 4)
+        h = ROTL32(h + read_le32(s + i) * XXH_PRIME32_3, 17) * XXH_PRIME32_4;
+    for(; i < len; i++)
+        h = ROTL32(h + s[i] * XXH_PRIME32_5, 11) * XXH_PRIME32_1;
+
+    h ^= h >> 15;
+    h *= XXH_PRIME32_2;
+    h ^= h >> 13;
+    h *= XXH_PRIME32_3;
+    h ^= h >> 16;
+
+    return PyLong_FromUnsignedLong((unsigned long) h);
+}
+
+
+static /*const*/ PyMethodDef module_methods[] = {
+    {"murmur3_hash", murmur3_hash, METH_VARARGS,
+     "Return the 32-bit MurmurHash3 of the given 8-bit string."},
+    {"xxh32_hash", xxh32_hash, METH_VARARGS,
+     "Return the 32-bit xxHash of the given 8-bit string."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef moduledef = {
+    PyModuleDef_HEAD_INIT,
+    "_hashes",
+    NULL,
+    -1,
+    module_methods,
+    NULL,
+    NULL,
+    NULL,
+    NULL
+};
+
+PyMODINIT_FUNC
+MODINIT_NAME(void)
+{
+    PyObject *mod = PyModule_Create(&moduledef);
+
+    MOD_RETURN(mod);
+}
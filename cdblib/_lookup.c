@@ -0,0 +1,100 @@
+#include "_cdb.h"
+
+#define MOD_RETURN(mod) return mod;
+#define MODINIT_NAME PyInit__lookup
+
+
+/* Parse the arguments for get(), gets(), count() or value_length(), and
+ * call probe_tables(). */
+static PyObject *
+probe(PyObject *args, enum probe_mode mode)
+{
+    PyObject *data;
+    PyObject *index;
+    Py_ssize_t pair_size;
+    const char *key;
+    Py_ssize_t key_len;
+    unsigned long long hashed_key;
+
+    if(! PyArg_ParseTuple(args, "OOny#K", &data, &index, &pair_size,
+                          &key, &key_len, &hashed_key))
+        return NULL;
+
+    if(pair_size != 8 && pair_size != 12 && pair_size != 16) {
+        PyErr_SetString(PyExc_ValueError, "pair_size must be 8, 12 or 16");
+        return NULL;
+    }
+
+    return probe_tables(data, index, pair_size, key, key_len, hashed_key,
+                        mode);
+}
+
+
+/* Return the first value for a key, or None if it's missing. */
+static PyObject *
+get(PyObject *self, PyObject *args)
+{
+    return probe(args, PROBE_FIRST);
+}
+
+
+/* Return a list with all of the values for a key. */
+static PyObject *
+gets(PyObject *self, PyObject *args)
+{
+    return probe(args, PROBE_ALL);
+}
+
+
+/* Return the number of values for a key. */
+static PyObject *
+count(PyObject *self, PyObject *args)
+{
+    return probe(args, PROBE_COUNT);
+}
+
+
+/* Return the length of the first value for a key, or None if it's missing. */
+static PyObject *
+value_length(PyObject *self, PyObject *args)
+{
+    return probe(args, PROBE_LENGTH);
+}
+
+
+static /*const*/ PyMethodDef module_methods[] = {
+    {"get", get, METH_VARARGS,
+     "get(data, index, pair_size, key, hashed_key)\n\n"
+     "Return the first value stored for key in data, or None."},
+    {"gets", gets, METH_VARARGS,
+     "gets(data, index, pair_size, key, hashed_key)\n\n"
+     "Return a list of the values stored for key in data."},
+    {"count", count, METH_VARARGS,
+     "count(data, index, pair_size, key, hashed_key)\n\n"
+     "Return the number of values stored for key in data."},
+    {"value_length", value_length, METH_VARARGS,
+     "value_length(data, index, pair_size, key, hashed_key)\n\n"
+     "Return the length of the first value stored for key in data, or "
+     "None."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef moduledef = {
+    PyModuleDef_HEAD_INIT,
+    "_lookup",
+    NULL,
+    -1,
+    module_methods,
+    NULL,
+    NULL,
+    NULL,
+    NULL
+};
+
+PyMODINIT_FUNC
+MODINIT_NAME(void)
+{
+    PyObject *mod = PyModule_Create(&moduledef);
+
+    MOD_RETURN(mod);
+}
@@ -0,0 +1,209 @@
+'''
+Batched lookups for cdblib.Reader instances, vectorized with NumPy. This
+module is only used if NumPy can be imported.
+
+'''
+import numpy as np
+
+from .djb_hash import djb_hash
+
+# Batches smaller than this are faster to look up with the scalar code
+MIN_BATCH_SIZE = 2048
+
+# Keys longer than this are hashed one at a time rather than column by column
+MAX_VECTOR_KEY_LENGTH = 256
+
+
+def _djb_hash_many(keys, lengths):
+    # Compute DJB's hash function for all of the keys at once. The keys are
+    # sorted by length (longest first) so that at each byte position the keys
+    # that are still being hashed are a prefix of the array.
+    order = np.argsort(-lengths, kind='stable')
+    sorted_lengths = lengths[order]
+    offsets = np.zeros(len(keys), dtype=np.int64)
+    np.cumsum(sorted_lengths[:-1], out=offsets[1:])
+    flat = np.frombuffer(b''.join([keys[i] for i in order]), dtype=np.uint8)
+
+    ascending = sorted_lengths[::-1]
+    h = np.full(len(keys), 5381, dtype=np.uint32)
+    for i in range(int(sorted_lengths[0])):
+        active = len(keys) - np.searchsorted(ascending, i, side='right')
+        part = h[:active]
+        h[:active] = ((part << 5) + part) ^ flat[offsets[:active] + i]
+
+    ret = np.empty_like(h)
+    ret[order] = h
+    return ret
+
+
+def _keys_equal(buf, positions, key_flat, key_offsets, key_lengths):
+    # Compare the keys stored at the given positions of buf to the keys
+    # stored in key_flat, without slicing either. The lengths must already
+    # be known to match.
+    total = int(key_lengths.sum())
+    if not total:
+        return np.ones(len(positions), dtype=bool)
+
+    owner = np.repeat(np.arange(len(positions)), key_lengths)
+    starts = np.zeros(len(positions), dtype=np.int64)
+    np.cumsum(key_lengths[:-1], out=starts[1:])
+    within = np.arange(total, dtype=np.int64) - starts[owner]
+
+    stored = buf[positions[owner] + within]
+    wanted = key_flat[key_offsets[owner] + within]
+    mismatches = np.bincount(
+        owner, weights=(stored != wanted), minlength=len(positions)
+    )
+    return mismatches == 0
+
+
+def _widen(raw):
+    # Return the pairs of 48-bit integers in raw (an array of bytes with a row
+    # of 12 for each pair) as 64-bit integers.
+    padded = np.zeros((len(raw), 2, 8), dtype=np.uint8)
+    padded[:, :, :6] = raw.reshape(-1, 2, 6)
+    return padded.view('<u8').reshape(-1, 2)
+
+
+def lookup_many(reader, keys, first):
+    '''Equivalent to cdblib.Reader._lookup_many(), but with the probing done
+    in vectorized form. Returns a list with the encoded version of each key,
+    and a dict mapping each encoded key to its list of values.'''
+    # Encode the keys, collapsing duplicates. With the standard hash function
+    # the hashing is done later, all at once.
+    hash_key = reader.hash_key
+    use_djb = reader.hashfn is djb_hash
+    encoded_keys = []
+    unique = {}
+    hashes = []
+    for key in keys:
+        if use_djb and type(key) is bytes:
+            encoded = key
+        else:
+            encoded, h = hash_key(key)
+        encoded_keys.append(encoded)
+        if encoded not in unique:
+            unique[encoded] = len(unique)
+            if not use_djb:
+                hashes.append(h)
+
+    found = {}
+    if not unique:
+        return encoded_keys, found
+
+    data = reader.data
+    pair_size = reader.pair_size
+    dtype = np.dtype('<u4') if pair_size == 8 else np.dtype('<u8')
+    # 48-bit integers are read as bytes, then widened
+    wide = pair_size == 12
+
+    unique_keys = list(unique)
+    key_lengths = np.fromiter(
+        (len(k) for k in unique_keys), dtype=np.int64, count=len(unique_keys)
+    )
+    key_offsets = np.zeros(len(unique_keys), dtype=np.int64)
+    np.cumsum(key_lengths[:-1], out=key_offsets[1:])
+    key_flat = np.frombuffer(b''.join(unique_keys), dtype=np.uint8)
+
+    if not use_djb:
+        hashes = np.array(hashes, dtype=np.uint32)
+    elif key_lengths.max() <= MAX_VECTOR_KEY_LENGTH:
+        hashes = _djb_hash_many(unique_keys, key_lengths)
+    else:
+        hashes = np.fromiter(
+            (djb_hash(k) for k in unique_keys),
+            dtype=np.uint32,
+            count=len(unique_keys),
+        )
+    hashes = hashes.astype(np.int64)
+
+    # View the file as bytes, and the hash tables as (hash, position) pairs.
+    buf = np.frombuffer(data, dtype=np.uint8)
+    table_start = reader.table_start
+    slot_count = (len(buf) - table_start) // pair_size
+    if wide:
+        tables = np.frombuffer(
+            data, dtype=np.uint8, count=slot_count * pair_size,
+            offset=table_start
+        ).reshape(-1, pair_size)
+    else:
+        tables = np.frombuffer(
+            data, dtype=dtype, count=slot_count * 2, offset=table_start
+        ).reshape(-1, 2)
+    index = np.array(reader.index, dtype=np.int64)
+    index_base = (index[:, 0] - table_start) // pair_size
+    index_len = index[:, 1]
+
+    # "The hash value modulo 256 is the number of a hash table." Keys that
+    # map to an empty table can't be present.
+    table_number = hashes & 0xff
+    table_len = index_len[table_number]
+    active = np.nonzero(table_len)[0]
+    table_len = table_len[active]
+    table_base = index_base[table_number[active]]
+    slot = (hashes[active] >> 8) % table_len
+    steps = np.zeros(len(active), dtype=np.int64)
+    results = {}
+
+    # Probe one slot per key per pass, dropping keys from the active set once
+    # they run into an empty slot (or, in first mode, find a match).
+    byte_offsets = np.arange(pair_size, dtype=np.int64)
+    while len(active):
+        slots = tables[table_base + slot]
+        if wide:
+            slots = _widen(slots)
+        hash_values = slots[:, 0].astype(np.int64)
+        positions = slots[:, 1].astype(np.int64)
+
+        keep = positions != 0
+        candidate = keep & (hash_values == hashes[active])
+        if candidate.any():
+            c_idx = np.nonzero(candidate)[0]
+            c_keys = active[c_idx]
+            c_pos = positions[c_idx]
+
+            header = buf[c_pos[:, np.newaxis] + byte_offsets]
+            if wide:
+                header = _widen(header).astype(np.int64)
+            else:
+                header = header.view(dtype).reshape(-1, 2).astype(np.int64)
+            klen = header[:, 0]
+            vlen = header[:, 1]
+
+            match = klen == key_lengths[c_keys]
+            if match.any():
+                m_idx = np.nonzero(match)[0]
+                match[m_idx] = _keys_equal(
+                    buf,
+                    c_pos[m_idx] + pair_size,
+                    key_flat,
+                    key_offsets[c_keys[m_idx]],
+                    key_lengths[c_keys[m_idx]],
+                )
+
+            value_pos = c_pos + pair_size + klen
+            for k, pos, size in zip(
+                c_keys[match].tolist(),
+                value_pos[match].tolist(),
+                vlen[match].tolist(),
+            ):
+                results.setdefault(k, []).append(data[pos:pos + size])
+
+            if first:
+                keep[c_idx[match]] = False
+
+        # "Probe that slot, the next higher slot, and so on, until you find
+        # the record or run into an empty slot."
+        steps += 1
+        keep &= steps < table_len
+        active = active[keep]
+        table_len = table_len[keep]
+        table_base = table_base[keep]
+        slot = (slot[keep] + 1) % table_len
+        steps = steps[keep]
+
+    del buf, tables
+    for k, values in results.items():
+        found[unique_keys[k]] = values
+
+    return encoded_keys, found
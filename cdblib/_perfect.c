@@ -0,0 +1,415 @@
+#include "_cdb.h"
+
+#define MOD_RETURN(mod) return mod;
+#define MODINIT_NAME PyInit__perfect
+
+
+/* Equivalent to cdblib.perfect.perfect_hashes(): set the bucket for the
+ * 32-bit hash h, and the two values that its slot is computed from. */
+static void
+perfect_hashes(unsigned long long h, unsigned long long seed,
+               unsigned long long bucket_count,
+               unsigned long long slot_count, unsigned long long *bucket,
+               unsigned long long *f1, unsigned long long *f2)
+{
+    uint64_t z, w;
+
+    z = (uint64_t) ((seed << 32) | (h & 0xffffffffULL));
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    z ^= z >> 31;
+    w = z * 0x9e3779b97f4a7c15ULL;
+
+    *bucket = ((z & 0xffffffffULL) * bucket_count) >> 32;
+    *f1 = ((z >> 32) * slot_count) >> 32;
+    *f2 = ((w >> 32) * slot_count) >> 32;
+}
+
+
+/* Like probe_tables(), but start with the slot that the minimal perfect hash
+ * function stored by cdblib.perfect.PerfectWriter (in the trailer section at
+ * offset) picks for the key. Only keys whose hash is shared by several
+ * records need the hash tables to be searched. */
+static PyObject *
+perfect_probe(PyObject *args, enum probe_mode mode)
+{
+    PyObject *data;
+    PyObject *index;
+    Py_ssize_t pair_size, half;
+    const char *key;
+    Py_ssize_t key_len;
+    unsigned long long hashed_key, offset;
+    unsigned long long seed, bucket_count, slot_count;
+    unsigned long long displacements_pos, slots_pos, bitmap_pos;
+    unsigned long long bucket, f1, f2, d0, d1, slot, pos;
+    unsigned long long byte_pos, key_size, value_size;
+    const unsigned char *buf;
+    Py_buffer view;
+    PyObject *value;
+    PyObject *result;
+    int shared;
+
+    if(! PyArg_ParseTuple(args, "OOny#KK", &data, &index, &pair_size,
+                          &key, &key_len, &hashed_key, &offset))
+        return NULL;
+
+    if(pair_size != 8 && pair_size != 12 && pair_size != 16) {
+        PyErr_SetString(PyExc_ValueError, "pair_size must be 8, 12 or 16");
+        return NULL;
+    }
+    half = pair_size / 2;
+
+    if(PyObject_GetBuffer(data, &view, PyBUF_SIMPLE) < 0)
+        return NULL;
+    buf = (const unsigned char *) view.buf;
+
+    /* The section starts with the seed, bucket count and slot count, then
+     * the displacements, slots and bitmap. */
+    if(offset + 12 > (unsigned long long) view.len)
+        goto corrupt;
+    seed = read_le(buf + offset, 4);
+    bucket_count = read_le(buf + offset + 4, 4);
+    slot_count = read_le(buf + offset + 8, 4);
+    if(! slot_count) {
+        PyBuffer_Release(&view);
+        goto missing;
+    }
+    displacements_pos = offset + 12;
+    slots_pos = displacements_pos + (bucket_count * 8);
+    bitmap_pos = slots_pos + (slot_count * pair_size);
+
+    /* Find the slot from the bucket's displacements. */
+    perfect_hashes(hashed_key, seed, bucket_count, slot_count, &bucket, &f1,
+                   &f2);
+    pos = displacements_pos + (bucket * 8);
+    if(pos + 8 > (unsigned long long) view.len)
+        goto corrupt;
+    d0 = read_le(buf + pos, 4);
+    d1 = read_le(buf + pos + 4, 4);
+    slot = (f1 + (((d0 % slot_count) * f2) % slot_count) + d1) % slot_count;
+
+    /* Missing keys usually stop here, without reading a record. */
+    pos = slots_pos + (slot * pair_size);
+    if(pos + pair_size > (unsigned long long) view.len ||
+       bitmap_pos + (slot >> 3) >= (unsigned long long) view.len)
+        goto corrupt;
+    if(read_le(buf + pos, half) != hashed_key) {
+        PyBuffer_Release(&view);
+        goto missing;
+    }
+    byte_pos = read_le(buf + pos + half, half);
+    shared = buf[bitmap_pos + (slot >> 3)] & (1 << (slot & 7));
+
+    if(byte_pos + pair_size > (unsigned long long) view.len)
+        goto corrupt;
+    key_size = read_le(buf + byte_pos, half);
+    value_size = read_le(buf + byte_pos + half, half);
+    byte_pos += pair_size;
+    if(key_size > (unsigned long long) view.len - byte_pos ||
+       value_size > (unsigned long long) view.len - byte_pos - key_size)
+        goto corrupt;
+
+    if(key_size != (unsigned long long) key_len ||
+       memcmp(buf + byte_pos, key, (size_t) key_len) != 0) {
+        PyBuffer_Release(&view);
+        if(shared)
+            /* A different key with the same hash */
+            return probe_tables(data, index, pair_size, key, key_len,
+                                hashed_key, mode);
+        goto missing;
+    }
+    byte_pos += key_size;
+
+    if(shared && (mode == PROBE_ALL || mode == PROBE_COUNT)) {
+        /* The key may have more values */
+        PyBuffer_Release(&view);
+        return probe_tables(data, index, pair_size, key, key_len, hashed_key,
+                            mode);
+    }
+
+    if(mode == PROBE_COUNT) {
+        PyBuffer_Release(&view);
+        return PyLong_FromLong(1);
+    }
+    if(mode == PROBE_LENGTH) {
+        PyBuffer_Release(&view);
+        return PyLong_FromUnsignedLongLong(value_size);
+    }
+    value = value_at(data, buf, byte_pos, value_size);
+    PyBuffer_Release(&view);
+    if(value == NULL || mode == PROBE_FIRST)
+        return value;
+    result = PyList_New(1);
+    if(result == NULL) {
+        Py_DECREF(value);
+        return NULL;
+    }
+    PyList_SET_ITEM(result, 0, value);
+    return result;
+
+missing:
+    if(mode == PROBE_ALL)
+        return PyList_New(0);
+    if(mode == PROBE_COUNT)
+        return PyLong_FromLong(0);
+    Py_RETURN_NONE;
+
+corrupt:
+    PyBuffer_Release(&view);
+    PyErr_SetString(PyExc_OSError, "CDB corrupt");
+    return NULL;
+}
+
+
+/* perfect_probe() versions of get(), gets(), count() and value_length(). */
+static PyObject *
+perfect_get(PyObject *self, PyObject *args)
+{
+    return perfect_probe(args, PROBE_FIRST);
+}
+
+static PyObject *
+perfect_gets(PyObject *self, PyObject *args)
+{
+    return perfect_probe(args, PROBE_ALL);
+}
+
+static PyObject *
+perfect_count(PyObject *self, PyObject *args)
+{
+    return perfect_probe(args, PROBE_COUNT);
+}
+
+static PyObject *
+perfect_value_length(PyObject *self, PyObject *args)
+{
+    return perfect_probe(args, PROBE_LENGTH);
+}
+
+
+/* Return the first free slot in taken (which has n slots) at or after start,
+ * wrapping around to the beginning. There must be one. */
+static Py_ssize_t
+next_free(const unsigned char *taken, Py_ssize_t n, Py_ssize_t start)
+{
+    const unsigned char *p = memchr(taken + start, 0, (size_t) (n - start));
+
+    if(p == NULL)
+        p = memchr(taken, 0, (size_t) n);
+    return p - taken;
+}
+
+
+/* Equivalent to the Python code in cdblib.perfect._displace(): try to build
+ * a minimal perfect hash function with the given seed and bucket count for
+ * the distinct hashes (a buffer of native-endian 32-bit integers). Return a
+ * tuple of the displacements for each bucket and the index of the hash that
+ * each slot holds, as buffers of native-endian 32-bit integers, or None if a
+ * bucket couldn't be placed with fewer than max_displacement first
+ * displacements. */
+static PyObject *
+perfect_displace(PyObject *self, PyObject *args)
+{
+    Py_buffer hashes;
+    unsigned long long seed;
+    Py_ssize_t bucket_count, max_displacement, n, i, b, k, size, max_size;
+    unsigned long long bucket, h, d0, d0_limit;
+    uint32_t *f1 = NULL, *f2 = NULL, *members = NULL, *order;
+    Py_ssize_t *sizes = NULL, *starts = NULL;
+    unsigned long long *positions = NULL;
+    unsigned char *taken = NULL;
+    uint32_t *result_buf;
+    PyObject *result = NULL, *order_bytes = NULL, *ret = NULL;
+
+    if(! PyArg_ParseTuple(args, "y*Knn", &hashes, &seed, &bucket_count,
+                          &max_displacement))
+        return NULL;
+
+    n = hashes.len / 4;
+    if((hashes.len % 4) || ! n || n > 0xffffffffLL || bucket_count <= 0 ||
+       bucket_count > n) {
+        PyBuffer_Release(&hashes);
+        PyErr_SetString(PyExc_ValueError, "invalid perfect hash parameters");
+        return NULL;
+    }
+
+    f1 = PyMem_Malloc(n * sizeof(uint32_t));
+    f2 = PyMem_Malloc(n * sizeof(uint32_t));
+    members = PyMem_Malloc(n * sizeof(uint32_t));
+    sizes = PyMem_Calloc(bucket_count, sizeof(Py_ssize_t));
+    starts = PyMem_Malloc(bucket_count * sizeof(Py_ssize_t));
+    taken = PyMem_Calloc(n, 1);
+    result = PyBytes_FromStringAndSize(NULL, bucket_count * 8);
+    order_bytes = PyBytes_FromStringAndSize(NULL, n * 4);
+    if(f1 == NULL || f2 == NULL || members == NULL || sizes == NULL ||
+       starts == NULL || taken == NULL || result == NULL ||
+       order_bytes == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    result_buf = (uint32_t *) PyBytes_AS_STRING(result);
+    order = (uint32_t *) PyBytes_AS_STRING(order_bytes);
+    memset(result_buf, 0, (size_t) (bucket_count * 8));
+
+    /* Group the hashes by bucket, keeping them in order. */
+    for(i = 0; i < n; i++) {
+        unsigned long long a, c;
+
+        h = read_native((const unsigned char *) hashes.buf + (i * 4), 4);
+        perfect_hashes(h, seed, bucket_count, n, &bucket, &a, &c);
+        f1[i] = (uint32_t) a;
+        f2[i] = (uint32_t) c;
+        members[i] = (uint32_t) bucket;
+        sizes[bucket]++;
+    }
+    max_size = 0;
+    for(b = 0, k = 0; b < bucket_count; b++) {
+        starts[b] = k;
+        k += sizes[b];
+        if(sizes[b] > max_size)
+            max_size = sizes[b];
+    }
+    {
+        uint32_t *grouped = PyMem_Malloc(n * sizeof(uint32_t));
+        Py_ssize_t *fill = PyMem_Malloc(bucket_count * sizeof(Py_ssize_t));
+
+        if(grouped == NULL || fill == NULL) {
+            PyMem_Free(grouped);
+            PyMem_Free(fill);
+            PyErr_NoMemory();
+            goto done;
+        }
+        memcpy(fill, starts, bucket_count * sizeof(Py_ssize_t));
+        for(i = 0; i < n; i++)
+            grouped[fill[members[i]]++] = (uint32_t) i;
+        PyMem_Free(members);
+        PyMem_Free(fill);
+        members = grouped;
+    }
+    positions = PyMem_Malloc(max_size * sizeof(unsigned long long));
+    if(positions == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    /* Place the biggest buckets first, in order. */
+    d0_limit = ((unsigned long long) n < (unsigned long long) max_displacement)
+               ? (unsigned long long) n : (unsigned long long) max_displacement;
+    for(size = max_size; size > 0; size--) {
+        for(b = 0; b < bucket_count; b++) {
+            const uint32_t *bucket_members = members + starts[b];
+            Py_ssize_t first, free_slot, start, j;
+            unsigned long long shift = 0;
+            int placed = 0;
+
+            if(sizes[b] != size)
+                continue;
+
+            for(d0 = 0; d0 < d0_limit && ! placed; d0++) {
+                int distinct = 1;
+
+                for(k = 0; k < size; k++) {
+                    i = bucket_members[k];
+                    positions[k] = (f1[i] + (d0 * f2[i])) % n;
+                    for(j = 0; j < k; j++)
+                        if(positions[j] == positions[k])
+                            distinct = 0;
+                }
+                if(! distinct)
+                    continue;
+
+                /* Line up the first hash with each free slot in turn. */
+                first = (Py_ssize_t) positions[0];
+                free_slot = start = next_free(taken, n, first);
+                do {
+                    shift = (unsigned long long) (free_slot + n - first);
+                    for(k = 1; k < size; k++)
+                        if(taken[(positions[k] + shift) % n])
+                            break;
+                    if(k == size) {
+                        placed = 1;
+                        break;
+                    }
+                    free_slot = (free_slot + 1 < n)
+                                ? next_free(taken, n, free_slot + 1)
+                                : next_free(taken, n, 0);
+                } while(free_slot != start);
+            }
+            if(! placed) {
+                ret = Py_None;
+                Py_INCREF(ret);
+                goto done;
+            }
+
+            result_buf[2 * b] = (uint32_t) (d0 - 1);
+            result_buf[(2 * b) + 1] = (uint32_t) (shift % n);
+            for(k = 0; k < size; k++) {
+                Py_ssize_t p = (Py_ssize_t) ((positions[k] + shift) % n);
+
+                taken[p] = 1;
+                order[p] = bucket_members[k];
+            }
+        }
+    }
+
+    ret = PyTuple_Pack(2, result, order_bytes);
+
+done:
+    PyBuffer_Release(&hashes);
+    PyMem_Free(f1);
+    PyMem_Free(f2);
+    PyMem_Free(members);
+    PyMem_Free(sizes);
+    PyMem_Free(starts);
+    PyMem_Free(positions);
+    PyMem_Free(taken);
+    Py_XDECREF(result);
+    Py_XDECREF(order_bytes);
+    return ret;
+}
+
+
+static /*const*/ PyMethodDef module_methods[] = {
+    {"get", perfect_get, METH_VARARGS,
+     "get(data, index, pair_size, key, hashed_key, offset)\n\n"
+     "Like _lookup.get(), using the minimal perfect hash function "
+     "stored at offset."},
+    {"gets", perfect_gets, METH_VARARGS,
+     "gets(data, index, pair_size, key, hashed_key, offset)\n\n"
+     "Like _lookup.gets(), using the minimal perfect hash function "
+     "stored at offset."},
+    {"count", perfect_count, METH_VARARGS,
+     "count(data, index, pair_size, key, hashed_key, offset)\n\n"
+     "Like _lookup.count(), using the minimal perfect hash function "
+     "stored at offset."},
+    {"value_length", perfect_value_length, METH_VARARGS,
+     "value_length(data, index, pair_size, key, hashed_key, "
+     "offset)\n\n"
+     "Like _lookup.value_length(), using the minimal perfect hash function "
+     "stored at offset."},
+    {"displace", perfect_displace, METH_VARARGS,
+     "displace(hashes, seed, bucket_count, max_displacement)\n\n"
+     "Try to build a minimal perfect hash function for the hashes, an array "
+     "of distinct 32-bit integers."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef moduledef = {
+    PyModuleDef_HEAD_INIT,
+    "_perfect",
+    NULL,
+    -1,
+    module_methods,
+    NULL,
+    NULL,
+    NULL,
+    NULL
+};
+
+PyMODINIT_FUNC
+MODINIT_NAME(void)
+{
+    PyObject *mod = PyModule_Create(&moduledef);
+
+    MOD_RETURN(mod);
+}
@@ -0,0 +1,107 @@
+#include "_cdb.h"
+
+#define MOD_RETURN(mod) return mod;
+#define MODINIT_NAME PyInit__tables
+
+
+/* Equivalent to the Python code in cdblib.Writer._build_table(): place the
+ * pairs (a buffer of native-endian integers, with hashes and positions
+ * alternating) in a table with length slots using linear probing, and return
+ * the packed table. The integers are 4 bytes wide when pair_size is 8, and 8
+ * bytes wide otherwise. As in that code, a slot whose position is 0 counts as
+ * empty. */
+static PyObject *
+build_table(PyObject *self, PyObject *args)
+{
+    Py_buffer pairs;
+    PyObject *result;
+    Py_ssize_t length, pair_size, half, width, n, i;
+    unsigned long long h, pos, slot, k;
+    const unsigned char *src;
+    unsigned char *buf;
+
+    if(! PyArg_ParseTuple(args, "y*nn", &pairs, &length, &pair_size))
+        return NULL;
+
+    if(pair_size != 8 && pair_size != 12 && pair_size != 16) {
+        PyBuffer_Release(&pairs);
+        PyErr_SetString(PyExc_ValueError, "pair_size must be 8, 12 or 16");
+        return NULL;
+    }
+    half = pair_size / 2;
+    width = (pair_size == 8) ? 4 : 8;
+
+    if(pairs.len % (2 * width)) {
+        PyBuffer_Release(&pairs);
+        PyErr_SetString(PyExc_ValueError,
+                        "pairs must hold whole (hash, position) pairs");
+        return NULL;
+    }
+    n = pairs.len / (2 * width);
+    /* There must be more slots than pairs, so that every pair fits. */
+    if(length < 0 || (n && length <= n) ||
+       length > PY_SSIZE_T_MAX / pair_size) {
+        PyBuffer_Release(&pairs);
+        PyErr_SetString(PyExc_ValueError, "invalid table length");
+        return NULL;
+    }
+
+    result = PyBytes_FromStringAndSize(NULL, length * pair_size);
+    if(result == NULL) {
+        PyBuffer_Release(&pairs);
+        return NULL;
+    }
+    buf = (unsigned char *) PyBytes_AS_STRING(result);
+    memset(buf, 0, (size_t) (length * pair_size));
+
+    src = (const unsigned char *) pairs.buf;
+    for(i = 0; i < n; i++, src += 2 * width) {
+        h = read_native(src, width);
+        pos = read_native(src + width, width);
+
+        slot = (h >> 8) % (unsigned long long) length;
+        for(k = 0; k < (unsigned long long) length; k++) {
+            unsigned char *p = buf + (slot * pair_size);
+
+            if(! read_le(p + half, half)) {
+                write_le(p, h, half);
+                write_le(p + half, pos, half);
+                break;
+            }
+            if(++slot == (unsigned long long) length)
+                slot = 0;
+        }
+    }
+
+    PyBuffer_Release(&pairs);
+    return result;
+}
+
+
+static /*const*/ PyMethodDef module_methods[] = {
+    {"build_table", build_table, METH_VARARGS,
+     "build_table(pairs, length, pair_size)\n\n"
+     "Return a packed hash table with length slots holding the pairs, an "
+     "array of alternating hashes and positions."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef moduledef = {
+    PyModuleDef_HEAD_INIT,
+    "_tables",
+    NULL,
+    -1,
+    module_methods,
+    NULL,
+    NULL,
+    NULL,
+    NULL
+};
+
+PyMODINIT_FUNC
+MODINIT_NAME(void)
+{
+    PyObject *mod = PyModule_Create(&moduledef);
+
+    MOD_RETURN(mod);
+}
@@ -0,0 +1,115 @@
+'''
+A blocked Bloom filter for rejecting missing keys without touching a
+database's hash tables. Each key maps to a single 512-bit (64-byte) block,
+so checking a key reads one cache line.
+
+'''
+from math import ceil, log
+from struct import Struct
+from zlib import crc32
+
+BLOCK_BITS = 512
+BLOCK_BYTES = BLOCK_BITS // 8
+
+# Serialized form: number of bits set per key, number of blocks, the blocks
+header = Struct('<LL')
+
+_MASK_64 = 0xffffffffffffffff
+
+
+def key_hash(key, hashed_key):
+    '''Return the 64-bit value that the Bloom filter uses for key. It's
+    derived from the key's cdb hash (hashed_key) and its CRC-32, mixed with
+    the splitmix64 finalizer.'''
+    z = (crc32(key) << 32) | hashed_key
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & _MASK_64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & _MASK_64
+    return z ^ (z >> 31)
+
+
+def _positions(block_count, k, h):
+    # Yield the bit positions for the key with the 64-bit hash h. The low bits
+    # pick the block, and the high bits are used for double hashing within it.
+    base = (h % block_count) * BLOCK_BITS
+    a = h >> 32
+    b = (h >> 41) | 1
+    for i in range(k):
+        yield base + ((a + i * b) & (BLOCK_BITS - 1))
+
+
+def might_contain(bits, block_count, k, h):
+    '''Return False if the key with the 64-bit hash h (from key_hash()) is
+    definitely not in the filter with the given parameters, and True if it
+    may be.'''
+    for pos in _positions(block_count, k, h):
+        if not bits[pos >> 3] & (1 << (pos & 7)):
+            return False
+    return True
+
+
+def might_contain_key(bits, block_count, k, key, hashed_key):
+    '''Like might_contain(), but takes the key and its cdb hash.'''
+    return might_contain(bits, block_count, k, key_hash(key, hashed_key))
+
+
+# If the C Extension is available, use it
+try:
+    from ._bloom import might_contain_key  # noqa
+except ImportError:
+    pass
+
+
+class BloomFilter(object):
+    '''A blocked Bloom filter. Use for_capacity() to create an empty one, and
+    from_bytes() to load a serialized one.'''
+
+    def __init__(self, bits, block_count, k):
+        self.bits = bits
+        self.block_count = block_count
+        self.k = k
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate):
+        '''Create an empty filter sized for capacity keys and a false positive
+        rate of about fp_rate.'''
+        if not (0 < fp_rate < 1):
+            raise ValueError('fp_rate must be between 0 and 1')
+
+        # Standard Bloom filter sizing, plus some extra room because blocked
+        # filters are a bit less accurate.
+        bits_per_key = -log(fp_rate) / (log(2) ** 2)
+        k = max(1, min(16, int(round(bits_per_key * log(2)))))
+        total_bits = max(1, capacity) * bits_per_key * 1.1
+        block_count = max(1, int(ceil(total_bits / BLOCK_BITS)))
+        return cls(bytearray(block_count * BLOCK_BYTES), block_count, k)
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''Load a filter serialized with to_bytes().'''
+        k, block_count = header.unpack(data[:header.size])
+        bits = bytes(data[header.size:header.size + block_count * BLOCK_BYTES])
+        if not k or len(bits) != block_count * BLOCK_BYTES:
+            raise ValueError('invalid Bloom filter')
+        return cls(bits, block_count, k)
+
+    def to_bytes(self):
+        '''Return the serialized form of the filter.'''
+        return header.pack(self.k, self.block_count) + bytes(self.bits)
+
+    def add(self, h):
+        '''Add the key with the 64-bit hash h (from key_hash()).'''
+        bits = self.bits
+        for pos in _positions(self.block_count, self.k, h):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def might_contain(self, h):
+        '''Return False if the key with the 64-bit hash h (from key_hash())
+        was definitely not added to the filter, and True if it may have
+        been.'''
+        return might_contain(self.bits, self.block_count, self.k, h)
+
+    def might_contain_key(self, key, hashed_key):
+        '''Like might_contain(), but takes the key and its cdb hash.'''
+        return might_contain_key(
+            self.bits, self.block_count, self.k, key, hashed_key
+        )
@@ -0,0 +1,199 @@
+'''
+A caching layer for cdblib.Reader instances, for workloads where a small
+number of keys account for most of the lookups.
+
+'''
+from collections import OrderedDict
+
+from .reloading import ReloadingReader
+
+# Cached marker for keys that aren't in the database
+_MISSING = object()
+
+
+class CachedReader(object):
+    '''Wraps a Reader (or Reader64) instance and remembers the results of the
+    most recently used lookups, including lookups for missing keys. At most
+    cache_size results are kept; the least recently used one is evicted to
+    make room for a new one.
+
+    The get(), get_many(), gets(), getint(), getints(), getstring() and
+    getstrings() methods are cached, including the conversion to int or str.
+    Everything else is passed through to the wrapped reader. Keys that can't
+    be hashed by Python are looked up without the cache.
+
+    If the wrapped reader is a ReloadingReader, the cache is cleared whenever
+    it switches to a new version of its file.'''
+
+    def __init__(self, reader, cache_size=1024):
+        if cache_size < 1:
+            raise ValueError('cache_size must be at least 1')
+        self.reader = reader
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache = OrderedDict()
+
+        # The number of reloads that the cached results are from, for
+        # ReloadingReader instances
+        self._reloads = None
+        if isinstance(reader, ReloadingReader):
+            self._reloads = reader.reloads
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Clear the cache and close the wrapped reader.'''
+        self.cache_clear()
+        self.reader.close()
+
+    def cache_clear(self):
+        '''Remove everything from the cache. The counters are not reset.'''
+        self._cache.clear()
+
+    def _check_reloads(self):
+        # Clear the cache if the wrapped ReloadingReader has switched to a new
+        # version of its file (checking for one first, if it's time to).
+        reader = self.reader
+        reader.current()
+        if reader.reloads != self._reloads:
+            self._reloads = reader.reloads
+            self._cache.clear()
+
+    def _lookup(self, cache_key, compute):
+        # Return the cached result for cache_key, calling compute() to fill
+        # it in if it's not present.
+        if self._reloads is not None:
+            self._check_reloads()
+        cache = self._cache
+        try:
+            result = cache[cache_key]
+        except (KeyError, TypeError):
+            result = compute()
+            self._store(cache_key, result)
+        else:
+            self.hits += 1
+            cache.move_to_end(cache_key)
+        return result
+
+    def _store(self, cache_key, result):
+        # Add a result to the cache, evicting the least recently used one if
+        # it's full.
+        self.misses += 1
+        cache = self._cache
+        try:
+            cache[cache_key] = result
+        except TypeError:
+            # Unhashable key - skip the cache
+            return
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+            self.evictions += 1
+
+    def __getitem__(self, key):
+        '''Like dict.__getitem__().'''
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def has_key(self, key):
+        '''Return True if key exists in the database.'''
+        return self.get(key) is not None
+    __contains__ = contains = has_key
+
+    def __iter__(self):
+        '''Like Reader.__iter__().'''
+        return iter(self.reader)
+
+    def __len__(self):
+        '''Like Reader.__len__().'''
+        return len(self.reader)
+
+    def get(self, key, default=None):
+        '''Get the first value for key, returning default if missing.'''
+        value = self._lookup(
+            ('get', key), lambda: self.reader.get(key, _MISSING)
+        )
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, default=None):
+        '''Like Reader.get_many(). Keys that aren't in the cache are looked up
+        together in one batch.'''
+        if self._reloads is not None:
+            self._check_reloads()
+        cache = self._cache
+        keys = list(keys)
+        results = []
+        missing = {}
+        for i, key in enumerate(keys):
+            cache_key = ('get', key)
+            try:
+                value = cache[cache_key]
+            except (KeyError, TypeError):
+                missing[i] = key
+                value = None
+            else:
+                self.hits += 1
+                cache.move_to_end(cache_key)
+            results.append(value)
+
+        if missing:
+            values = self.reader.get_many(missing.values(), _MISSING)
+            for i, value in zip(missing, values):
+                results[i] = value
+                self._store(('get', keys[i]), value)
+
+        return [default if v is _MISSING else v for v in results]
+
+    def gets(self, key):
+        '''Return an iterator over the values for key in insertion order.'''
+        return iter(
+            self._lookup(('gets', key), lambda: tuple(self.reader.gets(key)))
+        )
+
+    def getint(self, key, default=None, base=0):
+        '''Get the first value for key converted it to an int, returning
+        default if missing.'''
+        value = self._lookup(
+            ('getint', key, base),
+            lambda: self.reader.getint(key, _MISSING, base),
+        )
+        return default if value is _MISSING else value
+
+    def getints(self, key, base=0):
+        '''Return an iterator over the values for key in insertion order
+        after converting to int.'''
+        return iter(
+            self._lookup(
+                ('getints', key, base),
+                lambda: tuple(self.reader.getints(key, base)),
+            )
+        )
+
+    def getstring(self, key, default=None, encoding='utf-8'):
+        '''Get the first value for key decoded as unicode, returning default if
+        not found.'''
+        value = self._lookup(
+            ('getstring', key, encoding),
+            lambda: self.reader.getstring(key, _MISSING, encoding),
+        )
+        return default if value is _MISSING else value
+
+    def getstrings(self, key, encoding='utf-8'):
+        '''Return an iterator over the values for key in insertion order
+        after decoding as unicode.'''
+        return iter(
+            self._lookup(
+                ('getstrings', key, encoding),
+                lambda: tuple(self.reader.getstrings(key, encoding)),
+            )
+        )
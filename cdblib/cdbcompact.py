@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+
+import cdblib
+from cdblib.layered import compact
+
+
+def cdbcompact(parsed_args):
+    # Merge the layers into the temporary file, then replace the destination
+    # with it.
+    if parsed_args['64']:
+        reader_cls, writer_cls = cdblib.Reader64, cdblib.Writer64
+    else:
+        reader_cls, writer_cls = cdblib.Reader, cdblib.Writer
+
+    layers = cdblib.LayeredReader.from_file_paths(
+        parsed_args['layers'], reader_cls=reader_cls
+    )
+    with layers:
+        with open(parsed_args['cdb.tmp'], 'wb') as tmpfile:
+            compact(layers, tmpfile, writer_cls=writer_cls)
+
+    os.rename(parsed_args['cdb.tmp'], parsed_args['cdb'])
+
+
+def main(args=None):
+    args = sys.argv[1:] if (args is None) else args
+    parser = argparse.ArgumentParser(
+        description=(
+            'Merge a base database and the delta databases layered over it '
+            'into one database, applying deletions.'
+        )
+    )
+    parser.add_argument(
+        '-64', action='store_true', help='Use non-standard 64-bit file offsets'
+    )
+    parser.add_argument(
+        'cdb',
+        help=(
+            'Ultimate destination path for the merged database. '
+            'This path is not overwritten until the cdb.tmp file is '
+            'finalized, so it may be the same as one of the layers.'
+        ),
+    )
+    parser.add_argument(
+        'cdb.tmp',
+        help=(
+            'Temporary path to use for creating the merged database. '
+            'It must be on the same filesystem as the cdb file.'
+        ),
+    )
+    parser.add_argument(
+        'layers',
+        nargs='+',
+        help='Paths of the base database and then its deltas, oldest first.',
+    )
+
+    parsed_args = vars(parser.parse_args(args))
+    cdbcompact(parsed_args)
+
+
+if __name__ == '__main__':
+    main()
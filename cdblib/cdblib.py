@@ -5,20 +5,122 @@ that efficiently handle many keys, while remaining space-efficient.
     http://cr.yp.to/cdb.html
 
 '''
+from array import array
 from struct import Struct
-from itertools import chain
-from mmap import ACCESS_READ, mmap
-
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import accumulate, chain, islice, repeat, zip_longest
+from json import dumps as json_dumps, loads as json_loads
+from math import ceil
+from mmap import ACCESS_READ, PAGESIZE, mmap
+from operator import add
+from multiprocessing import Pool, cpu_count
+import mmap as mmap_module
+from random import Random
+from shutil import copyfileobj
+from sys import byteorder
+from tempfile import TemporaryFile
+from zlib import crc32
+
+from .bloom import BloomFilter, key_hash as bloom_key_hash
 from .djb_hash import djb_hash
+from .hashes import get_hash_function, hash_function_name
+from .pread import PreadFile
+
+# If the C Extension is available, use it for lookups
+try:
+    from . import _lookup
+except ImportError:
+    _lookup = None
+
+# If the C Extension is available, use it to build the hash tables
+try:
+    from . import _tables
+except ImportError:
+    _tables = None
+
+# If NumPy is available, use it for large batches of lookups
+try:
+    from . import _numpy_engine
+except ImportError:
+    _numpy_engine = None
 
 # Structs for 32-bit databases
 read_2_le4 = Struct('<LL').unpack
+read_2_le4_from = Struct('<LL').unpack_from
 write_2_le4 = Struct('<LL').pack
 
+# array typecode for unsigned 32-bit integers
+UINT32_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
 # Structs for 64-bit databases
 read_2_le8 = Struct('<QQ').unpack
+read_2_le8_from = Struct('<QQ').unpack_from
 write_2_le8 = Struct('<QQ').pack
 
+# 48-bit integers don't have a struct format, so they're split into a 32-bit
+# low part and a 16-bit high part.
+_le6_pair = Struct('<LHLH')
+
+
+def read_2_le6(data):
+    a_low, a_high, b_low, b_high = _le6_pair.unpack(data)
+    return a_low | (a_high << 32), b_low | (b_high << 32)
+
+
+def read_2_le6_from(data, offset=0):
+    a_low, a_high, b_low, b_high = _le6_pair.unpack_from(data, offset)
+    return a_low | (a_high << 32), b_low | (b_high << 32)
+
+
+def write_2_le6(a, b):
+    return _le6_pair.pack(a & 0xffffffff, a >> 32, b & 0xffffffff, b >> 32)
+
+
+# Optional sections stored after the hash tables, which other cdb tools ignore.
+# The sections are followed by a directory of (tag, offset, length) entries,
+# then by the number of entries and a magic string.
+TRAILER_MAGIC = b'pure-cdb'
+trailer_entry = Struct('<4sQQ')
+trailer_footer = Struct('<L8s')
+
+# Default size of Writer's buffer for records, in bytes
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# Default fraction of Writer's hash table slots to fill, as cdbmake does
+DEFAULT_LOAD_FACTOR = 0.5
+
+# Number of records that Writer.put_many() handles at a time (at most)
+PUT_MANY_CHUNK_SIZE = 4096
+
+# Padding for the shorter iterable passed to Writer.put_many_columns()
+_COLUMN_END = object()
+
+# Number of hash table slots to sample per partition in Reader.partitions(),
+# and in total
+PARTITION_SAMPLES = 4096
+MAX_PARTITION_SAMPLES = 1 << 18
+
+# Trailer section tags
+BLOOM_TAG = b'BLOM'
+TOMBSTONE_TAG = b'TOMB'
+METADATA_TAG = b'META'
+HASH_TAG = b'HASH'
+PERFECT_TAG = b'PERF'
+
+# Access patterns for Reader.advise(). mmap.madvise() and its constants aren't
+# available on every platform (or before Python 3.8).
+ADVICE = {
+    name: getattr(mmap_module, constant)
+    for name, constant in (
+        ('normal', 'MADV_NORMAL'),
+        ('random', 'MADV_RANDOM'),
+        ('sequential', 'MADV_SEQUENTIAL'),
+        ('willneed', 'MADV_WILLNEED'),
+    )
+    if hasattr(mmap_module, constant)
+}
+
 # Encoders for keys
 DEFAULT_ENCODERS = {
     str: lambda x: x.encode('utf-8'),
@@ -27,7 +129,12 @@ DEFAULT_ENCODERS = {
 
 
 class _CDBBase(object):
-    def __init__(self, hashfn=djb_hash, strict=False, encoders=None):
+    def __init__(self, hashfn=None, strict=False, encoders=None):
+        # hashfn may be one of the built-in hash functions' names
+        if hashfn is None:
+            hashfn = djb_hash
+        elif isinstance(hashfn, str):
+            hashfn = get_hash_function(hashfn)
         self.hashfn = hashfn
 
         if strict:
@@ -68,11 +175,34 @@ class Reader(_CDBBase):
     through a string or string-like sequence, such as mmap.mmap().'''
 
     read_pair = staticmethod(read_2_le4)
+    read_pair_from = staticmethod(read_2_le4_from)
     pair_size = 8
-
-    def __init__(self, data=None, file_path=None, file_obj=None, **kwargs):
+    table_typecode = UINT32_TYPECODE
+    zero_copy = False
+    file_path = None
+    backend = 'mmap'
+    cache_blocks = 256
+
+    def __init__(self, data=None, file_path=None, file_obj=None,
+                 zero_copy=False, bloom=True, advice=None, prefault=None,
+                 backend='mmap', cache_blocks=256, **kwargs):
         '''Create an instance reading from a sequence and using hashfn to hash
-        keys.'''
+        keys. If zero_copy is True, keys and values are returned as memoryview
+        slices of the data rather than as bytes. If bloom is True and the
+        database has a Bloom filter, it's loaded and used to reject missing
+        keys. If advice is given, it's passed to advise(), and if prefault is
+        given, it's passed to warm().
+
+        Files are memory-mapped if backend is 'mmap'. If it's 'pread', they're
+        read with os.pread() instead, and up to cache_blocks blocks of the hash
+        tables are cached.'''
+        if backend not in ('mmap', 'pread'):
+            raise ValueError("backend must be 'mmap' or 'pread'")
+        if zero_copy and (backend == 'pread'):
+            raise ValueError("zero_copy requires the 'mmap' backend")
+        self.backend = backend
+        self.cache_blocks = cache_blocks
+
         if data is not None:
             if len(data) < (self.pair_size * 256):
                 raise IOError('CDB too small')
@@ -80,22 +210,232 @@ class Reader(_CDBBase):
             self.file_obj = None
             self.mmap_obj = None
         elif file_path is not None:
+            self.file_path = file_path
             self.file_obj = open(file_path, 'rb')
-            self.data = mmap(self.file_obj.fileno(), 0, access=ACCESS_READ)
+            self.data = self._open_file(backend, cache_blocks)
         elif file_obj is not None:
+            name = getattr(file_obj, 'name', None)
+            if isinstance(name, str):
+                self.file_path = name
             self.file_obj = file_obj
-            self.data = mmap(self.file_obj.fileno(), 0, access=ACCESS_READ)
+            self.data = self._open_file(backend, cache_blocks)
         else:
             raise TypeError('No source data given')
 
+        if zero_copy:
+            self.zero_copy = True
+            self._source = self.data
+            self.data = memoryview(self.data)
+
         self.index = [self.read_pair(self.data[i:i+self.pair_size])
                       for i in range(0, 256*self.pair_size, self.pair_size)]
         self.table_start = min(p[0] for p in self.index)
-        # Assume load load factor is 0.5 like official CDB.
-        self.length = sum(p[1] >> 1 for p in self.index)
+        if isinstance(self.data, PreadFile):
+            # Only cache the hash tables and trailer sections, not records
+            self.data.cache_from = self.table_start
+
+        self._sections = self._read_trailer()
+        self.bloom = None
+        if bloom and BLOOM_TAG in self._sections:
+            self.bloom = BloomFilter.from_bytes(self._section(BLOOM_TAG))
+        self.tombstones = frozenset(self._read_tombstones())
+        self.metadata = self._read_metadata()
+
+        # The number of records is recorded in the metadata, or counted from
+        # the hash tables when it's first needed.
+        self._length = None
+        if self.metadata is not None:
+            self._length = self.metadata.get('records')
+
+        # The C and NumPy lookup code, and the fast scanning code, need data
+        # that supports the buffer protocol.
+        self._buffer = True
+        self._c_lookup = _lookup
+        self._numpy_engine = _numpy_engine
+        try:
+            memoryview(self.data).release()
+        except TypeError:
+            self._buffer = False
+            self._c_lookup = self._numpy_engine = None
 
+        try:
+            kwargs['hashfn'] = self._check_hash_function(kwargs.get('hashfn'))
+        except ValueError:
+            self.close()
+            raise
         super(Reader, self).__init__(**kwargs)
 
+        if advice is not None:
+            self.advise(advice)
+        if prefault is not None:
+            self.warm(prefault)
+
+    def _open_file(self, backend, cache_blocks):
+        # Return a sequence for reading self.file_obj with the given backend.
+        if backend == 'pread':
+            return PreadFile(self.file_obj.fileno(), cache_blocks)
+        return mmap(self.file_obj.fileno(), 0, access=ACCESS_READ)
+
+    def _check_hash_function(self, hashfn):
+        # Return the hash function to read the database with. Databases
+        # written with one of the other built-in hash functions record its
+        # name, which is used unless hashfn is given, in which case it must
+        # match.
+        if HASH_TAG not in self._sections:
+            return hashfn
+        name = bytes(self._section(HASH_TAG)).decode('ascii', 'replace')
+        stored = get_hash_function(name)
+        if hashfn is None:
+            return stored
+        if isinstance(hashfn, str):
+            hashfn = get_hash_function(hashfn)
+        if hashfn is not stored:
+            raise ValueError(
+                'database was written with the {!r} hash function'.format(name)
+            )
+        return hashfn
+
+    def _read_trailer(self):
+        # Return a dict mapping the tags of the database's trailer sections
+        # to their (offset, length). Databases without a valid trailer have
+        # no sections.
+        data = self.data
+        size = len(data)
+        table_end = max(p[0] + (p[1] * self.pair_size) for p in self.index)
+        if size - table_end < trailer_footer.size:
+            return {}
+
+        count, magic = trailer_footer.unpack(
+            data[size - trailer_footer.size:size]
+        )
+        directory_pos = size - trailer_footer.size - (
+            count * trailer_entry.size
+        )
+        if (magic != TRAILER_MAGIC) or (directory_pos < table_end):
+            return {}
+
+        sections = {}
+        for pos in range(directory_pos, directory_pos + (
+            count * trailer_entry.size
+        ), trailer_entry.size):
+            tag, offset, length = trailer_entry.unpack(
+                data[pos:pos + trailer_entry.size]
+            )
+            if (offset < table_end) or (offset + length > directory_pos):
+                return {}
+            sections[tag] = (offset, length)
+
+        return sections
+
+    def _section(self, tag):
+        # Return the contents of a trailer section.
+        offset, length = self._sections[tag]
+        return self.data[offset:offset + length]
+
+    def _read_tombstones(self):
+        # Yield the keys that were deleted with Writer.delete(). Each one is
+        # stored like a record with an empty value.
+        if TOMBSTONE_TAG not in self._sections:
+            return
+        data = bytes(self._section(TOMBSTONE_TAG))
+        pos = 0
+        while pos < len(data):
+            key_size, value_size = self.read_pair_from(data, pos)
+            pos += self.pair_size
+            yield data[pos:pos + key_size]
+            pos += key_size
+
+    def _read_metadata(self):
+        # Return the dict that Writer stores when metadata=True, or None if
+        # there isn't one.
+        if METADATA_TAG not in self._sections:
+            return None
+        try:
+            metadata = json_loads(bytes(self._section(METADATA_TAG)))
+        except ValueError:
+            return None
+        return metadata if isinstance(metadata, dict) else None
+
+    def _count_records(self):
+        # Return the number of occupied hash table slots. Hashes can be 0, so
+        # slots are told apart by their record positions, which can't be.
+        count = 0
+        for pos, length in self.index:
+            if length:
+                table = array(self.table_typecode, bytes(
+                    self.data[pos:pos + (length * self.pair_size)]
+                ))
+                positions = table[1::2]
+                count += len(positions) - positions.count(0)
+        return count
+
+    @property
+    def length(self):
+        '''The number of records in the database.'''
+        if self._length is None:
+            self._length = self._count_records()
+        return self._length
+
+    def _rejected(self, key, hashed_key):
+        # Return True if the Bloom filter shows that key isn't present.
+        return not self.bloom.might_contain_key(key, hashed_key)
+
+    def _region(self, region):
+        # Return the (start, end) offsets of a region of the database:
+        # 'tables' is the hash tables and trailer sections, and 'all' is the
+        # whole database. The header is always read when the Reader is
+        # created, so it doesn't need to be included.
+        if region == 'all':
+            return 0, len(self.data)
+        if region == 'tables':
+            return self.table_start, len(self.data)
+        raise ValueError("region must be 'tables' or 'all'")
+
+    def _madvise(self, option, start, end):
+        # Give advice to the kernel about a range of the memory map. This does
+        # nothing if the data isn't memory-mapped, or if the platform doesn't
+        # support madvise().
+        source = self._source if self.zero_copy else self.data
+        if not isinstance(source, mmap) or not hasattr(source, 'madvise'):
+            return False
+        start -= start % PAGESIZE
+        if end > start:
+            source.madvise(option, start, end - start)
+        return True
+
+    def advise(self, advice):
+        '''Tell the kernel how the memory-mapped database will be accessed:
+        'random' for point lookups, 'sequential' for scans with iteritems(),
+        or 'normal' for the default behavior. Returns True if the advice was
+        applied, and False if the data isn't memory-mapped or the platform
+        doesn't support it.'''
+        if advice not in ('normal', 'random', 'sequential'):
+            raise ValueError(
+                "advice must be 'normal', 'random', or 'sequential'"
+            )
+        if advice not in ADVICE:
+            return False
+        return self._madvise(ADVICE[advice], 0, len(self.data))
+
+    def warm(self, region='tables'):
+        '''Load a region of the database into memory ahead of time, so that
+        lookups don't wait on page faults: 'tables' for the hash tables and
+        trailer sections (such as the Bloom filter), or 'all' for the whole
+        database.'''
+        start, end = self._region(region)
+        if 'willneed' in ADVICE:
+            self._madvise(ADVICE['willneed'], start, end)
+
+        # Touch one byte per page to fault it in, starting from a page
+        # boundary so that the last page isn't skipped.
+        start -= start % PAGESIZE
+        try:
+            with memoryview(self.data) as view:
+                bytes(view[start:end:PAGESIZE])
+        except TypeError:
+            for pos in range(start, end, PAGESIZE):
+                self.data[pos]
+
     @classmethod
     def from_bytes(cls, data, **kwargs):
         return cls(data=data, **kwargs)
@@ -123,25 +463,163 @@ class Reader(_CDBBase):
         except Exception:
             pass
 
+        # In zero_copy mode, release our own view first. The mmap can only be
+        # closed once every view handed out has been released too - until
+        # then those views stay valid and keep the mapping alive.
         try:
-            self.data.close()
+            if self.zero_copy:
+                self.data.release()
+                self._source.close()
+            else:
+                self.data.close()
         except Exception:
             pass
 
     def iteritems(self):
         '''Like dict.iteritems(). Items are returned in insertion order.'''
-        pos = self.pair_size * 256
-        while pos < self.table_start:
-            klen, dlen = self.read_pair(self.data[pos:pos+self.pair_size])
-            pos += self.pair_size
-
-            key = self.data[pos:pos+klen]
-            pos += klen
-
-            data = self.data[pos:pos+dlen]
-            pos += dlen
-
-            yield key, data
+        return self._iteritems()
+
+    def _pair_reader(self):
+        # Return a function that reads the integer pair at a position in the
+        # data, like read_pair_from() but also for data without the buffer
+        # protocol.
+        if self._buffer:
+            return self.read_pair_from
+        read_pair = self.read_pair
+        pair_size = self.pair_size
+
+        def read_pair_from(data, pos):
+            return read_pair(data[pos:pos + pair_size])
+        return read_pair_from
+
+    def _iteritems(self, partition=None):
+        # Yield the (key, value) tuples of the records (or of the records in
+        # a partition) one at a time, so that only one value is read at once.
+        data = self.data
+        pair_size = self.pair_size
+        read_pair_from = self._pair_reader()
+        if partition is None:
+            pos, end = pair_size * 256, self.table_start
+        else:
+            pos, end = partition
+        while pos < end:
+            klen, dlen = read_pair_from(data, pos)
+            pos += pair_size
+            key_end = pos + klen
+            pos = key_end + dlen
+            yield data[key_end - klen:key_end], data[key_end:pos]
+
+    def iter_batches(self, n=1024, keys_only=False, partition=None):
+        '''Return an iterator over lists of up to n (key, value) tuples, in
+        insertion order. If keys_only is True, the lists hold just the keys,
+        and the values aren't read at all. If partition is given, only the
+        records in that (start, end) range from partitions() are read.'''
+        if n < 1:
+            raise ValueError('n must be at least 1')
+
+        data = self.data
+        pair_size = self.pair_size
+        read_pair_from = self._pair_reader()
+        if partition is None:
+            pos, end = pair_size * 256, self.table_start
+        else:
+            pos, end = partition
+        while pos < end:
+            batch = []
+            append = batch.append
+            if keys_only:
+                for i in repeat(None, n):
+                    klen, dlen = read_pair_from(data, pos)
+                    pos += pair_size
+                    append(data[pos:pos + klen])
+                    pos += klen + dlen
+                    if pos >= end:
+                        break
+            else:
+                for i in repeat(None, n):
+                    klen, dlen = read_pair_from(data, pos)
+                    pos += pair_size
+                    key_end = pos + klen
+                    pos = key_end + dlen
+                    append((data[key_end - klen:key_end], data[key_end:pos]))
+                    if pos >= end:
+                        break
+            yield batch
+
+    def partitions(self, n):
+        '''Split the records into at most n (start, end) byte ranges with
+        roughly the same number of records in each, for use with
+        iter_batches(). The ranges are in insertion order.'''
+        if n < 1:
+            raise ValueError('n must be at least 1')
+
+        pair_size = self.pair_size
+        start = pair_size * 256
+        end = self.table_start
+        if start >= end:
+            return []
+
+        # Every slot in the hash tables holds the position of a record (or
+        # zero), so a sample of them gives record boundaries to split on.
+        # Slots are picked at random: a regular stride can line up with
+        # patterns in the hash values of similar keys.
+        data = self.data
+        table_ends = list(accumulate(p[1] for p in self.index))
+        total_slots = table_ends[-1]
+        sample = set()
+        for i in Random(total_slots).sample(
+            range(total_slots),
+            min(total_slots, PARTITION_SAMPLES * n, MAX_PARTITION_SAMPLES),
+        ):
+            table = bisect_right(table_ends, i)
+            table_pos, table_len = self.index[table]
+            slot_pos = table_pos + (
+                (i - table_ends[table] + table_len) * pair_size
+            )
+            byte_pos = self.read_pair(data[slot_pos:slot_pos + pair_size])[1]
+            if byte_pos:
+                sample.add(byte_pos)
+
+        if not sample:
+            return [(start, end)]
+
+        sample = sorted(sample)
+        boundaries = sorted({
+            sample[(i * len(sample)) // n] for i in range(1, n)
+        } - {start})
+        starts = [start] + boundaries
+        return list(zip(starts, boundaries + [end]))
+
+    def parallel_map(self, func, processes=None, keys_only=False):
+        '''Split the records into partitions, and call func with an iterator
+        over the (key, value) tuples (or just the keys, if keys_only is True)
+        of each one, using a pool of worker processes. Returns a list of the
+        results in insertion order.
+
+        Each worker opens the database by its path (with the same backend,
+        cache_blocks and zero_copy options), so the Reader must have been
+        created from one, and func must be picklable. processes defaults to
+        the number of CPUs.'''
+        file_path = self.file_path
+        if file_path is None:
+            raise ValueError('parallel_map requires a file path')
+        if processes is None:
+            processes = cpu_count()
+
+        options = {
+            'backend': self.backend,
+            'cache_blocks': self.cache_blocks,
+            'zero_copy': self.zero_copy,
+        }
+        tasks = [
+            (type(self), file_path, options, func, keys_only, partition)
+            for partition in self.partitions(processes)
+        ]
+        if processes == 1:
+            return [_map_partition(task) for task in tasks]
+
+        with Pool(processes) as pool:
+            return pool.map(_map_partition, tasks, chunksize=1)
 
     def items(self):
         '''Like dict.items().'''
@@ -149,7 +627,7 @@ class Reader(_CDBBase):
 
     def iterkeys(self):
         '''Like dict.iterkeys().'''
-        return (p[0] for p in self.iteritems())
+        return chain.from_iterable(self.iter_batches(keys_only=True))
     __iter__ = iterkeys
 
     def itervalues(self):
@@ -158,7 +636,7 @@ class Reader(_CDBBase):
 
     def keys(self):
         '''Like dict.keys().'''
-        return [p[0] for p in self.iteritems()]
+        return list(self.iterkeys())
 
     def values(self):
         '''Like dict.values().'''
@@ -173,8 +651,8 @@ class Reader(_CDBBase):
 
     def has_key(self, key):
         '''Return True if key exists in the database.'''
-        return self.get(key) is not None
-    __contains__ = has_key
+        return self.value_length(key) is not None
+    __contains__ = contains = has_key
 
     def __len__(self):
         '''Return the number of records in the database.'''
@@ -186,6 +664,28 @@ class Reader(_CDBBase):
         # "Compute the hash value of the key in the record."
         key, hashed_key = self.hash_key(key)
 
+        if self.bloom is not None and self._rejected(key, hashed_key):
+            return iter(())
+
+        if self._c_lookup is not None:
+            return iter(
+                self._c_lookup.gets(
+                    self.data, self.index, self.pair_size, key, hashed_key
+                )
+            )
+
+        return self._gets(key, hashed_key)
+
+    def _gets(self, key, hashed_key):
+        data = self.data
+        for pos, size in self._find(key, hashed_key):
+            yield data[pos:pos + size]
+
+    def _find(self, key, hashed_key):
+        # Yield the position and size of each value for key. Values are never
+        # read, and candidate keys are only read if their length matches.
+        key_len = len(key)
+
         # "The hash value modulo 256 is the number of a hash table."
         slot_number, table_number = divmod(hashed_key, 256)
         table_pos, table_len = self.index[table_number]
@@ -222,13 +722,10 @@ class Reader(_CDBBase):
                 )
                 byte_pos += self.pair_size
 
-                candidate_key = self.data[byte_pos:byte_pos+key_size]
-                byte_pos += key_size
-
-                candidate_value = self.data[byte_pos:byte_pos+value_size]
-                byte_pos += value_size
-                if candidate_key == key:
-                    yield candidate_value
+                if key_size == key_len and (
+                    self.data[byte_pos:byte_pos + key_size] == key
+                ):
+                    yield byte_pos + key_size, value_size
 
             # If we've not run into an empty slot yet, we're not finished.
             # To go to the "next higher slot," we jump to the table's start.
@@ -237,33 +734,191 @@ class Reader(_CDBBase):
 
     def get(self, key, default=None):
         '''Get the first value for key, returning default if missing.'''
+        key, hashed_key = self.hash_key(key)
+
+        if self.bloom is not None and self._rejected(key, hashed_key):
+            return default
+
+        if self._c_lookup is not None:
+            value = self._c_lookup.get(
+                self.data, self.index, self.pair_size, key, hashed_key
+            )
+            return default if value is None else value
+
         # Avoid exception catch when handling default case; much faster.
-        return next(chain(self.gets(key), (default,)))
+        return next(chain(self._gets(key, hashed_key), (default,)))
+
+    def count(self, key):
+        '''Return the number of values stored for key, without reading
+        them.'''
+        key, hashed_key = self.hash_key(key)
+
+        if self.bloom is not None and self._rejected(key, hashed_key):
+            return 0
+
+        if self._c_lookup is not None:
+            return self._c_lookup.count(
+                self.data, self.index, self.pair_size, key, hashed_key
+            )
+
+        return sum(1 for p in self._find(key, hashed_key))
+
+    def value_length(self, key, default=None):
+        '''Return the length of the first value for key without reading it,
+        returning default if missing.'''
+        key, hashed_key = self.hash_key(key)
+
+        if self.bloom is not None and self._rejected(key, hashed_key):
+            return default
+
+        if self._c_lookup is not None:
+            length = self._c_lookup.value_length(
+                self.data, self.index, self.pair_size, key, hashed_key
+            )
+            return default if length is None else length
+
+        for pos, size in self._find(key, hashed_key):
+            return size
+        return default
+
+    def _lookup_many(self, keys, first):
+        # Batched version of gets(). Returns a list with the encoded version
+        # of each key, and a dict mapping each encoded key to its values. If
+        # first is True, only the first value for each key is collected.
+        numpy_engine = self._numpy_engine
+        if numpy_engine is not None:
+            keys = list(keys)
+            if len(keys) >= numpy_engine.MIN_BATCH_SIZE:
+                return numpy_engine.lookup_many(self, keys, first)
+
+        hash_key = self.hash_key
+        index = self.index
+        data = self.data
+        read_pair = self.read_pair
+        pair_size = self.pair_size
+
+        # Hash every key up front, and work out where its probe starts.
+        # Duplicate keys are only looked up once.
+        encoded_keys = []
+        probes = {}
+        bloom = self.bloom
+        for key in keys:
+            key, hashed_key = hash_key(key)
+            encoded_keys.append(key)
+            if key in probes:
+                continue
+
+            if bloom is not None and self._rejected(key, hashed_key):
+                continue
+
+            table_pos, table_len = index[hashed_key & 0xff]
+            if not table_len:
+                continue
+
+            slot_pos = table_pos + (
+                pair_size * ((hashed_key >> 8) % table_len)
+            )
+            probes[key] = (slot_pos, hashed_key, table_pos, table_len)
+
+        # Visit the probes in file offset order, which groups them by hash
+        # table and keeps access to the underlying data mostly sequential.
+        found = {}
+        c_lookup = self._c_lookup
+        for key, probe in sorted(probes.items(), key=lambda x: x[1][0]):
+            slot_pos, hashed_key, table_pos, table_len = probe
+            if c_lookup is not None:
+                args = (data, index, pair_size, key, hashed_key)
+                if first:
+                    value = c_lookup.get(*args)
+                    values = [] if value is None else [value]
+                else:
+                    values = c_lookup.gets(*args)
+                if values:
+                    found[key] = values
+                continue
+
+            table_end = table_pos + (pair_size * table_len)
+            values = []
+            while True:
+                hash_value, byte_pos = read_pair(
+                    data[slot_pos:slot_pos + pair_size]
+                )
+                slot_pos += pair_size
+
+                if not byte_pos:
+                    break
+
+                if hash_value == hashed_key:
+                    key_size, value_size = read_pair(
+                        data[byte_pos:byte_pos + pair_size]
+                    )
+                    byte_pos += pair_size
+                    if key_size == len(key) and (
+                        data[byte_pos:byte_pos + key_size] == key
+                    ):
+                        byte_pos += key_size
+                        values.append(data[byte_pos:byte_pos + value_size])
+                        if first:
+                            break
+
+                if slot_pos == table_end:
+                    slot_pos = table_pos
+
+            if values:
+                found[key] = values
+
+        return encoded_keys, found
+
+    def gets_many(self, keys):
+        '''Return a list with one list of values (in insertion order) for
+        each of the given keys, in the same order as keys. This is faster
+        than calling gets() in a loop.'''
+        encoded_keys, found = self._lookup_many(keys, False)
+        return [list(found.get(key, ())) for key in encoded_keys]
+
+    def get_many(self, keys, default=None):
+        '''Return a list with the first value for each of the given keys, in
+        the same order as keys. default is used for missing keys.'''
+        encoded_keys, found = self._lookup_many(keys, True)
+        default = [default]
+        return [found.get(key, default)[0] for key in encoded_keys]
 
     def getint(self, key, default=None, base=0):
         '''Get the first value for key converted it to an int, returning
         default if missing.'''
         value = self.get(key, default)
         if value is not default:
-            return int(value, base)
+            # bytes() is a no-op for bytes, but is needed for memoryviews.
+            return int(bytes(value), base)
         return value
 
     def getints(self, key, base=0):
         '''Yield values for key in insertion order after converting to int.'''
-        return (int(v, base) for v in self.gets(key))
+        return (int(bytes(v), base) for v in self.gets(key))
 
     def getstring(self, key, default=None, encoding='utf-8'):
         '''Get the first value for key decoded as unicode, returning default if
         not found.'''
         value = self.get(key, default)
         if value is not default:
-            return value.decode(encoding)
+            return str(value, encoding)
         return value
 
     def getstrings(self, key, encoding='utf-8'):
         '''Yield values for key in insertion order after decoding as
         unicode.'''
-        return (v.decode(encoding) for v in self.gets(key))
+        return (str(v, encoding) for v in self.gets(key))
+
+
+def _map_partition(task):
+    # Run func over one partition of a database, for Reader.parallel_map().
+    reader_cls, file_path, options, func, keys_only, partition = task
+    with reader_cls.from_file_path(file_path, **options) as reader:
+        if not keys_only:
+            return func(reader._iteritems(partition))
+        return func(chain.from_iterable(
+            reader.iter_batches(keys_only=True, partition=partition)
+        ))
 
 
 class Reader64(Reader):
@@ -272,22 +927,107 @@ class Reader64(Reader):
     writer.'''
 
     read_pair = staticmethod(read_2_le8)
+    read_pair_from = staticmethod(read_2_le8_from)
     pair_size = 16
+    table_typecode = 'Q'
+
+
+class Reader48(Reader):
+    '''A cdblib.Reader variant to support reading from CDB files that use
+    48-bit file offsets, which must be generated with Writer48.'''
+
+    read_pair = staticmethod(read_2_le6)
+    read_pair_from = staticmethod(read_2_le6_from)
+    pair_size = 12
+
+    def _count_records(self):
+        # Like Reader._count_records(), but arrays can't hold 48-bit integers.
+        # Instead, each byte of the positions is gathered for all of the slots
+        # at once, and OR-ing them together leaves a zero for each empty slot.
+        count = 0
+        for pos, length in self.index:
+            if length:
+                table = memoryview(bytes(self.data[pos:pos + (length * 12)]))
+                occupied = 0
+                for i in range(6, 12):
+                    occupied |= int.from_bytes(table[i::12], 'little')
+                count += length - occupied.to_bytes(length, 'little').count(0)
+        return count
+
+
+def _all_bytes(objs):
+    # Return True if every item in objs is a bytes object.
+    return all(issubclass(t, bytes) for t in set(map(type, objs)))
 
 
 class Writer(_CDBBase):
     '''Object for building new Constant Databases, and writing them to a
     seekable file-like object.'''
 
+    read_pair = staticmethod(read_2_le4)
     write_pair = staticmethod(write_2_le4)
     pair_size = 8
+    table_typecode = UINT32_TYPECODE
 
-    def __init__(self, fp, **kwargs):
+    def __init__(self, fp, bloom_fp_rate=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                 spill=False, spill_dir=None, metadata=False,
+                 load_factor=DEFAULT_LOAD_FACTOR, **kwargs):
         '''Create an instance writing to a file-like object, using hashfn to
-        hash keys.'''
+        hash keys. If bloom_fp_rate is given, a Bloom filter with about that
+        false positive rate is stored after the hash tables. If metadata is
+        True, the numbers of records and unique keys are stored there too,
+        with some statistics about the database (see Reader.metadata). The
+        count of unique keys is exact if fp is readable.
+        Records are collected in memory and written in chunks of about
+        buffer_size bytes.
+
+        load_factor is the fraction of each hash table's slots that are
+        filled. Higher values make smaller hash tables, but lookups have to
+        probe more slots.
+
+        If spill is True, hash table entries are also written out to
+        temporary files (in spill_dir, or the default temporary directory)
+        along with the records, and read back one table at a time by
+        finalize(), for databases with too many keys to keep in memory.'''
+        if buffer_size < 0:
+            raise ValueError('buffer_size must not be negative')
+        self.buffer_size = buffer_size
+        if not (0 < load_factor < 1):
+            raise ValueError('load_factor must be between 0 and 1')
+        self.load_factor = load_factor
+        self.spill = spill
+        self.spill_dir = spill_dir
+
         self.fp = fp
         fp.write(b'\x00' * (256 * self.pair_size))
-        self._unordered = [[] for i in range(256)]
+
+        # Records waiting to be written, which start at _buffer_pos. The
+        # position is tracked here rather than by asking fp.
+        self._buffer = bytearray()
+        self._pos = self._buffer_pos = fp.tell()
+
+        # Hash table entries for each table, stored as alternating hashes and
+        # positions so they take about as much memory as they will on disk.
+        self._unordered = [array(self.table_typecode) for i in range(256)]
+
+        # The CRC-32 of each entry's key, for counting the unique keys in each
+        # table, if metadata is wanted
+        self._key_crcs = None
+        if metadata:
+            self._key_crcs = [array(UINT32_TYPECODE) for i in range(256)]
+
+        # Bloom filter hashes for each record, if a filter is wanted
+        if (bloom_fp_rate is not None) and not (0 < bloom_fp_rate < 1):
+            raise ValueError('bloom_fp_rate must be between 0 and 1')
+        self.bloom_fp_rate = bloom_fp_rate
+        self._bloom_hashes = None if bloom_fp_rate is None else array('Q')
+
+        # Temporary files for each of the _pending() arrays, which are created
+        # when they're first needed.
+        self._spill_files = [None] * len(self._pending()) if spill else None
+
+        # Keys passed to delete()
+        self._tombstones = []
 
         super(Writer, self).__init__(**kwargs)
 
@@ -303,15 +1043,233 @@ class Writer(_CDBBase):
         if not isinstance(value, bytes):
             raise TypeError('value must be of type bytes')
 
-        # Computing the hash for the key also ensures that it's binary
+        # Computing the hash for the key usually ensures that it's binary, but
+        # not with every hash function or encoder.
         key, h = self.hash_key(key)
+        if not isinstance(key, bytes):
+            raise TypeError('key must be of type bytes')
+
+        pos = self._pos
+        tbl = self._unordered[h & 0xff]
+        tbl.append(h)
+        tbl.append(pos)
+
+        value_len = len(value)
+        self._pos = end = pos + self.pair_size + len(key) + value_len
+        buffer = self._buffer
+        buffer += self.write_pair(len(key), value_len)
+        buffer += key
+        if value_len < self.buffer_size:
+            buffer += value
+            if end - self._buffer_pos >= self.buffer_size:
+                self._flush()
+        else:
+            # Large values are written directly rather than copied
+            self._flush()
+            self.fp.write(value)
+
+        if self._key_crcs is not None:
+            self._key_crcs[h & 0xff].append(crc32(key))
+        if self._bloom_hashes is not None:
+            self._bloom_hashes.append(bloom_key_hash(key, h))
+
+    def put_many(self, items):
+        '''Write (key, value) pairs from an iterable to the output file.
+        Equivalent to calling put() in a loop, but faster: records are checked,
+        encoded, hashed and written in batches.'''
+        items = iter(items)
+        limit = self.buffer_size
+        while True:
+            # Chunks end early once their values add up to buffer_size, so
+            # that large values aren't all held in memory at once.
+            keys = []
+            values = []
+            size = 0
+            for key, value in islice(items, PUT_MANY_CHUNK_SIZE):
+                keys.append(key)
+                values.append(value)
+                try:
+                    size += len(value)
+                except TypeError:
+                    # put() will reject the value
+                    pass
+                if size >= limit:
+                    break
+            if not keys:
+                break
+            self._put_chunk(keys, values)
 
-        pos = self.fp.tell()
-        self.fp.write(self.write_pair(len(key), len(value)))
-        self.fp.write(key)
-        self.fp.write(value)
+    def put_many_columns(self, keys, values):
+        '''Like put_many(), but takes the keys and values as separate
+        iterables, which must be the same length.'''
+        try:
+            same_length = len(keys) == len(values)
+        except TypeError:
+            # Iterators are checked as they're read
+            self.put_many(self._columns(keys, values))
+            return
+        if not same_length:
+            raise ValueError('keys and values must be the same length')
+        self.put_many(zip(keys, values))
+
+    @staticmethod
+    def _columns(keys, values):
+        # Yield (key, value) pairs for put_many_columns(), raising ValueError
+        # if one of the iterables runs out before the other.
+        for key, value in zip_longest(keys, values, fillvalue=_COLUMN_END):
+            if key is _COLUMN_END or value is _COLUMN_END:
+                raise ValueError('keys and values must be the same length')
+            yield key, value
+
+    def _put_chunk(self, keys, values):
+        # Write a batch of records for put_many(). Batches with anything
+        # unusual in them - including anything that will cause an error - are
+        # handed to put(), so that the results are exactly the same.
+        try:
+            if not _all_bytes(values) or (
+                max(map(len, values)) >= self.buffer_size
+            ):
+                raise TypeError
+            if _all_bytes(keys):
+                encoded = keys
+            elif self.hash_key == self.hash_key_strict:
+                raise TypeError
+            else:
+                encoders = self.encoders
+                encoded = [
+                    k if isinstance(k, bytes) else encoders[type(k)](k)
+                    for k in keys
+                ]
+                if not _all_bytes(encoded):
+                    raise TypeError
+            hashes = list(map(self.hashfn, encoded))
+            if hash_function_name(self.hashfn) is None:
+                # Truncate to 32 bits and remove sign.
+                hashes = [h & 0xffffffff for h in hashes]
+        except Exception:
+            for key, value in zip(keys, values):
+                self.put(key, value)
+            return
 
-        self._unordered[h & 0xff].append((h, pos))
+        # Work out where each record starts (and where the last one ends).
+        key_lens = list(map(len, encoded))
+        value_lens = list(map(len, values))
+        positions = list(accumulate(chain((self._pos,), map(
+            add, map(add, key_lens, value_lens), repeat(self.pair_size)
+        ))))
+
+        unordered = self._unordered
+        key_crcs = self._key_crcs
+        if key_crcs is None:
+            for h, record_pos in zip(hashes, positions[:-1]):
+                tbl = unordered[h & 0xff]
+                tbl.append(h)
+                tbl.append(record_pos)
+        else:
+            for h, record_pos, crc in zip(
+                hashes, positions[:-1], map(crc32, encoded)
+            ):
+                i = h & 0xff
+                tbl = unordered[i]
+                tbl.append(h)
+                tbl.append(record_pos)
+                key_crcs[i].append(crc)
+        if self._bloom_hashes is not None:
+            self._bloom_hashes.extend(map(bloom_key_hash, encoded, hashes))
+
+        # Pack the records into the buffer, flushing it wherever put() would,
+        # so that it holds about buffer_size bytes at most.
+        parts = list(chain.from_iterable(zip(
+            map(self.write_pair, key_lens, value_lens), encoded, values
+        )))
+        count = len(encoded)
+        start = 0
+        while start < count:
+            end = min(count, bisect_left(
+                positions, self._buffer_pos + self.buffer_size, start + 1
+            ))
+            self._buffer += b''.join(parts[3 * start:3 * end])
+            self._pos = positions[end]
+            if self._pos - self._buffer_pos >= self.buffer_size:
+                self._flush()
+            start = end
+
+    def _flush(self):
+        # Write out any buffered records, and spill the hash table entries if
+        # that's wanted. Each entry is no bigger than its record's header, so
+        # they never take much more memory than the buffer does.
+        if self._buffer:
+            self.fp.write(self._buffer)
+            self._buffer.clear()
+        self._buffer_pos = self._pos
+        if self._spill_files is not None:
+            self._spill()
+
+    def _pending(self):
+        # Return the arrays of values collected for finalize(): the entries
+        # for each hash table, then any key CRCs for each table, then any
+        # Bloom filter hashes.
+        arrays = list(self._unordered)
+        if self._key_crcs is not None:
+            arrays.extend(self._key_crcs)
+        if self._bloom_hashes is not None:
+            arrays.append(self._bloom_hashes)
+        return arrays
+
+    def _spill(self):
+        # Move the pending values to the ends of their temporary files.
+        spill_files = self._spill_files
+        for i, values in enumerate(self._pending()):
+            if values:
+                if spill_files[i] is None:
+                    spill_files[i] = TemporaryFile(dir=self.spill_dir)
+                values.tofile(spill_files[i])
+                del values[:]
+
+    def _unspill(self, i, typecode, chunk_size=-1):
+        # Yield arrays of the values in temporary file i, reading chunk_size
+        # bytes at a time (or everything at once).
+        f = self._spill_files[i]
+        if f is None:
+            return
+        f.seek(0)
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            values = array(typecode)
+            values.frombytes(data)
+            yield values
+
+    def _append_records(self, fp, start, arrays):
+        # Copy the records from offset start to the end of the file-like object
+        # fp, along with the values that another writer collected for them
+        # (like _pending(), with positions in fp). This is used to join up the
+        # parts of a database that were written in parallel.
+        self._flush()
+        fp.seek(start)
+        copyfileobj(fp, self.fp, DEFAULT_BUFFER_SIZE)
+
+        shift = self._pos - start
+        typecode = self.table_typecode
+        for i, (values, new_values) in enumerate(zip(self._pending(), arrays)):
+            if i < 256:
+                new_values[1::2] = array(
+                    typecode, map(add, new_values[1::2], repeat(shift))
+                )
+            values.extend(new_values)
+
+        self._pos = fp.tell() + shift
+        self._flush()
+
+    def delete(self, key):
+        '''Record that key has been deleted. This doesn't affect the records
+        in this database, but when it's used as a layer of a LayeredReader,
+        it hides the key's records in the layers below.'''
+        key, h = self.hash_key(key)
+        if not isinstance(key, bytes):
+            raise TypeError('key must be of type bytes')
+        self._tombstones.append(key)
 
     def puts(self, key, values):
         '''Write more than one value for the same key to the output file.
@@ -342,30 +1300,198 @@ class Writer(_CDBBase):
     def finalize(self):
         '''Write the final hash tables to the output file, and write out its
         index. The output file remains open upon return.'''
+        self._flush()
+        record_bytes = self._pos - (256 * self.pair_size)
         index = []
-        for tbl in self._unordered:
-            length = len(tbl) * 2
-            ordered = [(0, 0)] * length
-            for pair in tbl:
-                where = (pair[0] >> 8) % length
-                for i in chain(range(where, length), range(0, where)):
-                    if not ordered[i][0]:
-                        ordered[i] = pair
-                        break
-
-            index.append((self.fp.tell(), length))
-            for pair in ordered:
-                self.fp.write(self.write_pair(*pair))
+        records = unique_keys = 0
+        for i, tbl in enumerate(self._unordered):
+            if self._spill_files is not None:
+                # Everything has been spilled, and the file is read at once
+                tbl = next(self._unspill(i, self.table_typecode), tbl)
+
+            if self._key_crcs is not None:
+                key_crcs = self._key_crcs[i]
+                if self._spill_files is not None:
+                    key_crcs = next(
+                        self._unspill(256 + i, UINT32_TYPECODE), key_crcs
+                    )
+                unique_keys += self._count_unique_keys(tbl, key_crcs)
+
+            records += len(tbl) // 2
+            length = self._table_length(len(tbl) // 2)
+            table = self._build_table(tbl, length)
+            index.append((self._pos, length))
+            self.fp.write(table)
+            self._pos += len(table)
+
+        metadata = None
+        if self._key_crcs is not None:
+            lengths = [length for pos, length in index]
+            metadata = {
+                'records': records,
+                'unique_keys': unique_keys,
+                'tombstones': len(self._tombstones),
+                'hash': hash_function_name(self.hashfn),
+                'pair_size': self.pair_size,
+                'record_bytes': record_bytes,
+                'slots': sum(lengths),
+                'largest_table': max(lengths),
+            }
+        self._write_trailer(metadata)
 
         self.fp.seek(0)
-        for pair in index:
-            self.fp.write(self.write_pair(*pair))
+        self.fp.write(b''.join(self.write_pair(*pair) for pair in index))
         self.fp = None  # prevent double finalize()
 
+        if self._spill_files is not None:
+            for f in self._spill_files:
+                if f is not None:
+                    f.close()
+            self._spill_files = None
+
+    def _count_unique_keys(self, tbl, key_crcs):
+        # Return the number of distinct keys among the records with the hash
+        # table entries tbl. Keys are told apart by their hashes and CRCs, and
+        # records that share both have their keys read back to compare them,
+        # if the output file can be read.
+        fingerprints = list(zip(tbl[0::2], key_crcs))
+        counts = Counter(fingerprints)
+        unique_keys = len(counts)
+        fp = self.fp
+        readable = getattr(fp, 'readable', None)
+        if unique_keys == len(fingerprints) or not (readable and readable()):
+            return unique_keys
+
+        shared = {}
+        for fingerprint, pos in zip(fingerprints, tbl[1::2]):
+            if counts[fingerprint] > 1:
+                fp.seek(pos)
+                key_len = self.read_pair(fp.read(self.pair_size))[0]
+                shared.setdefault(fingerprint, set()).add(fp.read(key_len))
+        fp.seek(self._pos)
+        return unique_keys + sum(len(keys) - 1 for keys in shared.values())
+
+    def _table_length(self, count):
+        # Return the number of slots for a hash table with count entries.
+        # There's always an empty slot, where lookups for missing keys can
+        # stop rather than visiting every slot.
+        if not count:
+            return 0
+        return max(count + 1, ceil(count / self.load_factor))
+
+    def _build_table(self, pairs, length):
+        # Return a hash table with length slots holding the hashes and
+        # positions from pairs (an array of table_typecode, alternating between
+        # the two), packed for writing.
+        if _tables is not None:
+            return _tables.build_table(pairs, length, self.pair_size)
+
+        # Place each pair at the first free slot, starting from the one that
+        # its hash picks. As with cdbmake, a slot is free if its position is 0
+        # (hashes can be 0, but records never start at 0).
+        hashes = [0] * length
+        positions = [0] * length
+        values = iter(pairs)
+        for h, pos in zip(values, values):
+            i = (h >> 8) % length
+            while positions[i]:
+                i += 1
+                if i == length:
+                    i = 0
+            hashes[i] = h
+            positions[i] = pos
+
+        if array(self.table_typecode).itemsize * 2 != self.pair_size:
+            # Arrays can't hold 48-bit integers
+            return b''.join(map(self.write_pair, hashes, positions))
+        table = array(self.table_typecode, hashes + positions)
+        table[0::2], table[1::2] = table[:length], table[length:]
+        if byteorder != 'little':
+            table.byteswap()
+        return table.tobytes()
+
+    def _trailer_sections(self, metadata=None):
+        # Return a list of (tag, data) pairs to store after the hash tables.
+        sections = []
+        name = hash_function_name(self.hashfn)
+        if name not in (None, 'djb'):
+            sections.append((HASH_TAG, name.encode('ascii')))
+
+        if metadata is not None:
+            sections.append((METADATA_TAG, json_dumps(
+                metadata, sort_keys=True
+            ).encode('ascii')))
+
+        if self._bloom_hashes is not None:
+            chunks = [self._bloom_hashes]
+            count = len(self._bloom_hashes)
+            if self._spill_files is not None:
+                # Everything has been spilled, 8 bytes per hash
+                i = len(self._spill_files) - 1
+                f = self._spill_files[i]
+                count = 0 if (f is None) else (f.seek(0, 2) // 8)
+                chunks = self._unspill(i, 'Q', DEFAULT_BUFFER_SIZE)
+
+            bloom = BloomFilter.for_capacity(count, self.bloom_fp_rate)
+            for h in chain.from_iterable(chunks):
+                bloom.add(h)
+            sections.append((BLOOM_TAG, bloom.to_bytes()))
+
+        if self._tombstones:
+            sections.append((TOMBSTONE_TAG, b''.join(chain.from_iterable(
+                (self.write_pair(len(key), 0), key)
+                for key in self._tombstones
+            ))))
+
+        return sections
+
+    def _write_trailer(self, metadata=None):
+        # Write the trailer sections (if there are any), then their
+        # directory, then the footer.
+        sections = self._trailer_sections(metadata)
+        if not sections:
+            return
+
+        directory = []
+        for tag, data in sections:
+            directory.append(trailer_entry.pack(tag, self._pos, len(data)))
+            self.fp.write(data)
+            self._pos += len(data)
+        self.fp.write(b''.join(directory))
+        self.fp.write(trailer_footer.pack(len(directory), TRAILER_MAGIC))
+
 
 class Writer64(Writer):
     '''A cdblib.Writer variant to support writing CDB files that use 64-bit
     file offsets.'''
 
+    read_pair = staticmethod(read_2_le8)
     write_pair = staticmethod(write_2_le8)
     pair_size = 16
+    table_typecode = 'Q'
+
+
+class Writer48(Writer):
+    '''A cdblib.Writer variant that uses 48-bit integers for file offsets and
+    lengths. Hash tables are a quarter smaller than Writer64's, and databases
+    can be up to 256 TiB in size.'''
+
+    read_pair = staticmethod(read_2_le6)
+    write_pair = staticmethod(write_2_le6)
+    pair_size = 12
+    table_typecode = 'Q'
+
+    def _check_pos(self):
+        # Raise OverflowError if the next record can't be stored. The arrays
+        # of hash table entries can hold bigger positions than the file can,
+        # so they don't catch this like Writer's do.
+        if self._pos >> 48:
+            raise OverflowError('position is too large for a 48-bit database')
+
+    def put(self, key, value=b''):
+        self._check_pos()
+        super(Writer48, self).put(key, value)
+
+    def _put_chunk(self, keys, values):
+        self._check_pos()
+        super(Writer48, self)._put_chunk(keys, values)
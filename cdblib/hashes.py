@@ -0,0 +1,116 @@
+'''
+Hash functions for the hash tables, by the names that databases record them
+under. djb_hash is the standard cdb hash function; the others mix their input
+more thoroughly, so keys that differ in only a few bytes (such as sequential
+numbers) are spread more evenly across the slots.
+
+'''
+from struct import unpack_from
+
+from .djb_hash import djb_hash
+
+_MASK_32 = 0xffffffff
+
+
+def _rotl32(x, r):
+    return ((x << r) | (x >> (32 - r))) & _MASK_32
+
+
+def murmur3_hash(s):
+    '''Return the 32-bit MurmurHash3 (x86 variant, with a seed of 0) of byte
+    string *s*'''
+    length = len(s)
+    block_count = length // 4
+    h = 0
+    for k in unpack_from('<{}L'.format(block_count), s):
+        k = (_rotl32((k * 0xcc9e2d51) & _MASK_32, 15) * 0x1b873593) & _MASK_32
+        h = (_rotl32(h ^ k, 13) * 5 + 0xe6546b64) & _MASK_32
+
+    tail = s[block_count * 4:]
+    if tail:
+        k = int.from_bytes(tail, 'little')
+        k = (_rotl32((k * 0xcc9e2d51) & _MASK_32, 15) * 0x1b873593) & _MASK_32
+        h ^= k
+
+    h ^= length
+    h = ((h ^ (h >> 16)) * 0x85ebca6b) & _MASK_32
+    h = ((h ^ (h >> 13)) * 0xc2b2ae35) & _MASK_32
+    return h ^ (h >> 16)
+
+
+_XXH_PRIME32_1 = 0x9e3779b1
+_XXH_PRIME32_2 = 0x85ebca77
+_XXH_PRIME32_3 = 0xc2b2ae3d
+_XXH_PRIME32_4 = 0x27d4eb2f
+_XXH_PRIME32_5 = 0x165667b1
+
+
+def xxh32_hash(s):
+    '''Return the 32-bit xxHash (XXH32, with a seed of 0) of byte string
+    *s*'''
+    length = len(s)
+    pos = 0
+    if length >= 16:
+        v = [
+            (_XXH_PRIME32_1 + _XXH_PRIME32_2) & _MASK_32,
+            _XXH_PRIME32_2,
+            0,
+            (-_XXH_PRIME32_1) & _MASK_32,
+        ]
+        stripe_count = length // 16
+        lanes = unpack_from('<{}L'.format(stripe_count * 4), s)
+        for i, lane in enumerate(lanes):
+            acc = (v[i & 3] + lane * _XXH_PRIME32_2) & _MASK_32
+            v[i & 3] = (_rotl32(acc, 13) * _XXH_PRIME32_1) & _MASK_32
+        pos = stripe_count * 16
+        h = (
+            _rotl32(v[0], 1) + _rotl32(v[1], 7) +
+            _rotl32(v[2], 12) + _rotl32(v[3], 18)
+        ) & _MASK_32
+    else:
+        h = _XXH_PRIME32_5
+
+    h = (h + length) & _MASK_32
+    word_count = (length - pos) // 4
+    for word in unpack_from('<{}L'.format(word_count), s, pos):
+        h = (h + word * _XXH_PRIME32_3) & _MASK_32
+        h = (_rotl32(h, 17) * _XXH_PRIME32_4) & _MASK_32
+    for c in s[pos + (word_count * 4):]:
+        h = (h + c * _XXH_PRIME32_5) & _MASK_32
+        h = (_rotl32(h, 11) * _XXH_PRIME32_1) & _MASK_32
+
+    h = ((h ^ (h >> 15)) * _XXH_PRIME32_2) & _MASK_32
+    h = ((h ^ (h >> 13)) * _XXH_PRIME32_3) & _MASK_32
+    return h ^ (h >> 16)
+
+
+# If the C Extension is available, use it
+try:
+    from ._hashes import murmur3_hash, xxh32_hash  # noqa
+except ImportError:
+    pass
+
+# Hash functions by name
+HASH_FUNCTIONS = {
+    'djb': djb_hash,
+    'murmur3': murmur3_hash,
+    'xxh32': xxh32_hash,
+}
+
+
+def get_hash_function(name):
+    '''Return the hash function called name, raising ValueError if there
+    isn't one.'''
+    try:
+        return HASH_FUNCTIONS[name]
+    except KeyError:
+        raise ValueError('unknown hash function: {!r}'.format(name))
+
+
+def hash_function_name(hashfn):
+    '''Return the name of the hash function hashfn, or None if it's not one
+    of the built-in functions.'''
+    for name, func in HASH_FUNCTIONS.items():
+        if func is hashfn:
+            return name
+    return None
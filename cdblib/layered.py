@@ -0,0 +1,245 @@
+'''
+Read a stack of databases as though they were one: a large base database,
+with small databases of changes (deltas) layered over it. Since databases
+can't be changed, this lets changes be published without rebuilding the base,
+which can be merged with its deltas later by compact().
+
+'''
+from .cdblib import Reader, Writer
+
+# Marker for keys that a layer doesn't have
+_MISSING = object()
+
+
+class LayeredReader(object):
+    '''A dictionary-like object for reading a stack of Reader instances as
+    one database. layers is a list of readers, oldest (the base) first.
+
+    For each key, the newest layer with records for it wins: lookups return
+    that layer's values, and the key's records in older layers are hidden.
+    Keys that were deleted with Writer.delete() when writing a layer are
+    hidden in the layers below it too.
+
+    Iterating goes through the layers from oldest to newest, skipping the
+    records that are hidden. All of the layers must use the same hash
+    function.'''
+
+    def __init__(self, layers):
+        self.layers = list(layers)
+        if not self.layers:
+            raise ValueError('at least one layer is required')
+        self._newest_first = self.layers[::-1]
+        self.hashfn = self.layers[0].hashfn
+        self.hash_key = self.layers[0].hash_key
+        self._hidden_keys = None
+        self._length = None
+
+    @classmethod
+    def from_file_paths(cls, file_paths, reader_cls=Reader, **kwargs):
+        '''Open each of file_paths (oldest first) with
+        reader_cls.from_file_path(), passing on kwargs.'''
+        layers = []
+        try:
+            for file_path in file_paths:
+                layers.append(reader_cls.from_file_path(file_path, **kwargs))
+        except Exception:
+            for layer in layers:
+                layer.close()
+            raise
+        return cls(layers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Close each of the layers.'''
+        for layer in self.layers:
+            layer.close()
+
+    def _find(self, key, lookup):
+        # Return lookup(layer, key) for the newest layer where it's not
+        # _MISSING, stopping early if a layer deleted the key.
+        key = self.hash_key(key)[0]
+        for layer in self._newest_first:
+            result = lookup(layer, key)
+            if result is not _MISSING:
+                return result
+            if key in layer.tombstones:
+                break
+        return _MISSING
+
+    def _find_many(self, keys, lookup_many):
+        # Batched version of _find(): lookup_many(layer, keys) returns a list
+        # of results for keys. Each layer looks up the keys that haven't been
+        # resolved by the newer layers, in one batch.
+        hash_key = self.hash_key
+        keys = [hash_key(key)[0] for key in keys]
+        results = [_MISSING] * len(keys)
+        pending = list(range(len(keys)))
+        for layer in self._newest_first:
+            if not pending:
+                break
+            tombstones = layer.tombstones
+            unresolved = []
+            layer_results = lookup_many(layer, [keys[i] for i in pending])
+            for i, result in zip(pending, layer_results):
+                if result is not _MISSING:
+                    results[i] = result
+                elif keys[i] not in tombstones:
+                    unresolved.append(i)
+            pending = unresolved
+        return results
+
+    def _hidden(self):
+        # Return a list with the set of keys that newer layers hide for each
+        # layer, oldest first. Only the newer layers' keys are collected.
+        if self._hidden_keys is None:
+            hidden = [frozenset()]
+            for layer in self._newest_first[:-1]:
+                hidden.append(
+                    hidden[-1] | frozenset(layer.iterkeys()) | layer.tombstones
+                )
+            self._hidden_keys = hidden[::-1]
+        return self._hidden_keys
+
+    def iteritems(self):
+        '''Like dict.iteritems().'''
+        for layer, hidden in zip(self.layers, self._hidden()):
+            if hidden:
+                for item in layer.iteritems():
+                    if item[0] not in hidden:
+                        yield item
+            else:
+                yield from layer.iteritems()
+
+    def items(self):
+        '''Like dict.items().'''
+        return list(self.iteritems())
+
+    def iterkeys(self):
+        '''Like dict.iterkeys().'''
+        for layer, hidden in zip(self.layers, self._hidden()):
+            if hidden:
+                for key in layer.iterkeys():
+                    if key not in hidden:
+                        yield key
+            else:
+                yield from layer.iterkeys()
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        '''Like dict.itervalues().'''
+        return (p[1] for p in self.iteritems())
+
+    def keys(self):
+        '''Like dict.keys().'''
+        return list(self.iterkeys())
+
+    def values(self):
+        '''Like dict.values().'''
+        return list(self.itervalues())
+
+    def __getitem__(self, key):
+        '''Like dict.__getitem__().'''
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def has_key(self, key):
+        '''Return True if key exists in the database.'''
+        return self.value_length(key) is not None
+    __contains__ = contains = has_key
+
+    def __len__(self):
+        '''Return the number of records that aren't hidden. Only the hidden
+        keys are looked up, so this doesn't read every record.'''
+        if self._length is None:
+            self._length = sum(
+                len(layer) - sum(layer.count(key) for key in hidden)
+                for layer, hidden in zip(self.layers, self._hidden())
+            )
+        return self._length
+
+    def get(self, key, default=None):
+        '''Get the first value for key, returning default if missing.'''
+        value = self._find(key, lambda layer, key: layer.get(key, _MISSING))
+        return default if value is _MISSING else value
+
+    def gets(self, key):
+        '''Return an iterator over the values for key in insertion order.'''
+        values = self._find(
+            key, lambda layer, key: list(layer.gets(key)) or _MISSING
+        )
+        return iter(() if values is _MISSING else values)
+
+    def count(self, key):
+        '''Return the number of values stored for key, without reading
+        them.'''
+        count = self._find(
+            key, lambda layer, key: layer.count(key) or _MISSING
+        )
+        return 0 if count is _MISSING else count
+
+    def value_length(self, key, default=None):
+        '''Return the length of the first value for key without reading it,
+        returning default if missing.'''
+        length = self._find(
+            key, lambda layer, key: layer.value_length(key, _MISSING)
+        )
+        return default if length is _MISSING else length
+
+    def get_many(self, keys, default=None):
+        '''Like Reader.get_many(). Each layer looks up the keys that the newer
+        layers didn't have in one batch.'''
+        values = self._find_many(
+            keys, lambda layer, keys: layer.get_many(keys, _MISSING)
+        )
+        return [default if v is _MISSING else v for v in values]
+
+    def gets_many(self, keys):
+        '''Like Reader.gets_many(). Each layer looks up the keys that the
+        newer layers didn't have in one batch.'''
+        values = self._find_many(keys, lambda layer, keys: [
+            v or _MISSING for v in layer.gets_many(keys)
+        ])
+        return [[] if v is _MISSING else v for v in values]
+
+    def getint(self, key, default=None, base=0):
+        '''Get the first value for key converted it to an int, returning
+        default if missing.'''
+        value = self.get(key, default)
+        if value is not default:
+            return int(bytes(value), base)
+        return value
+
+    def getints(self, key, base=0):
+        '''Yield values for key in insertion order after converting to int.'''
+        return (int(bytes(v), base) for v in self.gets(key))
+
+    def getstring(self, key, default=None, encoding='utf-8'):
+        '''Get the first value for key decoded as unicode, returning default if
+        not found.'''
+        value = self.get(key, default)
+        if value is not default:
+            return str(value, encoding)
+        return value
+
+    def getstrings(self, key, encoding='utf-8'):
+        '''Yield values for key in insertion order after decoding as
+        unicode.'''
+        return (str(v, encoding) for v in self.gets(key))
+
+
+def compact(reader, fp, writer_cls=Writer, **kwargs):
+    '''Write the records that reader (usually a LayeredReader) holds to the
+    file-like object fp, as one database without any tombstones. Records are
+    streamed from the layers to the writer, which is created with kwargs. It
+    uses the same hash function as reader, unless hashfn is given.'''
+    kwargs.setdefault('hashfn', reader.hashfn)
+    writer = writer_cls(fp, **kwargs)
+    writer.put_many(reader.iteritems())
+    writer.finalize()
@@ -0,0 +1,144 @@
+'''
+Build databases using several processes. Each worker writes the records from
+one part of the input, along with their hash table entries, to temporary
+files; these are then joined up into the final database (or databases, when
+the records are split into shards by their hashes).
+
+'''
+import os
+from array import array
+from multiprocessing import Pool, cpu_count
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from .cdblib import Writer
+from .sharded import _route
+
+
+def parallel_build(file_path, inputs, processes=None, writer_cls=Writer,
+                   temp_dir=None, **kwargs):
+    '''Write a database to file_path from inputs, a list of iterables of
+    (key, value) pairs, using a pool of worker processes.
+
+    Each input is handled by a single worker, so the inputs should be of
+    similar sizes, and there should be at least as many of them as processes
+    (which defaults to the number of CPUs). Inputs are sent to the workers, so
+    they must be picklable. An input can also be a function (such as a
+    functools.partial() that reads a file) that returns an iterable, which
+    the worker calls.
+
+    The database is the same as one written by calling put_many() with each
+    input in turn. Temporary files are written to a directory inside temp_dir
+    (or the default temporary directory), and other keyword arguments are
+    passed to writer_cls.'''
+    parallel_build_shards(
+        [file_path], inputs, processes=processes, writer_cls=writer_cls,
+        temp_dir=temp_dir, **kwargs
+    )
+
+
+def parallel_build_shards(file_paths, inputs, processes=None,
+                          writer_cls=Writer, temp_dir=None, **kwargs):
+    '''Like parallel_build(), but split the records between a database for
+    each of file_paths. Each record goes in the shard that
+    cdblib.sharded.shard_for_hash() picks for the hash of its key, and the
+    shards are finished in parallel too. Use cdblib.sharded.write_manifest()
+    to list them for ShardedReader.'''
+    file_paths = list(file_paths)
+    if not file_paths:
+        raise ValueError('at least one file path is required')
+    if processes is None:
+        processes = cpu_count()
+
+    work_dir = mkdtemp(dir=temp_dir)
+    try:
+        # Workers don't spill, since their entries are written out anyway
+        tasks = [
+            (items, len(file_paths), writer_cls, dict(kwargs, spill=False),
+             join(work_dir, str(i)))
+            for i, items in enumerate(inputs)
+        ]
+
+        def shard_tasks(results):
+            return [
+                (file_path, [segments[i] for segments in results], writer_cls,
+                 kwargs)
+                for i, file_path in enumerate(file_paths)
+            ]
+
+        if processes == 1:
+            for task in shard_tasks(list(map(_write_segments, tasks))):
+                _join_segments(task)
+            return
+
+        with Pool(processes) as pool:
+            results = pool.map(_write_segments, tasks, chunksize=1)
+            pool.map(_join_segments, shard_tasks(results), chunksize=1)
+    finally:
+        rmtree(work_dir, ignore_errors=True)
+
+
+def _write_segments(task):
+    # Write the records from one input to a file for each shard, with the
+    # values that its writer collected for them (the arrays from _pending())
+    # in another file. Returns a list of (records_path, entries_path, lengths)
+    # tuples, where lengths are the lengths of the arrays in the entries file.
+    items, shard_count, writer_cls, kwargs, path_prefix = task
+    if callable(items):
+        items = items()
+
+    files = []
+    writers = []
+    for i in range(shard_count):
+        f = open('{}-{}.records'.format(path_prefix, i), 'wb')
+        files.append(f)
+        writers.append(writer_cls(f, **kwargs))
+
+    try:
+        if shard_count == 1:
+            writers[0].put_many(items)
+        else:
+            for routed in _route(items, writers[0].hash_key, shard_count):
+                for writer, shard_items in zip(writers, routed):
+                    writer.put_many(shard_items)
+
+        for writer in writers:
+            writer._flush()
+    finally:
+        for f in files:
+            f.close()
+
+    segments = []
+    for f, writer in zip(files, writers):
+        entries_path = '{}.entries'.format(f.name)
+        arrays = writer._pending()
+        with open(entries_path, 'wb') as ef:
+            for values in arrays:
+                values.tofile(ef)
+        segments.append((f.name, entries_path, [len(a) for a in arrays]))
+
+    return segments
+
+
+def _join_segments(task):
+    # Write a database from the segments that each worker wrote for it, in
+    # order.
+    file_path, segments, writer_cls, kwargs = task
+    with open(file_path, 'wb') as f:
+        writer = writer_cls(f, **kwargs)
+        start = 256 * writer.pair_size
+        for records_path, entries_path, lengths in segments:
+            arrays = []
+            with open(entries_path, 'rb') as ef:
+                for pending, length in zip(writer._pending(), lengths):
+                    values = array(pending.typecode)
+                    values.fromfile(ef, length)
+                    arrays.append(values)
+            os.remove(entries_path)
+
+            with open(records_path, 'rb') as rf:
+                writer._append_records(rf, start, arrays)
+            os.remove(records_path)
+
+        writer.finalize()
@@ -0,0 +1,465 @@
+'''
+Read-optimized databases, with a minimal perfect hash function over the
+hashes of their keys. It's built with the CHD ("compress, hash, and
+displace") algorithm, and gives each distinct hash its own slot, so a lookup
+reads one slot, and then the one record that the slot points to if the
+slot's hash matches. Hits and misses alike never walk a chain of slots.
+
+The hash function and its slots are stored after the hash tables, so the
+databases are still standard cdb files that Reader (and other cdb tools) can
+read.
+
+'''
+from array import array
+from collections import Counter
+from itertools import chain
+from math import ceil
+from struct import Struct
+from sys import byteorder
+
+# If the C Extension is available, use it to build and use the function
+try:
+    from . import _perfect
+except ImportError:
+    _perfect = None
+
+from .cdblib import (
+    PERFECT_TAG,
+    UINT32_TYPECODE,
+    Reader,
+    Reader48,
+    Reader64,
+    Writer,
+    Writer48,
+    Writer64,
+)
+
+# Serialized form: seed, number of buckets, number of slots; then the two
+# displacements for each bucket, the hash and record position for each slot,
+# and a bitmap of the slots whose hash is shared by several records
+header = Struct('<LLL')
+displacements = Struct('<LL')
+
+# Average number of hashes in each bucket. Larger buckets make the function
+# smaller, but slower to build.
+BUCKET_SIZE = 3
+
+# Number of first displacements to try for each bucket, and seeds to try for
+# the whole function, before giving up
+MAX_DISPLACEMENT = 256
+MAX_SEEDS = 64
+
+# Marker for keys that are missing, in batches of lookups
+_MISSING = object()
+
+_MASK_32 = 0xffffffff
+_MASK_64 = 0xffffffffffffffff
+
+
+def perfect_hashes(h, seed, bucket_count, slot_count):
+    '''Return the bucket (from 0 to bucket_count - 1) for the 32-bit hash h,
+    and the two values (from 0 to slot_count - 1) that its slot is computed
+    from. h is mixed with the seed by the splitmix64 finalizer.'''
+    z = (seed << 32) | h
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & _MASK_64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & _MASK_64
+    z ^= z >> 31
+    w = (z * 0x9e3779b97f4a7c15) & _MASK_64
+    return (
+        ((z & _MASK_32) * bucket_count) >> 32,
+        ((z >> 32) * slot_count) >> 32,
+        ((w >> 32) * slot_count) >> 32,
+    )
+
+
+def _displace(hashes, seed):
+    # Try to build the function for the distinct 32-bit hashes with the given
+    # seed. Return arrays with the displacements for each bucket and the index
+    # (in hashes) of the hash for each slot, or None if some bucket couldn't
+    # be placed.
+    slot_count = len(hashes)
+    bucket_count = ceil(slot_count / BUCKET_SIZE)
+    buckets = [[] for i in range(bucket_count)]
+    for i, h in enumerate(hashes):
+        bucket, f1, f2 = perfect_hashes(h, seed, bucket_count, slot_count)
+        buckets[bucket].append((f1, f2, i))
+
+    # Place the biggest buckets first, while there's the most room. Each
+    # hash's slot is (f1 + (d0 * f2) + d1) % slot_count, where d0 and d1 are
+    # its bucket's displacements.
+    result = array(UINT32_TYPECODE, bytes(8 * bucket_count))
+    order = array(UINT32_TYPECODE, bytes(4 * slot_count))
+    taken = bytearray(slot_count)
+    for b in sorted(range(bucket_count), key=lambda b: -len(buckets[b])):
+        bucket = buckets[b]
+        if not bucket:
+            break
+
+        for d0 in range(min(slot_count, MAX_DISPLACEMENT)):
+            positions = [(f1 + (d0 * f2)) % slot_count for f1, f2, i in bucket]
+            if len(set(positions)) < len(positions):
+                continue
+
+            # Line up the first hash with each free slot in turn, starting
+            # from its own, until the others land on free slots too.
+            first = positions[0]
+            rest = positions[1:]
+            free = taken.find(0, first)
+            if free < 0:
+                free = taken.find(0)
+            start = free
+            while True:
+                d1 = free - first
+                if not any(taken[(p + d1) % slot_count] for p in rest):
+                    break
+                free = taken.find(0, free + 1)
+                if free < 0:
+                    free = taken.find(0)
+                if free == start:
+                    d1 = None
+                    break
+            if d1 is not None:
+                break
+        else:
+            return None
+
+        result[2 * b] = d0
+        result[(2 * b) + 1] = d1 % slot_count
+        for p, (f1, f2, i) in zip(positions, bucket):
+            p = (p + d1) % slot_count
+            taken[p] = 1
+            order[p] = i
+
+    return result, order
+
+
+def build(hashes):
+    '''Return a minimal perfect hash function for the distinct 32-bit hashes
+    (a non-empty sequence): the seed, and arrays with the displacements for
+    each bucket and the index (in hashes) of the hash that each slot
+    holds.'''
+    hashes = array(UINT32_TYPECODE, hashes)
+    for seed in range(MAX_SEEDS):
+        if _perfect is not None:
+            built = _perfect.displace(
+                hashes, seed, ceil(len(hashes) / BUCKET_SIZE), MAX_DISPLACEMENT
+            )
+            if built is not None:
+                built = [array(UINT32_TYPECODE, b) for b in built]
+        else:
+            built = _displace(hashes, seed)
+        if built is not None:
+            return (seed,) + tuple(built)
+    raise ValueError('could not build a perfect hash function')
+
+
+class PerfectWriter(Writer):
+    '''A Writer that also stores a minimal perfect hash function over the
+    hashes of its keys, for PerfectReader to use. The distinct hashes are kept
+    in memory until finalize() builds the function from them.'''
+
+    def __init__(self, fp, **kwargs):
+        super(PerfectWriter, self).__init__(fp, **kwargs)
+        # The distinct hashes, the position of the first record for each,
+        # and the hashes that several records share
+        self._perfect_hashes = array(UINT32_TYPECODE)
+        self._perfect_positions = array(self.table_typecode)
+        self._shared_hashes = set()
+
+    def _build_table(self, pairs, length):
+        # Collect the distinct hashes in the table. Entries are in the order
+        # that their records were written, so reading them backwards leaves
+        # the first position for each hash.
+        first = dict(zip(pairs[-2::-2], pairs[-1::-2]))
+        self._perfect_hashes.extend(first)
+        self._perfect_positions.extend(first.values())
+        if len(first) * 2 < len(pairs):
+            self._shared_hashes.update(
+                h for h, count in Counter(pairs[0::2]).items() if count > 1
+            )
+        return super(PerfectWriter, self)._build_table(pairs, length)
+
+    def _trailer_sections(self, metadata=None):
+        sections = super(PerfectWriter, self)._trailer_sections(metadata)
+        sections.append((PERFECT_TAG, self._perfect_section()))
+        return sections
+
+    def _perfect_section(self):
+        # Return the serialized function and slots.
+        hashes = self._perfect_hashes
+        positions = self._perfect_positions
+        slot_count = len(hashes)
+        if slot_count:
+            seed, result, order = build(hashes)
+        else:
+            seed, result, order = 0, array(UINT32_TYPECODE), []
+
+        slot_hashes = [hashes[i] for i in order]
+        slot_positions = [positions[i] for i in order]
+        shared = self._shared_hashes
+        bitmap = bytearray((slot_count + 7) // 8)
+        if shared:
+            for slot, h in enumerate(slot_hashes):
+                if h in shared:
+                    bitmap[slot >> 3] |= 1 << (slot & 7)
+
+        if array(self.table_typecode).itemsize * 2 == self.pair_size:
+            slots = array(self.table_typecode, slot_hashes + slot_positions)
+            slots[0::2], slots[1::2] = (
+                slots[:slot_count], slots[slot_count:]
+            )
+        else:
+            # Arrays can't hold 48-bit integers
+            slots = b''.join(
+                map(self.write_pair, slot_hashes, slot_positions)
+            )
+        if byteorder != 'little':
+            result.byteswap()
+            if isinstance(slots, array):
+                slots.byteswap()
+
+        return b''.join((
+            header.pack(seed, len(result) // 2, slot_count),
+            result.tobytes(),
+            slots if isinstance(slots, bytes) else slots.tobytes(),
+            bytes(bitmap),
+        ))
+
+
+class PerfectWriter64(PerfectWriter, Writer64):
+    '''A PerfectWriter variant for 64-bit file offsets.'''
+
+
+class PerfectWriter48(PerfectWriter, Writer48):
+    '''A PerfectWriter variant for 48-bit file offsets and lengths.'''
+
+
+class PerfectReader(Reader):
+    '''A Reader that looks keys up with the minimal perfect hash function that
+    PerfectWriter stores. Each lookup reads one slot, and at most one record:
+    the first one with the key's hash.
+
+    Keys that share their hash with other records, because they have several
+    values or because of a collision, are marked. Looking up all of their
+    values, or a key that collides with one of them, falls back to searching
+    the hash tables like Reader does. So do all lookups in databases that
+    don't have the function.'''
+
+    def __init__(self, *args, **kwargs):
+        super(PerfectReader, self).__init__(*args, **kwargs)
+        # Like _c_lookup, the C lookup code needs data that supports the
+        # buffer protocol
+        self._c_perfect = _perfect if self._buffer else None
+
+        # The offset of the function's trailer section (for the C lookup
+        # code), and its parameters and the offsets of its parts
+        self._perfect = self._layout = None
+        self._read_perfect()
+
+    def _read_perfect(self):
+        # Set up the function, if the database has a valid one.
+        if PERFECT_TAG not in self._sections:
+            return
+        offset, length = self._sections[PERFECT_TAG]
+        if length < header.size:
+            return
+        seed, bucket_count, slot_count = header.unpack(
+            self.data[offset:offset + header.size]
+        )
+        displacements_pos = offset + header.size
+        slots_pos = displacements_pos + (bucket_count * displacements.size)
+        bitmap_pos = slots_pos + (slot_count * self.pair_size)
+        if (
+            (bucket_count != ceil(slot_count / BUCKET_SIZE)) or
+            (bitmap_pos + ((slot_count + 7) // 8) != offset + length)
+        ):
+            return
+        self._perfect = offset
+        self._layout = (
+            seed, bucket_count, slot_count,
+            displacements_pos, slots_pos, bitmap_pos,
+        )
+
+    def _perfect_find(self, key, hashed_key):
+        # Return the position and size of the first value for key, and
+        # whether other records share its hash, or None if the key is missing.
+        # If the slot's record has a different key with the same hash, the
+        # position and size are None and the hash tables must be searched.
+        (
+            seed, bucket_count, slot_count,
+            displacements_pos, slots_pos, bitmap_pos,
+        ) = self._layout
+        if not slot_count:
+            return None
+        data = self.data
+        pair_size = self.pair_size
+
+        # Find the slot from the bucket's displacements
+        bucket, f1, f2 = perfect_hashes(
+            hashed_key, seed, bucket_count, slot_count
+        )
+        pos = displacements_pos + (bucket * displacements.size)
+        d0, d1 = displacements.unpack(data[pos:pos + displacements.size])
+        slot = (f1 + (d0 * f2) + d1) % slot_count
+
+        # Missing keys usually stop here, without reading a record
+        pos = slots_pos + (slot * pair_size)
+        h, record_pos = self.read_pair(data[pos:pos + pair_size])
+        if h != hashed_key:
+            return None
+
+        shared = data[bitmap_pos + (slot >> 3)] & (1 << (slot & 7))
+        key_size, value_size = self.read_pair(
+            data[record_pos:record_pos + pair_size]
+        )
+        record_pos += pair_size
+        if key_size == len(key) and (
+            data[record_pos:record_pos + key_size] == key
+        ):
+            return record_pos + key_size, value_size, shared
+        if shared:
+            return None, None, shared
+        return None
+
+    def _perfect_gets(self, key, hashed_key):
+        # Return a list of the values for the encoded key.
+        if self._c_perfect is not None:
+            return self._c_perfect.gets(
+                self.data, self.index, self.pair_size, key, hashed_key,
+                self._perfect
+            )
+
+        found = self._perfect_find(key, hashed_key)
+        if found is None:
+            return []
+        pos, size, shared = found
+        if shared:
+            return list(self._gets(key, hashed_key))
+        return [self.data[pos:pos + size]]
+
+    def _perfect_get(self, key, hashed_key, default):
+        # Return the first value for the encoded key, or default.
+        if self._c_perfect is not None:
+            value = self._c_perfect.get(
+                self.data, self.index, self.pair_size, key, hashed_key,
+                self._perfect
+            )
+            return default if value is None else value
+
+        found = self._perfect_find(key, hashed_key)
+        if found is None:
+            return default
+        pos, size, shared = found
+        if pos is None:
+            return next(chain(self._gets(key, hashed_key), (default,)))
+        return self.data[pos:pos + size]
+
+    def gets(self, key):
+        '''Yield values for key in insertion order.'''
+        if self._perfect is None:
+            return super(PerfectReader, self).gets(key)
+        key, hashed_key = self.hash_key(key)
+        if self.bloom is not None and self._rejected(key, hashed_key):
+            return iter(())
+        return iter(self._perfect_gets(key, hashed_key))
+
+    def get(self, key, default=None):
+        '''Get the first value for key, returning default if missing.'''
+        if self._perfect is None:
+            return super(PerfectReader, self).get(key, default)
+        key, hashed_key = self.hash_key(key)
+        if self.bloom is not None and self._rejected(key, hashed_key):
+            return default
+        return self._perfect_get(key, hashed_key, default)
+
+    def count(self, key):
+        '''Return the number of values stored for key, without reading
+        them.'''
+        if self._perfect is None:
+            return super(PerfectReader, self).count(key)
+        key, hashed_key = self.hash_key(key)
+        if self.bloom is not None and self._rejected(key, hashed_key):
+            return 0
+
+        if self._c_perfect is not None:
+            return self._c_perfect.count(
+                self.data, self.index, self.pair_size, key, hashed_key,
+                self._perfect
+            )
+
+        found = self._perfect_find(key, hashed_key)
+        if found is None:
+            return 0
+        if found[2]:
+            return sum(1 for p in self._find(key, hashed_key))
+        return 1
+
+    def value_length(self, key, default=None):
+        '''Return the length of the first value for key without reading it,
+        returning default if missing.'''
+        if self._perfect is None:
+            return super(PerfectReader, self).value_length(key, default)
+        key, hashed_key = self.hash_key(key)
+        if self.bloom is not None and self._rejected(key, hashed_key):
+            return default
+
+        if self._c_perfect is not None:
+            length = self._c_perfect.value_length(
+                self.data, self.index, self.pair_size, key, hashed_key,
+                self._perfect
+            )
+            return default if length is None else length
+
+        found = self._perfect_find(key, hashed_key)
+        if found is None:
+            return default
+        if found[0] is None:
+            for pos, size in self._find(key, hashed_key):
+                return size
+            return default
+        return found[1]
+
+    def _lookup_many(self, keys, first):
+        # Look each key up in turn, since every lookup reads one slot anyway.
+        if self._perfect is None:
+            return super(PerfectReader, self)._lookup_many(keys, first)
+        hash_key = self.hash_key
+        bloom = self.bloom
+        encoded_keys = []
+        found = {}
+        for key in keys:
+            key, hashed_key = hash_key(key)
+            encoded_keys.append(key)
+            if key in found:
+                continue
+            if bloom is not None and self._rejected(key, hashed_key):
+                continue
+            if first:
+                value = self._perfect_get(key, hashed_key, _MISSING)
+                values = [] if value is _MISSING else [value]
+            else:
+                values = self._perfect_gets(key, hashed_key)
+            if values:
+                found[key] = values
+        return encoded_keys, found
+
+
+class PerfectReader64(PerfectReader, Reader64):
+    '''A PerfectReader variant for 64-bit file offsets.'''
+
+
+class PerfectReader48(PerfectReader, Reader48):
+    '''A PerfectReader variant for 48-bit file offsets and lengths.'''
+
+
+def convert(reader, fp, writer_cls=PerfectWriter, **kwargs):
+    '''Write a copy of the database that reader holds, with its tombstones, to
+    the file-like object fp with writer_cls (usually a PerfectWriter), which
+    is created with kwargs. It uses the same hash function as reader, unless
+    hashfn is given.'''
+    kwargs.setdefault('hashfn', reader.hashfn)
+    writer = writer_cls(fp, **kwargs)
+    writer.put_many(reader.iteritems())
+    for key in reader.tombstones:
+        writer.delete(key)
+    writer.finalize()
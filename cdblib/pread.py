@@ -0,0 +1,111 @@
+'''
+A read-only, sequence-like view of a file that reads with os.pread() instead
+of memory-mapping it, for filesystems where mmap performs badly. A small cache
+of fixed-size blocks keeps the hot parts of the file in memory.
+
+'''
+import os
+from collections import OrderedDict
+
+
+class PreadFile(object):
+    '''Supports len() and indexing or slicing (like bytes) for the file with
+    the descriptor fileno. Reads of up to block_size bytes at or after
+    cache_from are served from a least recently used cache of at most
+    cache_blocks blocks; other reads go straight to the file.'''
+
+    block_size = 4096
+
+    def __init__(self, fileno, cache_blocks=256, cache_from=0):
+        if not hasattr(os, 'pread'):
+            raise ValueError('os.pread() is not available on this platform')
+        self.fileno = fileno
+        self.size = os.fstat(fileno).st_size
+        self.cache_blocks = cache_blocks
+        self.cache_from = cache_from
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = key.start
+            stop = key.stop
+            if (
+                (key.step is None) and
+                (start is not None) and
+                (stop is not None) and
+                (0 <= start <= stop)
+            ):
+                # Fast path for the slices that Reader uses
+                return self.read(start, min(stop, self.size) - start)
+
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return self.read(0, self.size)[key]
+            return self.read(start, stop - start)
+
+        if key < 0:
+            key += self.size
+        if not (0 <= key < self.size):
+            raise IndexError('index out of range')
+        return self.read(key, 1)[0]
+
+    def close(self):
+        '''Empty the cache. The file descriptor is left open.'''
+        self._cache.clear()
+
+    def read(self, pos, length):
+        '''Return length bytes starting at pos (fewer at the end of the
+        file).'''
+        if length <= 0:
+            return b''
+        block_size = self.block_size
+        if (pos < self.cache_from) or (length > block_size):
+            return self._pread(pos, length)
+
+        first = pos // block_size
+        last = (pos + length - 1) // block_size
+        offset = pos - (first * block_size)
+        if first == last:
+            return self._block(first)[offset:offset + length]
+        return (self._block(first) + self._block(last))[
+            offset:offset + length
+        ]
+
+    def _block(self, i):
+        # Return block i, reading it into the cache if it's not there.
+        cache = self._cache
+        try:
+            block = cache[i]
+            cache.move_to_end(i)
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return block
+
+        self.misses += 1
+        block = self._pread(i * self.block_size, self.block_size)
+        cache[i] = block
+        if len(cache) > self.cache_blocks:
+            cache.popitem(last=False)
+        return block
+
+    def _pread(self, pos, length):
+        # Read from the file, retrying short reads until length bytes have
+        # been read or the end of the file is reached.
+        data = os.pread(self.fileno, length, pos)
+        if len(data) == length:
+            return data
+
+        chunks = [data]
+        while data and (length > len(data)):
+            length -= len(data)
+            pos += len(data)
+            data = os.pread(self.fileno, length, pos)
+            chunks.append(data)
+        return b''.join(chunks)
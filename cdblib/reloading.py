@@ -0,0 +1,139 @@
+'''
+A wrapper for cdblib.Reader instances that follows atomic replacement of the
+database file, as done by cdbmake and cdblib.compat.cdbmake.
+
+'''
+import os
+from threading import Lock, Thread
+from time import monotonic
+
+from .cdblib import Reader
+
+
+def _file_id(st):
+    # Return the parts of a stat result that change when a file is replaced.
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class ReloadingReader(object):
+    '''Reads the database at file_path, and switches to a new version of it
+    when the file is replaced.
+
+    The file is checked at most once every check_interval seconds, when the
+    reader is used. If it has changed, the new version is opened (in a
+    background thread if background is True) and swapped in once it's ready.
+    Lookups that are already running finish with the old version, which is
+    closed when nothing refers to it anymore.
+
+    The reader is created with reader_cls.from_file_path(file_path, **kwargs),
+    so kwargs can include any Reader option (such as prefault='tables' to warm
+    up new versions before they're swapped in). Attributes that aren't defined
+    here are looked up on the current reader.'''
+
+    def __init__(self, file_path, check_interval=1.0, background=True,
+                 reader_cls=Reader, **kwargs):
+        self.file_path = file_path
+        self.check_interval = check_interval
+        self.background = background
+        self.reader_cls = reader_cls
+        self.reader_kwargs = kwargs
+        self.reloads = 0
+        self.last_error = None
+        self._lock = Lock()
+        self._closed = False
+        self._next_check = monotonic() + check_interval
+        self.reader, self._file_id = self._open()
+
+    def _open(self):
+        # Open the file, and return a reader along with the ID of the file it
+        # actually opened.
+        reader = self.reader_cls.from_file_path(
+            self.file_path, **self.reader_kwargs
+        )
+        return reader, _file_id(os.fstat(reader.file_obj.fileno()))
+
+    def current(self):
+        '''Return the current reader, checking for a new version of the file
+        first if it's time to.'''
+        if monotonic() >= self._next_check:
+            self.check()
+        return self.reader
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Close the current reader and stop checking for new versions.'''
+        # Wait for any reload in progress, so that its reader is the one that
+        # gets closed.
+        with self._lock:
+            self._closed = True
+            self.reader.close()
+
+    def check(self):
+        '''Check whether the file has been replaced, and start loading the new
+        version if it has. Returns True if a reload was started.'''
+        if not self._lock.acquire(False):
+            # Another check or reload is already in progress
+            return False
+
+        self._next_check = monotonic() + self.check_interval
+        try:
+            file_id = _file_id(os.stat(self.file_path))
+        except OSError as e:
+            # The file may be missing briefly while it's being replaced
+            self.last_error = e
+            self._lock.release()
+            return False
+
+        if self._closed or (file_id == self._file_id):
+            self._lock.release()
+            return False
+
+        if self.background:
+            Thread(target=self._reload, daemon=True).start()
+        else:
+            self._reload()
+        return True
+
+    def _reload(self):
+        # Open the new version of the file and swap it in. The lock is held
+        # by check() on entry.
+        try:
+            try:
+                reader, file_id = self._open()
+            except Exception as e:
+                # Keep using the old version; the next check will try again.
+                self.last_error = e
+                return
+
+            if self._closed:
+                reader.close()
+                return
+
+            self.reader, self._file_id = reader, file_id
+            self.reloads += 1
+        finally:
+            self._lock.release()
+
+    def __getitem__(self, key):
+        '''Like Reader.__getitem__().'''
+        return self.current()[key]
+
+    def __contains__(self, key):
+        '''Like Reader.__contains__().'''
+        return key in self.current()
+
+    def __iter__(self):
+        '''Like Reader.__iter__().'''
+        return iter(self.current())
+
+    def __len__(self):
+        '''Like Reader.__len__().'''
+        return len(self.current())
@@ -0,0 +1,376 @@
+'''
+Databases that are split between several files (shards), which are listed in a
+small JSON manifest. Each key's records are stored in the shard that
+shard_for_hash() picks for its hash, so lookups only need to visit one file.
+
+'''
+import json
+import os
+from itertools import chain, islice, zip_longest
+from os.path import abspath, dirname, join, relpath, splitext
+
+from .cdblib import PUT_MANY_CHUNK_SIZE, Reader, Reader48, Reader64, Writer
+
+# Identifies manifest files
+MANIFEST_FORMAT = 'pure-cdb-shards'
+
+# Reader classes for each pair size
+READER_CLASSES = {
+    Reader.pair_size: Reader,
+    Reader48.pair_size: Reader48,
+    Reader64.pair_size: Reader64,
+}
+
+
+def shard_for_hash(h, shard_count):
+    '''Return the shard (from 0 to shard_count - 1) for keys with the 32-bit
+    hash h. The hash is mixed first, so that the keys in each shard are spread
+    across all of its hash tables.'''
+    return (((h * 0x9e3779b1) & 0xffffffff) * shard_count) >> 32
+
+
+def write_manifest(manifest_path, file_paths, writer_cls=Writer):
+    '''Write a manifest listing the shards at file_paths (in order), which were
+    written by writer_cls instances. The paths are stored relative to the
+    manifest, and the manifest is replaced atomically.'''
+    file_paths = list(file_paths)
+    if not file_paths:
+        raise ValueError('at least one shard is required')
+
+    manifest_dir = dirname(abspath(manifest_path))
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'pair_size': writer_cls.pair_size,
+        'shards': [relpath(abspath(p), manifest_dir) for p in file_paths],
+    }
+    tmp_path = '{}.tmp'.format(manifest_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.write('\n')
+    os.replace(tmp_path, manifest_path)
+
+
+def read_manifest(manifest_path):
+    '''Return the paths of the shards listed in the manifest at
+    manifest_path, and their pair size.'''
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if (
+        not isinstance(manifest, dict) or
+        manifest.get('format') != MANIFEST_FORMAT or
+        not manifest.get('shards')
+    ):
+        raise ValueError('not a shard manifest')
+
+    manifest_dir = dirname(abspath(manifest_path))
+    file_paths = [join(manifest_dir, p) for p in manifest['shards']]
+    return file_paths, manifest.get('pair_size')
+
+
+def _route(items, hash_key, shard_count):
+    # Yield a list of (key, value) pairs for each shard, a chunk of items at a
+    # time. Keys are encoded, so they don't need to be encoded again.
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, PUT_MANY_CHUNK_SIZE))
+        if not chunk:
+            break
+        routed = [[] for i in range(shard_count)]
+        for key, value in chunk:
+            key, h = hash_key(key)
+            routed[shard_for_hash(h, shard_count)].append((key, value))
+        yield routed
+
+
+class ShardedReader(object):
+    '''A dictionary-like object for reading a database that was split into
+    shards, such as one written by ShardedWriter.
+
+    The shards are listed in the manifest at manifest_path, and each one is
+    opened with reader_cls.from_file_path(). reader_cls defaults to Reader,
+    Reader48 or Reader64, to match the manifest. kwargs can include any Reader
+    option. Shards written with one of the built-in hash functions record it,
+    but other hash functions must be passed as hashfn.
+
+    Lookups for a key visit only the shard that holds it. Iteration visits
+    each shard in turn, so records are in insertion order within each shard,
+    but not overall.'''
+
+    def __init__(self, manifest_path, reader_cls=None, **kwargs):
+        file_paths, pair_size = read_manifest(manifest_path)
+        if reader_cls is None:
+            try:
+                reader_cls = READER_CLASSES[pair_size]
+            except KeyError:
+                raise ValueError('unsupported pair_size: {}'.format(pair_size))
+
+        self.manifest_path = manifest_path
+        self.readers = []
+        try:
+            for file_path in file_paths:
+                self.readers.append(
+                    reader_cls.from_file_path(file_path, **kwargs)
+                )
+        except Exception:
+            self.close()
+            raise
+        self.hash_key = self.readers[0].hash_key
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Close each of the shards.'''
+        for reader in self.readers:
+            reader.close()
+
+    def _shard(self, key):
+        # Return the encoded key and the reader for the shard that holds it.
+        key, h = self.hash_key(key)
+        return key, self.readers[shard_for_hash(h, len(self.readers))]
+
+    def _group(self, keys):
+        # Return a list of the positions in keys (and the encoded keys) that
+        # belong to each shard.
+        hash_key = self.hash_key
+        shard_count = len(self.readers)
+        groups = [([], []) for reader in self.readers]
+        for i, key in enumerate(keys):
+            key, h = hash_key(key)
+            positions, shard_keys = groups[shard_for_hash(h, shard_count)]
+            positions.append(i)
+            shard_keys.append(key)
+        return groups
+
+    def __getitem__(self, key):
+        '''Like dict.__getitem__().'''
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def has_key(self, key):
+        '''Return True if key exists in the database.'''
+        return self.value_length(key) is not None
+    __contains__ = contains = has_key
+
+    def __len__(self):
+        '''Return the number of records in all of the shards.'''
+        return sum(len(reader) for reader in self.readers)
+
+    def iteritems(self):
+        '''Like dict.iteritems(), visiting each shard in turn.'''
+        return chain.from_iterable(r.iteritems() for r in self.readers)
+
+    def iter_batches(self, n=1024, keys_only=False):
+        '''Like Reader.iter_batches(), visiting each shard in turn.'''
+        return chain.from_iterable(
+            r.iter_batches(n, keys_only=keys_only) for r in self.readers
+        )
+
+    def items(self):
+        '''Like dict.items().'''
+        return list(self.iteritems())
+
+    def iterkeys(self):
+        '''Like dict.iterkeys().'''
+        return chain.from_iterable(r.iterkeys() for r in self.readers)
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        '''Like dict.itervalues().'''
+        return chain.from_iterable(r.itervalues() for r in self.readers)
+
+    def keys(self):
+        '''Like dict.keys().'''
+        return list(self.iterkeys())
+
+    def values(self):
+        '''Like dict.values().'''
+        return list(self.itervalues())
+
+    def get(self, key, default=None):
+        '''Get the first value for key, returning default if missing.'''
+        key, reader = self._shard(key)
+        return reader.get(key, default)
+
+    def gets(self, key):
+        '''Yield values for key in insertion order.'''
+        key, reader = self._shard(key)
+        return reader.gets(key)
+
+    def count(self, key):
+        '''Return the number of values stored for key, without reading
+        them.'''
+        key, reader = self._shard(key)
+        return reader.count(key)
+
+    def value_length(self, key, default=None):
+        '''Return the length of the first value for key without reading it,
+        returning default if missing.'''
+        key, reader = self._shard(key)
+        return reader.value_length(key, default)
+
+    def get_many(self, keys, default=None):
+        '''Like Reader.get_many(). Each shard looks up its keys in one
+        batch.'''
+        keys = list(keys)
+        results = [default] * len(keys)
+        for reader, (positions, shard_keys) in zip(
+            self.readers, self._group(keys)
+        ):
+            if shard_keys:
+                values = reader.get_many(shard_keys, default)
+                for i, value in zip(positions, values):
+                    results[i] = value
+        return results
+
+    def gets_many(self, keys):
+        '''Like Reader.gets_many(). Each shard looks up its keys in one
+        batch.'''
+        keys = list(keys)
+        results = [None] * len(keys)
+        for reader, (positions, shard_keys) in zip(
+            self.readers, self._group(keys)
+        ):
+            if shard_keys:
+                values = reader.gets_many(shard_keys)
+                for i, value in zip(positions, values):
+                    results[i] = value
+        return results
+
+    def getint(self, key, default=None, base=0):
+        '''Get the first value for key converted it to an int, returning
+        default if missing.'''
+        key, reader = self._shard(key)
+        return reader.getint(key, default, base)
+
+    def getints(self, key, base=0):
+        '''Yield values for key in insertion order after converting to int.'''
+        key, reader = self._shard(key)
+        return reader.getints(key, base)
+
+    def getstring(self, key, default=None, encoding='utf-8'):
+        '''Get the first value for key decoded as unicode, returning default if
+        not found.'''
+        key, reader = self._shard(key)
+        return reader.getstring(key, default, encoding)
+
+    def getstrings(self, key, encoding='utf-8'):
+        '''Yield values for key in insertion order after decoding as
+        unicode.'''
+        key, reader = self._shard(key)
+        return reader.getstrings(key, encoding)
+
+
+class ShardedWriter(object):
+    '''Object for building a database split into shard_count shards, with a
+    manifest at manifest_path. The shards are written next to the manifest,
+    named after it: info.json has shards info-0.cdb, info-1.cdb and so on.
+
+    Each shard is written by a writer_cls instance, created with kwargs. The
+    manifest is written when finalize() is called.'''
+
+    def __init__(self, manifest_path, shard_count, writer_cls=Writer,
+                 **kwargs):
+        if shard_count < 1:
+            raise ValueError('shard_count must be at least 1')
+        self.manifest_path = manifest_path
+        self.writer_cls = writer_cls
+        root = splitext(manifest_path)[0]
+        self.file_paths = [
+            '{}-{}.cdb'.format(root, i) for i in range(shard_count)
+        ]
+
+        self.writers = []
+        try:
+            for file_path in self.file_paths:
+                f = open(file_path, 'wb')
+                try:
+                    self.writers.append(writer_cls(f, **kwargs))
+                except Exception:
+                    f.close()
+                    raise
+        except Exception:
+            for writer in self.writers:
+                writer.fp.close()
+            raise
+        self.hash_key = self.writers[0].hash_key
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finalize()
+
+    def _shard(self, key):
+        # Return the encoded key and the writer for its shard.
+        key, h = self.hash_key(key)
+        return key, self.writers[shard_for_hash(h, len(self.writers))]
+
+    def put(self, key, value=b''):
+        '''Write a string key/value pair to the shard for key.'''
+        key, writer = self._shard(key)
+        writer.put(key, value)
+
+    def puts(self, key, values):
+        '''Write more than one value for the same key to the shard for key.'''
+        key, writer = self._shard(key)
+        writer.puts(key, values)
+
+    def putint(self, key, value):
+        '''Like Writer.putint().'''
+        key, writer = self._shard(key)
+        writer.putint(key, value)
+
+    def putints(self, key, values):
+        '''Like Writer.putints().'''
+        key, writer = self._shard(key)
+        writer.putints(key, values)
+
+    def putstring(self, key, value, encoding='utf-8'):
+        '''Like Writer.putstring().'''
+        key, writer = self._shard(key)
+        writer.putstring(key, value, encoding)
+
+    def putstrings(self, key, values, encoding='utf-8'):
+        '''Like Writer.putstrings().'''
+        key, writer = self._shard(key)
+        writer.putstrings(key, values, encoding)
+
+    def put_many(self, items):
+        '''Like Writer.put_many(). Records are sent to their shards in
+        batches.'''
+        for routed in _route(items, self.hash_key, len(self.writers)):
+            for writer, shard_items in zip(self.writers, routed):
+                if shard_items:
+                    writer.put_many(shard_items)
+
+    def put_many_columns(self, keys, values):
+        '''Like Writer.put_many_columns().'''
+        missing = object()
+
+        def items():
+            for key, value in zip_longest(keys, values, fillvalue=missing):
+                if (key is missing) or (value is missing):
+                    raise ValueError('keys and values must be the same length')
+                yield key, value
+
+        self.put_many(items())
+
+    def finalize(self):
+        '''Finish each shard, then write the manifest. The shards' files are
+        closed.'''
+        if self.writers[0].fp is None:
+            # Already finalized
+            return
+
+        for writer in self.writers:
+            f = writer.fp
+            writer.finalize()
+            f.close()
+        write_manifest(self.manifest_path, self.file_paths, self.writer_cls)
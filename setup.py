@@ -8,6 +8,14 @@ from setuptools import Extension, find_packages, setup
 if environ.get('ENABLE_DJB_HASH_CEXT', '1') != '0':
     ext_modules = [
         Extension('cdblib._djb_hash', sources=['cdblib/_djb_hash.c']),
+        Extension('cdblib._lookup', sources=['cdblib/_lookup.c'],
+                  depends=['cdblib/_cdb.h']),
+        Extension('cdblib._perfect', sources=['cdblib/_perfect.c'],
+                  depends=['cdblib/_cdb.h']),
+        Extension('cdblib._tables', sources=['cdblib/_tables.c'],
+                  depends=['cdblib/_cdb.h']),
+        Extension('cdblib._bloom', sources=['cdblib/_bloom.c']),
+        Extension('cdblib._hashes', sources=['cdblib/_hashes.c']),
     ]
 else:
     ext_modules = []
@@ -39,6 +47,7 @@ setup(
         'console_scripts': [
             'python-pure-cdbmake=cdblib.cdbmake:main',
             'python-pure-cdbdump=cdblib.cdbdump:main',
+            'python-pure-cdbcompact=cdblib.cdbcompact:main',
         ],
     },
 )
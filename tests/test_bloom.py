@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+import io
+import unittest
+
+from struct import pack
+
+import cdblib
+
+from cdblib.bloom import BloomFilter, key_hash
+
+
+class BloomFilterTests(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        hashes = [key_hash(str(i).encode('ascii'), i) for i in range(1000)]
+        for h in hashes:
+            bloom.add(h)
+        self.assertTrue(all(bloom.might_contain(h) for h in hashes))
+
+    def test_fp_rate(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(key_hash(str(i).encode('ascii'), i))
+
+        false_positives = sum(
+            bloom.might_contain(key_hash(str(i).encode('ascii'), i))
+            for i in range(1000, 11000)
+        )
+        self.assertLess(false_positives, 200)
+
+    def test_serialization(self):
+        bloom = BloomFilter.for_capacity(10, 0.1)
+        bloom.add(key_hash(b'dave', 1))
+        loaded = BloomFilter.from_bytes(bloom.to_bytes())
+        self.assertEqual(loaded.k, bloom.k)
+        self.assertEqual(loaded.block_count, bloom.block_count)
+        self.assertTrue(loaded.might_contain(key_hash(b'dave', 1)))
+
+        with self.assertRaises(ValueError):
+            BloomFilter.from_bytes(bloom.to_bytes()[:-1])
+
+    def test_might_contain_key(self):
+        # The C extension's version of might_contain_key() must agree with
+        # might_contain() and key_hash().
+        bloom = BloomFilter.for_capacity(100, 0.1)
+        for i in range(100):
+            bloom.add(key_hash(str(i).encode('ascii'), i))
+
+        for i in range(1000):
+            key = str(i).encode('ascii')
+            self.assertEqual(
+                bloom.might_contain_key(key, i),
+                bloom.might_contain(key_hash(key, i)),
+            )
+
+    def test_fp_rate_range(self):
+        for fp_rate in (0, 1, -0.5):
+            with self.assertRaises(ValueError):
+                BloomFilter.for_capacity(10, fp_rate)
+
+
+class BloomReaderTestBase(object):
+    def setUp(self):
+        with io.BytesIO() as f:
+            with self.writer_cls(f, bloom_fp_rate=0.01) as writer:
+                for i in range(1000):
+                    writer.putint(str(i), i)
+                writer.putints(b'dups', [1, 2])
+            self.data = f.getvalue()
+
+        self.reader = self.reader_cls(self.data)
+
+    def test_lookups(self):
+        self.assertIsNotNone(self.reader.bloom)
+        for i in range(1000):
+            self.assertEqual(self.reader.getint(str(i)), i)
+            self.assertEqual(self.reader.count(str(i)), 1)
+        self.assertEqual(list(self.reader.getints(b'dups')), [1, 2])
+
+        for key in (b'missing', b'1000', b'-1'):
+            self.assertIsNone(self.reader.get(key))
+            self.assertEqual(list(self.reader.gets(key)), [])
+            self.assertEqual(self.reader.count(key), 0)
+            self.assertNotIn(key, self.reader)
+        self.assertEqual(
+            self.reader.get_many([b'1', b'missing', b'2']), [b'1', None, b'2']
+        )
+
+    def test_rejects(self):
+        # With an empty filter nothing is found, so the filter must have been
+        # consulted.
+        self.reader.bloom = BloomFilter.for_capacity(1, 0.5)
+        self.assertIsNone(self.reader.get(b'1'))
+        self.assertEqual(list(self.reader.gets(b'1')), [])
+        self.assertEqual(self.reader.count(b'1'), 0)
+        self.assertIsNone(self.reader.value_length(b'1'))
+        self.assertEqual(self.reader.get_many([b'1']), [None])
+
+    def test_pure_python(self):
+        self.reader._c_lookup = None
+        self.assertEqual(self.reader.getint(b'999'), 999)
+        self.assertIsNone(self.reader.get(b'missing'))
+
+    def test_disabled(self):
+        reader = self.reader_cls(self.data, bloom=False)
+        self.assertIsNone(reader.bloom)
+        self.assertEqual(reader.getint(b'999'), 999)
+
+    def test_iteritems(self):
+        # The trailer doesn't show up as records.
+        items = self.reader.items()
+        self.assertEqual(len(items), 1002)
+        self.assertEqual(items[-1], (b'dups', b'2'))
+
+    def test_invalid_trailer(self):
+        # Data after the tables that isn't a valid trailer is ignored.
+        reader = self.reader_cls(self.data[:-1])
+        self.assertIsNone(reader.bloom)
+
+        reader = self.reader_cls(self.data[:-12] + self.data[-8:])
+        self.assertIsNone(reader.bloom)
+        self.assertEqual(reader.getint(b'999'), 999)
+
+        # Sections must be between the hash tables and the directory
+        entry_pos = len(self.data) - 12 - 20
+        data = bytearray(self.data)
+        data[entry_pos + 4:entry_pos + 12] = pack('<Q', 0)
+        reader = self.reader_cls(bytes(data))
+        self.assertIsNone(reader.bloom)
+
+    def test_might_contain_key(self):
+        # The C extension's version of might_contain_key() must agree with
+        # might_contain() and key_hash().
+        bloom = BloomFilter.for_capacity(100, 0.1)
+        for i in range(100):
+            bloom.add(key_hash(str(i).encode('ascii'), i))
+
+        for i in range(1000):
+            key = str(i).encode('ascii')
+            self.assertEqual(
+                bloom.might_contain_key(key, i),
+                bloom.might_contain(key_hash(key, i)),
+            )
+
+    def test_fp_rate_range(self):
+        with self.assertRaises(ValueError):
+            self.writer_cls(io.BytesIO(), bloom_fp_rate=1.5)
+
+
+class BloomReaderTestCase(BloomReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
+
+
+class BloomReader64TestCase(BloomReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+
+
+class BloomReader48TestCase(BloomReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader48
+    writer_cls = cdblib.Writer48
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+import io
+import unittest
+
+import cdblib
+
+
+class CachedReaderTestBase(object):
+    def setUp(self):
+        with io.BytesIO() as f:
+            with self.writer_cls(f) as writer:
+                writer.puts(b'dave', [b'1', b'2'])
+                writer.put(b'hex', b'0x1a')
+                writer.putstring(b'art', u'\N{SNOWMAN}')
+            self.data = f.getvalue()
+
+        self.reader = self.reader_cls(self.data)
+        self.cached = cdblib.CachedReader(self.reader, cache_size=2)
+
+    def test_get(self):
+        for i in range(3):
+            self.assertEqual(self.cached.get(b'dave'), b'1')
+            self.assertEqual(self.cached[b'dave'], b'1')
+        self.assertEqual(self.cached.hits, 5)
+        self.assertEqual(self.cached.misses, 1)
+        self.assertEqual(self.cached.evictions, 0)
+
+    def test_missing(self):
+        # Negative results are cached too, but the default isn't.
+        self.assertIsNone(self.cached.get(b'junk'))
+        self.assertEqual(self.cached.get(b'junk', b'default'), b'default')
+        self.assertNotIn(b'junk', self.cached)
+        self.assertFalse(self.cached.contains(b'junk'))
+        self.assertIn(b'dave', self.cached)
+        with self.assertRaises(KeyError):
+            self.cached[b'junk']
+        self.assertEqual(self.cached.hits, 4)
+        self.assertEqual(self.cached.misses, 2)
+
+    def test_eviction(self):
+        self.cached.get(b'dave')
+        self.cached.get(b'hex')
+        self.cached.get(b'dave')  # Now hex is the least recently used
+        self.cached.get(b'art')
+        self.assertEqual(self.cached.evictions, 1)
+        self.assertEqual(
+            list(self.cached._cache), [('get', b'dave'), ('get', b'art')]
+        )
+
+        self.cached.cache_clear()
+        self.assertEqual(len(self.cached._cache), 0)
+        self.assertEqual(self.cached.get(b'dave'), b'1')
+        self.assertEqual(self.cached.misses, 4)
+
+    def test_get_many(self):
+        self.cached.get(b'dave')
+        self.assertEqual(
+            self.cached.get_many([b'dave', b'hex', b'junk'], b'default'),
+            [b'1', b'0x1a', b'default'],
+        )
+        self.assertEqual(self.cached.hits, 1)
+        self.assertEqual(self.cached.misses, 3)
+        self.assertEqual(self.cached.evictions, 1)
+
+        # Everything is cached now
+        self.assertEqual(
+            self.cached.get_many([b'hex', b'junk']), [b'0x1a', None]
+        )
+        self.assertEqual(self.cached.hits, 3)
+
+    def test_gets(self):
+        for i in range(2):
+            self.assertEqual(list(self.cached.gets(b'dave')), [b'1', b'2'])
+            self.assertEqual(list(self.cached.gets(b'junk')), [])
+        self.assertEqual(self.cached.hits, 2)
+
+    def test_decoders(self):
+        for i in range(2):
+            self.assertEqual(self.cached.getint(b'hex'), 26)
+            self.assertEqual(self.cached.getint(b'junk', 1), 1)
+        self.assertEqual(self.cached.hits, 2)
+
+        self.assertEqual(self.cached.getint(b'dave', base=16), 1)
+        self.assertEqual(list(self.cached.getints(b'dave')), [1, 2])
+        self.assertEqual(self.cached.getstring(b'art'), u'\N{SNOWMAN}')
+        self.assertIsNone(self.cached.getstring(b'junk'))
+        self.assertEqual(
+            list(self.cached.getstrings(b'art')), [u'\N{SNOWMAN}']
+        )
+
+        # Conversion errors aren't cached
+        for i in range(2):
+            with self.assertRaises(ValueError):
+                self.cached.getint(b'art')
+
+    def test_unhashable_key(self):
+        cached = cdblib.CachedReader(
+            self.reader_cls(self.data, encoders={list: b''.join})
+        )
+        self.assertEqual(cached.get([b'da', b've']), b'1')
+        self.assertEqual(cached.get_many([[b'da', b've']]), [b'1'])
+        self.assertEqual(len(cached._cache), 0)
+
+    def test_passthrough(self):
+        self.assertEqual(len(self.cached), 4)
+        self.assertEqual(list(self.cached), self.reader.keys())
+        self.assertEqual(self.cached.items(), self.reader.items())
+        self.assertEqual(self.cached.count(b'dave'), 2)
+
+    def test_close(self):
+        with self.cached as cached:
+            cached.get(b'dave')
+        self.assertEqual(len(self.cached._cache), 0)
+
+    def test_cache_size(self):
+        with self.assertRaises(ValueError):
+            cdblib.CachedReader(self.reader, cache_size=0)
+
+
+class CachedReaderTestCase(CachedReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
+
+
+class CachedReader64TestCase(CachedReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+
+
+if __name__ == '__main__':
+    unittest.main()
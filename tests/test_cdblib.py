@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 import hashlib
 import io
+import tracemalloc
 import unittest
 
+from array import array
 from collections import defaultdict
 from functools import partial
+from math import ceil
+from mmap import PAGESIZE, mmap
 from os.path import abspath, dirname, join
-from struct import pack
+from struct import error as struct_error, pack
+from unittest.mock import patch
 from zlib import adler32
 
 import cdblib
@@ -68,6 +73,7 @@ class Reader64KnownGoodTestCase(ReaderKnownGoodTestCase):
 
 class ReaderDictLikeTestCase(unittest.TestCase):
     reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
     data_path = testdata_path('top250pws.cdb')
 
     def setUp(self):
@@ -88,6 +94,24 @@ class ReaderDictLikeTestCase(unittest.TestCase):
         for key in uniq_keys:
             self.assertTrue(self.reader[key] in uniq_values)
 
+    def test_iteritems_memory(self):
+        # Records are read one at a time, so large values don't pile up
+        with io.BytesIO() as f:
+            with self.writer_cls(f) as writer:
+                for i in range(40):
+                    writer.put(str(i).encode('ascii'), bytes([i]) * 500000)
+            reader = self.reader_cls(f.getvalue())
+
+        for method in (reader.iteritems, reader.itervalues):
+            tracemalloc.start()
+            try:
+                count = sum(1 for item in method())
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(count, 40)
+            self.assertLess(peak, 2000000)
+
     def test_items(self):
         for idx, (key, value) in enumerate(self.reader.items()):
             self.assertEqual(self.reader[key], value)
@@ -113,6 +137,89 @@ class ReaderDictLikeTestCase(unittest.TestCase):
     def test_values(self):
         self.assertEqual(self.reader.values(), list(self.reader.itervalues()))
 
+    def test_iter_batches(self):
+        items = self.reader.items()
+        batches = list(self.reader.iter_batches(100))
+        self.assertEqual([len(b) for b in batches], [100, 100, 50])
+        self.assertEqual([i for b in batches for i in b], items)
+
+        batches = list(self.reader.iter_batches(250, keys_only=True))
+        self.assertEqual(batches, [[k for k, v in items]])
+
+        with self.assertRaises(ValueError):
+            list(self.reader.iter_batches(0))
+
+    def test_partitions(self):
+        items = self.reader.items()
+        for n in (1, 2, 7, 1000):
+            partitions = self.reader.partitions(n)
+            self.assertLessEqual(len(partitions), n)
+            self.assertEqual(
+                [
+                    item for partition in partitions
+                    for batch in self.reader.iter_batches(partition=partition)
+                    for item in batch
+                ],
+                items,
+            )
+        self.assertEqual(len(self.reader.partitions(2)), 2)
+
+        with self.assertRaises(ValueError):
+            self.reader.partitions(0)
+
+        writer_cls = (
+            cdblib.Writer64 if self.reader_cls is cdblib.Reader64
+            else cdblib.Writer
+        )
+        with io.BytesIO() as f:
+            writer_cls(f).finalize()
+            self.assertEqual(self.reader_cls(f.getvalue()).partitions(4), [])
+
+    def test_parallel_map(self):
+        items = self.reader.items()
+        with self.assertRaises(ValueError):
+            self.reader.parallel_map(list)
+
+        for processes in (1, 3):
+            with self.reader_cls.from_file_path(self.data_path) as reader:
+                results = reader.parallel_map(list, processes=processes)
+                self.assertEqual(len(results), processes)
+                self.assertEqual(sum(results, []), items)
+
+        with self.reader_cls.from_file_path(self.data_path) as reader:
+            self.assertEqual(sum(reader.parallel_map(list), []), items)
+
+        with open(self.data_path, 'rb') as f:
+            with self.reader_cls.from_file_obj(f) as reader:
+                results = reader.parallel_map(
+                    list, processes=2, keys_only=True
+                )
+                self.assertEqual(sum(results, []), [k for k, v in items])
+
+    def test_parallel_map_options(self):
+        # Workers open the database with the same backend and options
+        items = self.reader.items()
+        for options, value_type in (
+            ({'backend': 'pread', 'cache_blocks': 8}, bytes),
+            ({'zero_copy': True}, memoryview),
+        ):
+            with self.reader_cls.from_file_path(
+                self.data_path, **options
+            ) as reader, patch.object(
+                self.reader_cls, 'from_file_path',
+                wraps=self.reader_cls.from_file_path,
+            ) as from_file_path:
+                results = sum(reader.parallel_map(list, processes=1), [])
+            expected = dict(
+                {'backend': 'mmap', 'cache_blocks': 256, 'zero_copy': False},
+                **options
+            )
+            from_file_path.assert_called_once_with(self.data_path, **expected)
+            self.assertIsInstance(results[0][1], value_type)
+            self.assertEqual(
+                [(bytes(k), bytes(v)) for k, v in results], items
+            )
+
     def test_has_key_contains(self):
         for key in self.reader:
             self.assertTrue(self.reader.has_key(key))
@@ -128,6 +235,31 @@ class ReaderDictLikeTestCase(unittest.TestCase):
         self.assertEqual(len(self.reader), 250)
         self.assertEqual(len(list(self.reader)), 250)
 
+    def test_len_counted(self):
+        # Without metadata, records are counted from the hash tables, which
+        # other tools might not make twice as big as the number of records
+        pair_format = '<LL' if (self.reader_cls.pair_size == 8) else '<QQ'
+        pair_size = self.reader_cls.pair_size
+        key, value = b'key', b'value'
+        h = cdblib.djb_hash(key)
+
+        record_pos = 256 * pair_size
+        table_pos = record_pos + pair_size + len(key) + len(value)
+        index = [(table_pos, 0)] * 256
+        index[h & 0xff] = (table_pos, 5)
+        table = [(0, 0)] * 5
+        table[(h >> 8) % 5] = (h, record_pos)
+
+        data = b''.join(
+            [pack(pair_format, *p) for p in index] +
+            [pack(pair_format, len(key), len(value)), key, value] +
+            [pack(pair_format, *p) for p in table]
+        )
+        reader = self.reader_cls(data)
+        self.assertIsNone(reader.metadata)
+        self.assertEqual(reader.get(key), value)
+        self.assertEqual(len(reader), 1)
+
     def test_get_no_default(self):
         get = self.reader.get
 
@@ -144,16 +276,31 @@ class ReaderDictLikeTestCase(unittest.TestCase):
         self.assertEqual(get(b'!!KinDaCompleX', b'default'), b'default')
         self.assertEqual(get(b'^^Hashes_Differently', b'default'), b'default')
 
+    def test_get_many_large_batch(self):
+        # Large enough to use the NumPy engine, if it's available
+        keys = self.reader.keys() * 10
+        keys.append(b'!!KinDaCompleX')
+        self.assertEqual(
+            self.reader.get_many(keys), [self.reader.get(k) for k in keys]
+        )
+        self.assertEqual(
+            self.reader.gets_many(keys),
+            [list(self.reader.gets(k)) for k in keys],
+        )
+
 
 class Reader64DictLikeTestCase(ReaderDictLikeTestCase):
     reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
     data_path = testdata_path('top250pws.cdb64')
 
 
 class ReaderNativeInterfaceTestBase(object):
     ARTS = (u'\N{SNOWMAN}', u'\N{CLOUD}', u'\N{UMBRELLA}')
+    ARTS_UTF8 = tuple(s.encode('utf-8') for s in ARTS)
     reader_cls = cdblib.Reader
     writer_cls = cdblib.Writer
+    pure_python = False
 
     def setUp(self):
         self.sio = sio = io.BytesIO()
@@ -166,6 +313,8 @@ class ReaderNativeInterfaceTestBase(object):
 
         sio.seek(0)
         self.reader = self.reader_cls(sio.getvalue(), hashfn=self.HASHFN)
+        if self.pure_python:
+            self.reader._c_lookup = None
 
     def test_min_size(self):
         with io.BytesIO() as f:
@@ -176,6 +325,33 @@ class ReaderNativeInterfaceTestBase(object):
         with self.assertRaises(OSError):
             reader = self.reader_cls(data[:-1], hashfn=self.HASHFN)
 
+    def test_non_buffer_data(self):
+        class Sequence(object):
+            # Supports slicing, but not the buffer protocol
+            def __init__(self, data):
+                self.data = data
+
+            def __len__(self):
+                return len(self.data)
+
+            def __getitem__(self, key):
+                return self.data[key]
+
+        reader = self.reader_cls(
+            Sequence(self.sio.getvalue()), hashfn=self.HASHFN
+        )
+        self.assertIsNone(reader._c_lookup)
+        self.assertIsNone(reader._numpy_engine)
+        self.assertEqual(reader.get(b'dave'), b'0')
+        self.assertEqual(
+            reader.gets_many([b'art'] * 3000)[-1], list(self.ARTS_UTF8)
+        )
+        reader.warm('all')
+        self.assertFalse(reader.advise('random'))
+        self.assertEqual(
+            reader.items(), self.reader_cls(self.sio.getvalue()).items()
+        )
+
     def test_insertion_order(self):
         keys  = [b'dave'] * 10
         keys.append(b'dave_no_dups')
@@ -212,6 +388,57 @@ class ReaderNativeInterfaceTestBase(object):
         )
         self.assertEqual(list(self.reader.gets(b'junk')), [])
 
+    def test_contains(self):
+        for key in (b'dave', b'dave_no_dups', b'art'):
+            self.assertTrue(self.reader.contains(key))
+            self.assertIn(key, self.reader)
+        self.assertFalse(self.reader.contains(b'junk'))
+        self.assertFalse(self.reader.has_key(b'dav'))
+
+    def test_count(self):
+        self.assertEqual(self.reader.count(b'dave'), 10)
+        self.assertEqual(self.reader.count(b'dave_no_dups'), 1)
+        self.assertEqual(self.reader.count(b'art'), 3)
+        self.assertEqual(self.reader.count(b'junk'), 0)
+
+    def test_value_length(self):
+        self.assertEqual(self.reader.value_length(b'dave_hex'), 4)
+        self.assertEqual(self.reader.value_length(b'art'), 3)
+        self.assertIsNone(self.reader.value_length(b'junk'))
+        self.assertEqual(self.reader.value_length(b'junk', -1), -1)
+
+    def test_get_many(self):
+        keys = [b'art', b'junk', b'dave', b'dave_no_dups', b'dave', b'junk']
+        self.assertEqual(
+            self.reader.get_many(keys),
+            [self.reader.get(key) for key in keys],
+        )
+        self.assertEqual(
+            self.reader.get_many(keys, default=b'wad'),
+            [self.reader.get(key, b'wad') for key in keys],
+        )
+        self.assertEqual(self.reader.get_many([]), [])
+
+    def test_gets_many(self):
+        keys = [b'dave', b'art', b'junk', b'dave_hex', b'dave']
+        self.assertEqual(
+            self.reader.gets_many(keys),
+            [list(self.reader.gets(key)) for key in keys],
+        )
+        self.assertEqual(self.reader.gets_many(iter(keys))[2], [])
+
+    @unittest.skipIf(
+        cdblib.cdblib._numpy_engine is None, 'NumPy is not available'
+    )
+    def test_lookup_many_numpy(self):
+        engine = cdblib.cdblib._numpy_engine
+        keys = [b'dave', u'art', b'junk', b'dave_hex', b'dave', b'', b'x' * 300]
+        for first in (True, False):
+            self.assertEqual(
+                engine.lookup_many(self.reader, keys, first),
+                self.reader._lookup_many(keys, first),
+            )
+
     def test_getint(self):
         self.assertEqual(self.reader.getint(b'dave'), 0)
         self.assertEqual(self.reader.getint(b'dave_no_dups'), 1)
@@ -261,6 +488,13 @@ class Reader64NativeInterfaceDjbHashTestCase(ReaderNativeInterfaceTestBase,
     HASHFN = staticmethod(cdblib.djb_hash)
 
 
+class Reader48NativeInterfaceDjbHashTestCase(ReaderNativeInterfaceTestBase,
+                                             unittest.TestCase):
+    reader_cls = cdblib.Reader48
+    writer_cls = cdblib.Writer48
+    HASHFN = staticmethod(cdblib.djb_hash)
+
+
 class ReaderNativeInterfaceNullHashTestCase(ReaderNativeInterfaceTestBase,
                                             unittest.TestCase):
     # Ensure collisions don't result in the wrong keys being returned.
@@ -275,6 +509,43 @@ class Reader64NativeInterfaceNullHashTestCase(ReaderNativeInterfaceTestBase,
     HASHFN = staticmethod(lambda s: 1)
 
 
+class Reader48NativeInterfaceNullHashTestCase(ReaderNativeInterfaceTestBase,
+                                              unittest.TestCase):
+    reader_cls = cdblib.Reader48
+    writer_cls = cdblib.Writer48
+    # Ensure collisions don't result in the wrong keys being returned.
+    HASHFN = staticmethod(lambda s: 1)
+
+
+class ReaderNativeInterfacePurePythonTestCase(ReaderNativeInterfaceTestBase,
+                                              unittest.TestCase):
+    HASHFN = staticmethod(cdblib.djb_hash)
+    pure_python = True
+
+
+class Reader64NativeInterfacePurePythonTestCase(ReaderNativeInterfaceTestBase,
+                                                unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+    HASHFN = staticmethod(cdblib.djb_hash)
+    pure_python = True
+
+
+class Reader48NativeInterfacePurePythonTestCase(ReaderNativeInterfaceTestBase,
+                                                unittest.TestCase):
+    reader_cls = cdblib.Reader48
+    writer_cls = cdblib.Writer48
+    HASHFN = staticmethod(cdblib.djb_hash)
+    pure_python = True
+
+
+class ReaderNativeInterfacePurePythonNullHashTestCase(
+    ReaderNativeInterfaceTestBase, unittest.TestCase
+):
+    HASHFN = staticmethod(lambda s: 1)
+    pure_python = True
+
+
 class ReaderNativeInterfaceAltHashTestCase(ReaderNativeInterfaceTestBase,
                                            unittest.TestCase):
     # Use the adler32 checksum as a "hash"
@@ -321,6 +592,57 @@ class ReaderInputTestBase(object):
         with self.assertRaises(TypeError):
             self.reader_cls(None)
 
+    def test_c_lookup(self):
+        # The C lookup code is used whenever it's available.
+        with getattr(self, self.init_method)() as reader:
+            self.assertIs(reader._c_lookup, cdblib.cdblib._lookup)
+
+    def test_advise_warm(self):
+        with getattr(self, self.init_method)() as reader:
+            # Advice only applies to memory maps
+            applied = (
+                isinstance(reader.data, mmap) and hasattr(mmap, 'madvise')
+            )
+            for advice in ('random', 'sequential', 'normal'):
+                self.assertEqual(reader.advise(advice), applied)
+            with self.assertRaises(ValueError):
+                reader.advise('willneed')
+
+            for region in ('tables', 'all'):
+                reader.warm(region)
+            with self.assertRaises(ValueError):
+                reader.warm('records')
+
+            items = reader.items()
+
+        with self.reader_cls.from_file_path(
+            self.file_path, advice='random', prefault='all'
+        ) as reader:
+            self.assertEqual(reader.items(), items)
+
+    def test_warm_pages(self):
+        # Every page that overlaps the region is touched, even if the region
+        # doesn't start on a page boundary
+        class RecordingSequence(object):
+            def __init__(self, data):
+                self.data = data
+                self.touched = []
+
+            def __getitem__(self, pos):
+                self.touched.append(pos)
+                return self.data[pos]
+
+        with getattr(self, self.init_method)() as reader:
+            for data in (reader.data, RecordingSequence(reader.data)):
+                with patch.object(reader, 'data', data), patch.object(
+                    reader, '_region', return_value=(100, PAGESIZE + 50)
+                ):
+                    reader.warm()
+            self.assertEqual(
+                [pos // PAGESIZE for pos in data.touched], [0, 1]
+            )
+
+
 class ReaderInputDataTests(ReaderInputTestBase, unittest.TestCase):
     reader_cls = cdblib.Reader
     init_method = '_get_bytes_reader'
@@ -357,6 +679,85 @@ class Reader64InputFilePathTests(ReaderInputTestBase, unittest.TestCase):
     file_path = testdata_path('pwdump.cdb64')
 
 
+class ReaderZeroCopyTestBase(object):
+    def setUp(self):
+        self.reader = self.reader_cls.from_file_path(
+            self.file_path, zero_copy=True
+        )
+        self.reader._c_lookup = self.c_lookup
+        with self.reader_cls.from_file_path(self.file_path) as reader:
+            self.items = reader.items()
+
+    def tearDown(self):
+        self.reader.close()
+
+    def test_iteritems(self):
+        items = self.reader.items()
+        self.assertEqual(items, self.items)
+        for key, value in items:
+            self.assertIs(type(key), memoryview)
+            self.assertIs(type(value), memoryview)
+
+    def test_get(self):
+        for key, value in self.items:
+            self.assertIn(value, list(self.reader.gets(key)))
+            self.assertIs(type(self.reader.get(key)), memoryview)
+            self.assertIs(type(self.reader[key]), memoryview)
+        self.assertIsNone(self.reader.get(b'junk'))
+        self.assertEqual(
+            self.reader.get_many([key for key, value in self.items]),
+            [self.reader.get(key) for key, value in self.items],
+        )
+
+    def test_decoders(self):
+        key = self.items[0][0]
+        value = self.items[0][1]
+        self.assertEqual(self.reader.getstring(key), value.decode('utf-8'))
+        self.assertEqual(
+            list(self.reader.getstrings(key)),
+            [bytes(v).decode('utf-8') for v in self.reader.gets(key)],
+        )
+        self.assertEqual(self.reader.getint(key), int(value))
+        self.assertEqual(list(self.reader.getints(key)), [int(value)])
+        self.assertEqual(self.reader.getint(b'junk', 1), 1)
+        with self.assertRaises(ValueError):
+            self.reader.getint(self.items[1][0])
+
+    def test_close(self):
+        # Views that are still alive keep the mapping open after close().
+        key, value = self.items[0]
+        view = self.reader.get(key)
+        self.reader.close()
+        self.assertEqual(view, value)
+        self.assertFalse(self.reader._source.closed)
+
+        # The mapping can be closed once they're released.
+        view.release()
+        self.reader.close()
+        self.assertTrue(self.reader._source.closed)
+        with self.assertRaises(ValueError):
+            self.reader.get(key)
+
+
+class ReaderZeroCopyTestCase(ReaderZeroCopyTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    file_path = testdata_path('pwdump.cdb')
+    c_lookup = cdblib.cdblib._lookup
+
+
+class Reader64ZeroCopyTestCase(ReaderZeroCopyTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    file_path = testdata_path('pwdump.cdb64')
+    c_lookup = cdblib.cdblib._lookup
+
+
+class ReaderZeroCopyPurePythonTestCase(ReaderZeroCopyTestBase,
+                                       unittest.TestCase):
+    reader_cls = cdblib.Reader
+    file_path = testdata_path('pwdump.cdb')
+    c_lookup = None
+
+
 class WriterNativeInterfaceTestBase(object):
     reader_cls = cdblib.Reader
     writer_cls = cdblib.Writer
@@ -375,6 +776,57 @@ class WriterNativeInterfaceTestBase(object):
         self.writer.put(b'dave', b'dave')
         self.assertEqual(self.get_reader().get(b'dave'), b'dave')
 
+    def test_put_many(self):
+        self.writer.put_many([(b'dave', b'1'), (b'art', b'2')])
+        self.writer.put_many_columns(iter([b'dave', b'art']), [b'3', b'4'])
+        reader = self.get_reader()
+        self.assertEqual(list(reader.gets(b'dave')), [b'1', b'3'])
+        self.assertEqual(list(reader.gets(b'art')), [b'2', b'4'])
+
+    def test_put_many_fail(self):
+        # put_many() fails the same way as calling put() in a loop: the
+        # records before the bad one are written.
+        for items, exc_type in [
+            ([(b'dave', b'1'), (u'art', b'2')], TypeError),
+            ([(b'dave', b'1'), (123, b'2')], TypeError),
+            ([(b'dave', b'1'), (b'art', u'2')], TypeError),
+            ([(b'dave', b'1'), (b'art',)], ValueError),
+        ]:
+            with io.BytesIO() as f:
+                writer = self.writer_cls(f, hashfn=self.HASHFN, strict=True)
+                with self.assertRaises(exc_type):
+                    writer.put_many(items)
+                writer.finalize()
+                reader = self.reader_cls(f.getvalue(), hashfn=self.HASHFN)
+                if exc_type is TypeError:
+                    self.assertEqual(reader.items(), [(b'dave', b'1')])
+
+        with self.assertRaises(ValueError):
+            self.writer.put_many_columns([b'dave', b'art'], [b'1'])
+
+    def test_put_many_encoding(self):
+        items = [
+            (u'dave', b'1'), (2, b'2'), (b'art', b'3'), (u'\N{SNOWMAN}', b'4')
+        ]
+        with io.BytesIO() as f:
+            with self.writer_cls(f, hashfn=self.HASHFN) as writer:
+                for key, value in items:
+                    writer.put(key, value)
+            expected = f.getvalue()
+
+        for encoders in (None, {int: lambda x: None}):
+            with io.BytesIO() as f:
+                with self.writer_cls(
+                    f, hashfn=self.HASHFN, encoders=encoders
+                ) as writer:
+                    try:
+                        writer.put_many(items)
+                    except TypeError:
+                        # The encoder for int doesn't return bytes
+                        self.assertIsNotNone(encoders)
+                        continue
+                self.assertEqual(f.getvalue(), expected)
+
     def test_put_fail(self):
         for key, value, exc_type in [
             # Key is not binary
@@ -492,6 +944,82 @@ class WriterNativeInterfaceTestBase(object):
         self.assertEqual(reader.get(key1), value)
         self.assertEqual(reader.get(key2), value)
 
+    def test_build_table(self):
+        # The C and Python code for building tables agree, including for
+        # collisions, wrapping around, and hashes of 0 (slots are only empty
+        # if their position is 0).
+        typecode = self.writer.table_typecode
+        pairs = array(typecode, [
+            0x100, 10, 0x100, 20, 0, 30, 0x300, 40, 0, 50, 0x1ff, 60, 0xb00, 70,
+        ])
+        tables = []
+        for c_tables in (cdblib.cdblib._tables, None):
+            with patch('cdblib.cdblib._tables', c_tables):
+                tables.append(self.writer._build_table(pairs, 14))
+                self.assertEqual(
+                    self.writer._build_table(array(typecode), 0), b''
+                )
+        self.assertEqual(tables[0], tables[1])
+
+        pair_size = self.writer.pair_size
+        slots = [
+            self.reader_cls.read_pair(tables[0][i:i + pair_size])
+            for i in range(0, len(tables[0]), pair_size)
+        ]
+        expected = [(0, 0)] * 14
+        expected[0] = (0, 30)
+        expected[1:6] = [
+            (0x100, 10), (0x100, 20), (0x300, 40), (0, 50), (0x1ff, 60),
+        ]
+        expected[11] = (0xb00, 70)
+        self.assertEqual(slots, expected)
+
+    def test_load_factor(self):
+        items = [(str(i).encode('ascii'), b'x' * i) for i in range(500)]
+        counts = [0] * 256
+        for key, value in items:
+            counts[self.HASHFN(key) & 0xff] += 1
+
+        outputs = {}
+        for load_factor in (None, 0.25, 0.5, 0.9, 0.999):
+            kwargs = {} if (load_factor is None) else {
+                'load_factor': load_factor
+            }
+            with io.BytesIO() as f:
+                with self.writer_cls(f, hashfn=self.HASHFN, **kwargs) as writer:
+                    writer.put_many(items)
+                outputs[load_factor] = data = f.getvalue()
+
+            # Each table has an empty slot
+            reader = self.reader_cls(data, hashfn=self.HASHFN)
+            for count, (pos, length) in zip(counts, reader.index):
+                self.assertEqual(
+                    length,
+                    count and max(count + 1, ceil(count / (load_factor or 0.5)))
+                )
+
+            self.assertEqual(reader.items(), items)
+            self.assertEqual(len(reader), len(items))
+            for key, value in items:
+                self.assertEqual(reader.get(key), value)
+            self.assertIsNone(reader.get(b'missing'))
+            self.assertEqual(
+                reader.get_many([b'missing', b'1']), [None, b'x']
+            )
+
+        # The default is the same as cdbmake's
+        self.assertEqual(outputs[None], outputs[0.5])
+
+        for load_factor in (0, 1, 1.5):
+            with self.assertRaises(ValueError):
+                self.writer_cls(io.BytesIO(), load_factor=load_factor)
+
+    def test_position_overflow(self):
+        # Records must start at a position that the format can store
+        self.writer._pos = 1 << (self.writer.pair_size * 4)
+        with self.assertRaises(OverflowError):
+            self.writer.put(b'key', b'value')
+
 
 class WriterNativeInterfaceDjbHashTestCase(WriterNativeInterfaceTestBase,
                                            unittest.TestCase):
@@ -505,6 +1033,13 @@ class Writer64NativeInterfaceDjbHashTestCase(WriterNativeInterfaceTestBase,
     HASHFN = staticmethod(cdblib.djb_hash)
 
 
+class Writer48NativeInterfaceDjbHashTestCase(WriterNativeInterfaceTestBase,
+                                             unittest.TestCase):
+    reader_cls = cdblib.Reader48
+    writer_cls = cdblib.Writer48
+    HASHFN = staticmethod(cdblib.djb_hash)
+
+
 class WriterNativeInterfaceNullHashTestCase(WriterNativeInterfaceTestBase,
                                             unittest.TestCase):
     HASHFN = staticmethod(lambda s: 1)
@@ -569,6 +1104,231 @@ class WriterKnownGoodTestBase(object):
         self.writer.puts(b'dave', (b'dave', b'dave'))
         self.assertEqual(self.get_md5(), self.DUP_KEYS_MD5)
 
+    def test_buffer_size(self):
+        # The output is the same regardless of buffering, including for
+        # values that are too big to buffer
+        for buffer_size in (0, 1, 100, 4096):
+            with io.BytesIO() as f:
+                with self.writer_cls(
+                    f, hashfn=self.HASHFN, strict=True, buffer_size=buffer_size
+                ) as writer:
+                    for key, value in self.get_iteritems(self.pwdump_path):
+                        writer.put(key, value)
+                self.assertEqual(
+                    hashlib.md5(f.getvalue()).hexdigest(), self.PWDUMP_MD5
+                )
+
+        with self.assertRaises(ValueError):
+            self.writer_cls(io.BytesIO(), buffer_size=-1)
+
+    def test_put_many(self):
+        # put_many() produces the same output as calling put() in a loop,
+        # including for large values and when there's a Bloom filter
+        for kwargs in (
+            {}, {'buffer_size': 20}, {'buffer_size': 1000},
+            {'bloom_fp_rate': 0.1},
+        ):
+            outputs = []
+            for method in ('put', 'put_many', 'put_many_columns'):
+                with io.BytesIO() as f:
+                    with self.writer_cls(
+                        f, hashfn=self.HASHFN, strict=True, **kwargs
+                    ) as writer:
+                        items = self.get_iteritems(self.pwdump_path)
+                        if method == 'put':
+                            for key, value in items:
+                                writer.put(key, value)
+                        elif method == 'put_many':
+                            writer.put_many(items)
+                        else:
+                            keys, values = zip(*items)
+                            writer.put_many_columns(keys, values)
+                    outputs.append(f.getvalue())
+            self.assertEqual(
+                hashlib.md5(outputs[0]).hexdigest(),
+                hashlib.md5(outputs[1]).hexdigest(),
+            )
+            self.assertEqual(outputs[0], outputs[2])
+            if not kwargs:
+                self.assertEqual(
+                    hashlib.md5(outputs[0]).hexdigest(), self.PWDUMP_MD5
+                )
+
+    def test_put_many_buffer_size(self):
+        # put_many() writes records in the same pieces that put() does, so its
+        # buffer doesn't grow past buffer_size.
+        class RecordingFile(io.BytesIO):
+            def write(self, b):
+                self.sizes.append(len(b))
+                return super(RecordingFile, self).write(b)
+
+        for buffer_size in (0, 100, 1000, 100000):
+            sizes = []
+            for method in ('put', 'put_many'):
+                with RecordingFile() as f:
+                    f.sizes = []
+                    writer = self.writer_cls(
+                        f, hashfn=self.HASHFN, buffer_size=buffer_size
+                    )
+                    items = self.get_iteritems(self.pwdump_path)
+                    if method == 'put':
+                        for key, value in items:
+                            writer.put(key, value)
+                    else:
+                        writer.put_many(items)
+                    sizes.append(f.sizes)
+                    writer.finalize()
+            self.assertEqual(sizes[0], sizes[1])
+
+    def test_put_many_memory(self):
+        # put_many() doesn't collect many large values before writing them
+        class DiscardingFile(object):
+            def tell(self):
+                return 0
+
+            def write(self, b):
+                return len(b)
+
+        for method in ('put_many', 'put_many_columns'):
+            writer = self.writer_cls(DiscardingFile(), hashfn=self.HASHFN)
+            keys = (str(i).encode('ascii') for i in range(200))
+            values = (bytes([i]) * 100000 for i in range(200))
+            tracemalloc.start()
+            try:
+                if method == 'put_many':
+                    writer.put_many(zip(keys, values))
+                else:
+                    writer.put_many_columns(keys, values)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(
+                writer._pos, (200 * writer.pair_size) + 490 + (200 * 100000)
+            )
+            self.assertLess(peak, 4000000)
+
+    def test_spill(self):
+        # Spilling hash table entries to disk doesn't change the output, with
+        # or without a Bloom filter
+        for kwargs in (
+            {}, {'buffer_size': 100}, {'buffer_size': 100, 'bloom_fp_rate': 0.1}
+        ):
+            outputs = []
+            for spill in (False, True):
+                with io.BytesIO() as f:
+                    writer = self.writer_cls(
+                        f, hashfn=self.HASHFN, strict=True, spill=spill,
+                        **kwargs
+                    )
+                    writer.put_many(self.get_iteritems(self.pwdump_path))
+                    if spill:
+                        # Entries are spilled as the buffer fills up
+                        spill_files = writer._spill_files
+                        self.assertEqual(any(spill_files), bool(kwargs))
+                    writer.finalize()
+                    outputs.append(f.getvalue())
+
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertIsNone(writer._spill_files)
+            self.assertTrue(all(f is None or f.closed for f in spill_files))
+
+        # Empty databases too
+        outputs = []
+        for spill in (False, True):
+            with io.BytesIO() as f:
+                self.writer_cls(
+                    f, hashfn=self.HASHFN, strict=True, spill=spill,
+                    bloom_fp_rate=0.1
+                ).finalize()
+                outputs.append(f.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_metadata(self):
+        items = list(self.get_iteritems(self.pwdump_path))
+        unique_keys = len({key for key, value in items})
+        records = len(items) + 2
+
+        outputs = []
+        for kwargs in (
+            {}, {'metadata': True}, {'metadata': True, 'spill': True},
+            {'metadata': True, 'spill': True, 'buffer_size': 100},
+        ):
+            with io.BytesIO() as f:
+                with self.writer_cls(
+                    f, hashfn=self.HASHFN, strict=True, **kwargs
+                ) as writer:
+                    writer.put_many(items[:100])
+                    for key, value in items[100:]:
+                        writer.put(key, value)
+                    writer.puts(items[0][0], [b'1', b'2'])
+                    writer.delete(b'deleted')
+                outputs.append(f.getvalue())
+
+            reader = self.reader_cls(outputs[-1], hashfn=self.HASHFN)
+            self.assertEqual(len(reader), records)
+            if not kwargs:
+                # Records are counted from the hash tables
+                self.assertIsNone(reader.metadata)
+                continue
+
+            self.assertEqual(reader.metadata, {
+                'records': records,
+                'unique_keys': unique_keys,
+                'tombstones': 1,
+                'hash': 'djb' if (self.HASHFN is cdblib.djb_hash) else None,
+                'pair_size': self.writer_cls.pair_size,
+                'record_bytes': reader.table_start - (256 * reader.pair_size),
+                'slots': 2 * records,
+                'largest_table': max(length for pos, length in reader.index),
+            })
+
+            # The metadata is stored after the hash tables, which don't change
+            end = min(offset for offset, length in reader._sections.values())
+            self.assertEqual(outputs[-1][:end], outputs[0][:end])
+            self.assertEqual(outputs[-1], outputs[1])
+
+        # Empty databases too
+        with io.BytesIO() as f:
+            self.writer_cls(f, hashfn=self.HASHFN, metadata=True).finalize()
+            reader = self.reader_cls(f.getvalue(), hashfn=self.HASHFN)
+            self.assertEqual(len(reader), 0)
+            self.assertEqual(reader.metadata['unique_keys'], 0)
+            self.assertEqual(reader.metadata['largest_table'], 0)
+
+        # Keys with the same hash and CRC are still counted separately, by
+        # reading them back - unless the file can't be read
+        class WriteOnlyFile(io.BytesIO):
+            def readable(self):
+                return False
+
+        for file_cls, expected in ((io.BytesIO, 3), (WriteOnlyFile, 2)):
+            with file_cls() as f:
+                with self.writer_cls(
+                    f, hashfn=lambda key: 1, metadata=True
+                ) as writer:
+                    writer.puts(b'plumless', [b'1', b'2'])
+                    writer.puts(b'buckeroo', [b'3', b'4'])
+                    writer.put(b'other', b'5')
+                    writer.put_many([(b'buckeroo', b'6'), (b'other', b'7')])
+                reader = self.reader_cls(f.getvalue(), hashfn=lambda key: 1)
+                self.assertEqual(reader.metadata['records'], 7)
+                self.assertEqual(reader.metadata['unique_keys'], expected)
+                self.assertEqual(
+                    list(reader.gets(b'buckeroo')), [b'3', b'4', b'6']
+                )
+
+        # Invalid metadata is ignored
+        for metadata in ('[]', '{', '"string"'):
+            with io.BytesIO() as f:
+                with patch('cdblib.cdblib.json_dumps', return_value=metadata):
+                    with self.writer_cls(
+                        f, hashfn=self.HASHFN, metadata=True
+                    ) as writer:
+                        writer.put(b'key', b'value')
+                reader = self.reader_cls(f.getvalue(), hashfn=self.HASHFN)
+                self.assertIsNone(reader.metadata)
+                self.assertEqual(len(reader), 1)
+
     def get_iteritems(self, filename):
         with open(filename, 'rb') as infile:
             data = infile.read()
@@ -659,6 +1419,54 @@ class Writer64KnownGoodNullHashTestCase(WriterKnownGoodTestBase,
     PWDUMP_MD5 = '5a8d1dd40d82af01cbb23ceab16c1588'
 
 
+class Writer48TestCase(unittest.TestCase):
+    def test_pairs(self):
+        # 48-bit integers are stored in 6 little-endian bytes
+        pair = cdblib.cdblib.write_2_le6((1 << 40) | 2, 0xffffffffffff)
+        self.assertEqual(pair, b'\x02\x00\x00\x00\x00\x01' + b'\xff' * 6)
+        self.assertEqual(
+            cdblib.cdblib.read_2_le6(pair), ((1 << 40) | 2, 0xffffffffffff)
+        )
+        self.assertEqual(
+            cdblib.cdblib.read_2_le6_from(b'x' + pair, 1),
+            ((1 << 40) | 2, 0xffffffffffff)
+        )
+        with self.assertRaises(struct_error):
+            cdblib.cdblib.write_2_le6(1 << 48, 0)
+
+    def test_pwdump(self):
+        # The records are the same as in a 64-bit database, and the hash
+        # tables are a quarter smaller
+        with cdblib.Reader64.from_file_path(
+            testdata_path('pwdump.cdb64')
+        ) as expected:
+            with io.BytesIO() as f:
+                with cdblib.Writer48(f) as writer:
+                    writer.put_many(expected.iteritems())
+                reader = cdblib.Reader48(f.getvalue())
+
+            self.assertEqual(reader.items(), expected.items())
+            self.assertEqual(len(reader), len(expected))
+            self.assertEqual(
+                [length for pos, length in reader.index],
+                [length for pos, length in expected.index]
+            )
+            table_bytes = [
+                len(r.data) - r.table_start for r in (reader, expected)
+            ]
+            self.assertEqual(table_bytes[0] * 4, table_bytes[1] * 3)
+
+    def test_limits(self):
+        # Positions and lengths are limited to 48 bits
+        writer = cdblib.Writer48(io.BytesIO())
+        writer._pos = (1 << 48) - 1
+        writer.put_many([(b'key', b'value')])
+        with self.assertRaises(OverflowError):
+            writer.put(b'key', b'value')
+        with self.assertRaises(OverflowError):
+            writer.put_many([(b'key', b'value')])
+
+
 class StrictnessTestsBase(object):
     def test_string_keys(self):
         with io.BytesIO() as f:
@@ -698,6 +1506,9 @@ class StrictnessTestsBase(object):
         self.assertEqual(list(reader.getints(4)), [41, 42])
         self.assertEqual(reader.getstring(5), u's51')
         self.assertEqual(list(reader.getstrings(6)), [u's61', u'62'])
+        self.assertEqual(
+            reader.get_many([1, u'5', b'7']), [b'11', b's51', None]
+        )
 
     def test_encoding(self):
         # b'1', u'1', and 1 all encode to the same thing, so writing to
@@ -753,6 +1564,11 @@ class StrictnessTests64(StrictnessTestsBase, unittest.TestCase):
     reader_cls = cdblib.Reader64
     writer_cls = cdblib.Writer64
 
+
+class StrictnessTests48(StrictnessTestsBase, unittest.TestCase):
+    reader_cls = cdblib.Reader48
+    writer_cls = cdblib.Writer48
+
 class TestCDBBase(unittest.TestCase):
 
     def test_cdbase(self):
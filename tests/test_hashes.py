@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+import io
+import unittest
+
+from importlib.util import find_spec, module_from_spec
+from os import urandom
+from unittest.mock import patch
+
+import cdblib
+import cdblib.hashes
+
+from cdblib.hashes import get_hash_function, hash_function_name
+
+
+def load_pure_python():
+    # Return a separate copy of cdblib.hashes, loaded without the C
+    # extension
+    with patch.dict('sys.modules', {'cdblib._hashes': None}):
+        spec = find_spec('cdblib.hashes')
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+class HashFunctionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.modules = [cdblib.hashes, load_pure_python()]
+
+    def test_murmur3_known_good(self):
+        for module in self.modules:
+            murmur3_hash = module.murmur3_hash
+            self.assertEqual(murmur3_hash(b''), 0)
+            self.assertEqual(murmur3_hash(b'hello'), 0x248bfa47)
+            self.assertEqual(
+                murmur3_hash(b'The quick brown fox jumps over the lazy dog'),
+                0x2e4ff723
+            )
+
+    def test_xxh32_known_good(self):
+        for module in self.modules:
+            xxh32_hash = module.xxh32_hash
+            self.assertEqual(xxh32_hash(b''), 0x02cc5d05)
+            self.assertEqual(xxh32_hash(b'abc'), 0x32d153ff)
+            self.assertEqual(
+                xxh32_hash(b'Nobody inspects the spammish repetition'),
+                0xe2293b2f
+            )
+
+    def test_pure_python(self):
+        # The C extension (if it's built) and the pure Python functions
+        # agree, for each length of tail.
+        for length in range(40):
+            s = urandom(length)
+            for name in ('murmur3_hash', 'xxh32_hash'):
+                self.assertEqual(
+                    getattr(self.modules[0], name)(s),
+                    getattr(self.modules[1], name)(s),
+                )
+
+    def test_registry(self):
+        self.assertIs(get_hash_function('djb'), cdblib.djb_hash)
+        self.assertIs(get_hash_function('murmur3'), cdblib.murmur3_hash)
+        self.assertIs(get_hash_function('xxh32'), cdblib.xxh32_hash)
+        with self.assertRaises(ValueError):
+            get_hash_function('md5')
+
+        self.assertEqual(hash_function_name(cdblib.xxh32_hash), 'xxh32')
+        self.assertIsNone(hash_function_name(lambda s: 0))
+
+
+class StoredHashTestBase(object):
+    def write(self, **kwargs):
+        with io.BytesIO() as f:
+            with self.writer_cls(f, **kwargs) as writer:
+                for i in range(1000):
+                    writer.putint(i, i)
+                writer.put(b'a', b'1')
+            return f.getvalue()
+
+    def test_auto_detect(self):
+        for name in ('murmur3', 'xxh32'):
+            hashfn = get_hash_function(name)
+            for writer_hashfn in (name, hashfn):
+                data = self.write(hashfn=writer_hashfn, metadata=True)
+                reader = self.reader_cls(data)
+                self.assertIs(reader.hashfn, hashfn)
+                self.assertEqual(reader.metadata['hash'], name)
+                self.assertEqual(reader.get(b'a'), b'1')
+                self.assertEqual(reader.getint(999), 999)
+                self.assertEqual(len(reader), 1001)
+
+                # Giving the same function is allowed
+                for reader_hashfn in (name, hashfn):
+                    reader = self.reader_cls(data, hashfn=reader_hashfn)
+                    self.assertEqual(reader.getint(0), 0)
+
+    def test_default(self):
+        # Databases using djb_hash are standard cdb files, without a record
+        # of the hash function.
+        data = self.write()
+        self.assertEqual(data, self.write(hashfn='djb'))
+        self.assertEqual(data, self.write(hashfn=cdblib.djb_hash))
+        reader = self.reader_cls(data)
+        self.assertIs(reader.hashfn, cdblib.djb_hash)
+        self.assertEqual(reader.getint(1), 1)
+
+        # Neither are databases with other hash functions
+        data = self.write(hashfn=lambda s: 1)
+        self.assertEqual(self.reader_cls(data, hashfn=lambda s: 1).get(b'a'),
+                         b'1')
+
+        with self.assertRaises(ValueError):
+            self.writer_cls(io.BytesIO(), hashfn='md5')
+
+    def test_zero_hash(self):
+        # murmur3_hash(b'') is 0, and the other keys go in the same slot of
+        # the same table. None of them are lost.
+        self.assertEqual(cdblib.murmur3_hash(b''), 0)
+        items = [(b'', b'empty'), (b'422', b'1'), (b'4177', b'2'),
+                 (b'9684', b'3')]
+        with io.BytesIO() as f:
+            with self.writer_cls(f, hashfn='murmur3') as writer:
+                writer.put_many(items)
+            reader = self.reader_cls(f.getvalue())
+        self.assertEqual(reader.index[0][1], 8)
+        self.assertEqual(len(reader), 4)
+        self.assertEqual(reader.items(), items)
+        for key, value in items:
+            self.assertEqual(reader.get(key), value)
+
+    def test_mismatch(self):
+        data = self.write(hashfn='murmur3')
+        for hashfn in ('djb', 'xxh32', cdblib.djb_hash, lambda s: 1):
+            with self.assertRaises(ValueError):
+                self.reader_cls(data, hashfn=hashfn)
+
+    def test_unknown(self):
+        # A database recording an unknown hash function can't be read
+        data = self.write(hashfn='xxh32').replace(b'xxh32', b'xxh99')
+        with self.assertRaises(ValueError):
+            self.reader_cls(data)
+
+
+class StoredHashTestCase(StoredHashTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
+
+
+class StoredHash64TestCase(StoredHashTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+
+
+class StoredHash48TestCase(StoredHashTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader48
+    writer_cls = cdblib.Writer48
+
+
+if __name__ == '__main__':
+    unittest.main()
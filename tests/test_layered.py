@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+import io
+import tracemalloc
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import cdblib
+
+from cdblib.layered import compact
+
+
+class LayeredReaderTestBase(object):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+
+        def base(writer):
+            writer.put(b'a', b'1')
+            writer.puts(b'b', [b'2', b'3'])
+            writer.put(b'c', b'4')
+            writer.putint(b'd', 5)
+            writer.put(b'e', b'6')
+
+        def delta1(writer):
+            # Replace b, delete c and d, then add d back
+            writer.put(b'b', b'7')
+            writer.delete(b'c')
+            writer.delete(u'd')
+            writer.putint(b'd', 8)
+            writer.put(b'f', b'9')
+
+        def delta2(writer):
+            # Delete f and e, and replace a
+            writer.delete(b'f')
+            writer.delete(b'e')
+            writer.putstring(b'a', u'☃')
+
+        self.file_paths = [
+            self.write(name, func)
+            for name, func in (('0', base), ('1', delta1), ('2', delta2))
+        ]
+        self.reader = cdblib.LayeredReader.from_file_paths(
+            self.file_paths, reader_cls=self.reader_cls
+        )
+        self.expected = [
+            (b'b', b'7'), (b'd', b'8'), (b'a', u'☃'.encode('utf-8')),
+        ]
+
+    def tearDown(self):
+        self.reader.close()
+        rmtree(self.temp_dir, ignore_errors=False)
+
+    def write(self, name, func, **kwargs):
+        file_path = join(self.temp_dir, name)
+        with open(file_path, 'wb') as f:
+            with self.writer_cls(f, **kwargs) as writer:
+                func(writer)
+        return file_path
+
+    def test_tombstones(self):
+        layers = self.reader.layers
+        self.assertEqual(layers[0].tombstones, frozenset())
+        self.assertEqual(layers[1].tombstones, {b'c', b'd'})
+        self.assertEqual(layers[2].tombstones, {b'f', b'e'})
+
+        # Tombstones aren't records
+        self.assertEqual(layers[2].items(), [(b'a', b'\xe2\x98\x83')])
+        self.assertIsNone(layers[2].get(b'f'))
+
+        # They're stored alongside Bloom filters
+        def delta(writer):
+            writer.delete(b'x' * 1000)
+            writer.put(b'y', b'z')
+
+        file_path = self.write('bloom', delta, bloom_fp_rate=0.1)
+        with self.reader_cls.from_file_path(file_path) as reader:
+            self.assertIsNotNone(reader.bloom)
+            self.assertEqual(reader.tombstones, {b'x' * 1000})
+            self.assertEqual(reader.items(), [(b'y', b'z')])
+
+        with self.assertRaises(TypeError):
+            self.writer_cls(io.BytesIO(), strict=True).delete(u'a')
+        with self.assertRaises(TypeError):
+            self.writer_cls(
+                io.BytesIO(), hashfn=lambda key: 0, encoders={int: str}
+            ).delete(1)
+
+    def test_lookups(self):
+        reader = self.reader
+        self.assertEqual(reader.getstring(b'a'), u'☃')
+        self.assertEqual(list(reader.gets(b'b')), [b'7'])
+        self.assertEqual(reader.getint(b'd'), 8)
+        self.assertEqual(list(reader.getints(b'd')), [8])
+        self.assertEqual(list(reader.getstrings(b'a')), [u'☃'])
+        self.assertEqual(reader[b'b'], b'7')
+        self.assertEqual(reader.count(b'b'), 1)
+        self.assertEqual(reader.value_length(b'b'), 1)
+        self.assertIn(b'b', reader)
+        self.assertIn(u'b', reader)
+
+        for key in (b'c', b'e', b'f', b'missing'):
+            self.assertIsNone(reader.get(key))
+            self.assertEqual(reader.get(key, b'x'), b'x')
+            self.assertIsNone(reader.getint(key))
+            self.assertIsNone(reader.getstring(key))
+            self.assertEqual(list(reader.gets(key)), [])
+            self.assertEqual(reader.count(key), 0)
+            self.assertIsNone(reader.value_length(key))
+            self.assertNotIn(key, reader)
+            with self.assertRaises(KeyError):
+                reader[key]
+
+    def test_batch_lookups(self):
+        keys = [b'a', b'b', b'c', b'd', b'e', b'f', b'missing', u'b']
+        self.assertEqual(
+            self.reader.get_many(keys, b''),
+            [self.reader.get(key, b'') for key in keys]
+        )
+        self.assertEqual(
+            self.reader.gets_many(keys),
+            [list(self.reader.gets(key)) for key in keys]
+        )
+        self.assertEqual(self.reader.get_many([]), [])
+
+    def test_iteration(self):
+        reader = self.reader
+        self.assertEqual(reader.items(), self.expected)
+        self.assertEqual(reader.keys(), [k for k, v in self.expected])
+        self.assertEqual(list(reader), [k for k, v in self.expected])
+        self.assertEqual(reader.values(), [v for k, v in self.expected])
+        self.assertEqual(len(reader), 3)
+
+        # A single layer is just that database
+        with cdblib.LayeredReader.from_file_paths(
+            self.file_paths[:1], reader_cls=self.reader_cls
+        ) as reader:
+            self.assertEqual(len(reader), 6)
+            self.assertEqual(reader.items(), reader.layers[0].items())
+            self.assertEqual(reader.keys(), reader.layers[0].keys())
+
+    def test_compact(self):
+        with io.BytesIO() as f:
+            compact(self.reader, f, writer_cls=self.writer_cls)
+            merged = self.reader_cls(f.getvalue())
+            self.assertEqual(merged.items(), self.expected)
+            self.assertEqual(merged.tombstones, frozenset())
+
+        # The merged database uses the layers' hash function
+        def layer(writer):
+            writer.put(b'a', b'1')
+
+        file_paths = [
+            self.write(name, layer, hashfn='xxh32') for name in ('x0', 'x1')
+        ]
+        with cdblib.LayeredReader.from_file_paths(
+            file_paths, reader_cls=self.reader_cls
+        ) as reader:
+            self.assertIs(reader.hashfn, cdblib.xxh32_hash)
+            with io.BytesIO() as f:
+                compact(reader, f, writer_cls=self.writer_cls)
+                merged = self.reader_cls(f.getvalue())
+                self.assertIs(merged.hashfn, cdblib.xxh32_hash)
+                self.assertEqual(merged.items(), [(b'a', b'1')])
+
+    def test_compact_memory(self):
+        # Records are streamed, so large values aren't all held in memory
+        def layer(writer):
+            for i in range(200):
+                writer.put(str(i).encode('ascii'), bytes([i]) * 100000)
+
+        file_paths = [self.write('large', layer)]
+        with cdblib.LayeredReader.from_file_paths(
+            file_paths, reader_cls=self.reader_cls
+        ) as reader:
+            with open(join(self.temp_dir, 'compacted'), 'wb') as f:
+                tracemalloc.start()
+                try:
+                    compact(reader, f, writer_cls=self.writer_cls)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+        self.assertLess(peak, 4000000)
+
+        with self.reader_cls.from_file_path(f.name) as merged:
+            self.assertEqual(len(merged), 200)
+            self.assertEqual(merged.get(b'199'), bytes([199]) * 100000)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            cdblib.LayeredReader([])
+
+        # Layers that were opened are closed again
+        with self.assertRaises(OSError):
+            cdblib.LayeredReader.from_file_paths(
+                [self.file_paths[0], join(self.temp_dir, 'missing')],
+                reader_cls=self.reader_cls,
+            )
+
+
+class LayeredReaderTestCase(LayeredReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
+
+
+class LayeredReader64TestCase(LayeredReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+
+
+class LayeredReader48TestCase(LayeredReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader48
+    writer_cls = cdblib.Writer48
+
+
+if __name__ == '__main__':
+    unittest.main()
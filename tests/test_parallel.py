@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import io
+import os
+import unittest
+
+from functools import partial
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import cdblib
+
+from cdblib.sharded import shard_for_hash
+from tests.test_cdblib import testdata_path
+
+
+def read_items(file_path, reader_cls):
+    # An input function, as would be used to read a file in each worker
+    with reader_cls.from_file_path(file_path) as reader:
+        return reader.items()
+
+
+class ParallelBuildTestBase(object):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        with self.reader_cls.from_file_path(self.data_path) as reader:
+            self.items = reader.items()
+
+        # Uneven inputs, including an empty one
+        self.inputs = [
+            self.items[:100], [], self.items[100:150], self.items[150:],
+        ]
+
+    def tearDown(self):
+        rmtree(self.temp_dir, ignore_errors=False)
+
+    def get_expected(self, items, **kwargs):
+        with io.BytesIO() as f:
+            with self.writer_cls(f, **kwargs) as writer:
+                writer.put_many(items)
+            return f.getvalue()
+
+    def test_parallel_build(self):
+        # The output is the same as writing the inputs in order
+        file_path = join(self.temp_dir, 'out.cdb')
+        for processes in (1, 2):
+            for kwargs in (
+                {}, {'bloom_fp_rate': 0.1},
+                {'spill': True, 'buffer_size': 100},
+                {'metadata': True, 'bloom_fp_rate': 0.1},
+            ):
+                cdblib.parallel_build(
+                    file_path, self.inputs, processes=processes,
+                    writer_cls=self.writer_cls, temp_dir=self.temp_dir,
+                    **kwargs
+                )
+                with open(file_path, 'rb') as f:
+                    self.assertEqual(
+                        f.read(), self.get_expected(self.items, **kwargs)
+                    )
+
+        # Only the output is left behind
+        self.assertEqual(os.listdir(self.temp_dir), ['out.cdb'])
+
+    def test_input_functions(self):
+        file_path = join(self.temp_dir, 'out.cdb')
+        cdblib.parallel_build(
+            file_path,
+            [partial(read_items, self.data_path, self.reader_cls)] * 2,
+            processes=2, writer_cls=self.writer_cls,
+        )
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), self.get_expected(self.items * 2))
+
+    def test_parallel_build_shards(self):
+        file_paths = [join(self.temp_dir, str(i)) for i in range(3)]
+        hashfn = cdblib.djb_hash
+        for processes in (1, 2):
+            cdblib.parallel_build_shards(
+                file_paths, self.inputs, processes=processes,
+                writer_cls=self.writer_cls, bloom_fp_rate=0.1,
+            )
+
+            # Each shard holds the records for its keys, in order
+            for i, file_path in enumerate(file_paths):
+                expected = [
+                    (key, value) for key, value in self.items
+                    if shard_for_hash(hashfn(key), 3) == i
+                ]
+                self.assertTrue(expected)
+                with open(file_path, 'rb') as f:
+                    self.assertEqual(
+                        f.read(),
+                        self.get_expected(expected, bloom_fp_rate=0.1)
+                    )
+
+        with self.assertRaises(ValueError):
+            cdblib.parallel_build_shards([], self.inputs)
+
+    def test_errors(self):
+        # Errors in workers are raised, and temporary files are removed
+        file_path = join(self.temp_dir, 'out.cdb')
+        for processes in (1, 2):
+            with self.assertRaises(TypeError):
+                cdblib.parallel_build(
+                    file_path, [self.items, [(b'key', 1)]],
+                    processes=processes, temp_dir=self.temp_dir,
+                    writer_cls=self.writer_cls,
+                )
+            self.assertEqual(os.listdir(self.temp_dir), [])
+
+
+class ParallelBuildTestCase(ParallelBuildTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
+    data_path = testdata_path('pwdump.cdb')
+
+
+class ParallelBuild64TestCase(ParallelBuildTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+    data_path = testdata_path('pwdump.cdb64')
+
+
+if __name__ == '__main__':
+    unittest.main()
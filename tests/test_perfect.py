@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+import io
+import tracemalloc
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+import cdblib
+
+from cdblib.cdblib import PERFECT_TAG
+from cdblib.perfect import build, convert, header, perfect_hashes
+
+
+class PerfectHashTestCase(unittest.TestCase):
+    def test_build(self):
+        # Each hash gets its own slot, with the C code or without it
+        for count in (1, 2, 3, 10, 1000):
+            hashes = [(i * 0x9e3779b1) & 0xffffffff for i in range(count)]
+            results = []
+            for c_perfect in (cdblib.perfect._perfect, None):
+                with patch('cdblib.perfect._perfect', c_perfect):
+                    results.append(build(hashes))
+            self.assertEqual(results[0], results[1])
+
+            seed, result, order = results[0]
+            bucket_count = len(result) // 2
+            self.assertEqual(sorted(order), list(range(count)))
+            for slot, i in enumerate(order):
+                bucket, f1, f2 = perfect_hashes(
+                    hashes[i], seed, bucket_count, count
+                )
+                d0, d1 = result[2 * bucket], result[(2 * bucket) + 1]
+                self.assertEqual((f1 + (d0 * f2) + d1) % count, slot)
+
+    def test_build_impossible(self):
+        # Hashes that are the same can't be told apart
+        for c_perfect in (cdblib.perfect._perfect, None):
+            with patch('cdblib.perfect._perfect', c_perfect):
+                with self.assertRaises(ValueError):
+                    build([1, 2, 1])
+
+
+class PerfectTestBase(object):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+
+        # Some keys have several values, and some share their hash with
+        # others: b'000C' and b'001b', and b'000B' and b'001c'.
+        self.items = [(str(i).encode('ascii'), b'v' * i) for i in range(300)]
+        self.items += [
+            (b'dup', b'1'), (b'other', b'x'), (b'dup', b'2'), (b'dup', b'3'),
+            (b'000C', b'4'), (b'001b', b'5'), (b'001b', b'6'), (b'001c', b'7'),
+        ]
+        self.keys = [k for k, v in self.items] + [
+            b'missing', b'000B', u'1', 2,
+        ]
+        self.data = self.write(self.items)
+        self.reader = self.reader_cls(self.data)
+        self.expected = cdblib.Reader(self.write(self.items, cdblib.Writer))
+
+    def tearDown(self):
+        rmtree(self.temp_dir, ignore_errors=False)
+
+    def write(self, items, writer_cls=None, **kwargs):
+        with io.BytesIO() as f:
+            with (writer_cls or self.writer_cls)(f, **kwargs) as writer:
+                writer.put_many(items)
+            return f.getvalue()
+
+    def check(self, reader, expected=None):
+        # Lookups with reader agree with the expected reader
+        expected = expected or self.expected
+        for key in self.keys:
+            self.assertEqual(reader.get(key), expected.get(key))
+            self.assertEqual(reader.get(key, b'-'), expected.get(key, b'-'))
+            self.assertEqual(list(reader.gets(key)), list(expected.gets(key)))
+            self.assertEqual(reader.count(key), expected.count(key))
+            self.assertEqual(
+                reader.value_length(key), expected.value_length(key)
+            )
+            self.assertEqual(
+                reader.value_length(key, -1), expected.value_length(key, -1)
+            )
+            self.assertEqual(key in reader, key in expected)
+
+        self.assertEqual(
+            reader.get_many(self.keys, b'-'), expected.get_many(self.keys, b'-')
+        )
+        self.assertEqual(
+            reader.gets_many(self.keys), expected.gets_many(self.keys)
+        )
+        self.assertEqual(reader.items(), expected.items())
+
+    def test_lookups(self):
+        self.assertIsNotNone(self.reader._perfect)
+        self.check(self.reader)
+
+        # The Python code gives the same results as the C code
+        self.reader._c_perfect = self.reader._c_lookup = None
+        self.check(self.reader)
+
+    def test_standard(self):
+        # Databases are still readable without the function
+        self.check(self.base_reader_cls(self.data))
+
+        # And the function is built the same way without the C code
+        with patch('cdblib.perfect._perfect', None):
+            self.assertEqual(self.write(self.items), self.data)
+
+    def test_shared_hashes(self):
+        # With a hash function that gives every key the same hash, every
+        # lookup falls back to the hash tables
+        data = self.write(self.items, hashfn=lambda key: 1)
+        for c_perfect in (cdblib.perfect._perfect, None):
+            reader = self.reader_cls(data, hashfn=lambda key: 1)
+            reader._c_perfect = c_perfect
+            self.check(reader)
+
+    def test_without_function(self):
+        # Databases without the function (or with an invalid one) are read
+        # like Reader does
+        reader = self.reader_cls(self.write(self.items, self.base_writer_cls))
+        self.assertIsNone(reader._perfect)
+        self.check(reader)
+
+        section_pos, length = self.reader._sections[PERFECT_TAG]
+        corrupt = bytearray(self.data)
+        corrupt[section_pos + 4:section_pos + 8] = b'\xff' * 4
+        reader = self.reader_cls(bytes(corrupt))
+        self.assertIsNone(reader._perfect)
+        self.check(reader)
+
+    def test_empty(self):
+        data = self.write([])
+        reader = self.reader_cls(data)
+        self.assertIsNotNone(reader._perfect)
+        offset = reader._perfect
+        self.assertEqual(
+            header.unpack(data[offset:offset + header.size]), (0, 0, 0)
+        )
+        for c_perfect in (cdblib.perfect._perfect, None):
+            reader._c_perfect = c_perfect
+            self.assertIsNone(reader.get(b'a'))
+            self.assertEqual(list(reader.gets(b'a')), [])
+            self.assertEqual(reader.count(b'a'), 0)
+            self.assertIsNone(reader.value_length(b'a'))
+            self.assertEqual(reader.get_many([b'a', b'b']), [None, None])
+
+    def test_options(self):
+        # Bloom filters, metadata, other hash functions, and memoryviews
+        data = self.write(
+            self.items, bloom_fp_rate=0.01, metadata=True, hashfn='xxh32'
+        )
+        reader = self.reader_cls(data, zero_copy=True)
+        self.assertIsNotNone(reader.bloom)
+        self.assertEqual(reader.metadata['unique_keys'], 305)
+        self.assertIsInstance(reader.get(b'1'), memoryview)
+        expected = cdblib.Reader(self.write(
+            self.items, cdblib.Writer, hashfn='xxh32'
+        ))
+        for c_perfect in (cdblib.perfect._perfect, None):
+            reader._c_perfect = c_perfect
+            self.check(reader, expected)
+
+        # The pread backend
+        file_path = join(self.temp_dir, 'perfect.cdb')
+        with open(file_path, 'wb') as f:
+            f.write(self.data)
+        with self.reader_cls.from_file_path(
+            file_path, backend='pread'
+        ) as reader:
+            self.assertIsNone(reader._c_perfect)
+            self.check(reader)
+
+    @unittest.skipIf(cdblib.perfect._perfect is None, 'requires C extension')
+    def test_corrupt(self):
+        # Slots that point outside the data are rejected by the C code
+        section_pos, length = self.reader._sections[PERFECT_TAG]
+        seed, bucket_count, slot_count = header.unpack(
+            self.data[section_pos:section_pos + header.size]
+        )
+        slots_pos = section_pos + header.size + (8 * bucket_count)
+        pair_size = self.reader.pair_size
+        corrupt = bytearray(self.data)
+        for i in range(slot_count):
+            pos = slots_pos + (i * pair_size) + (pair_size // 2)
+            corrupt[pos:pos + (pair_size // 2)] = b'\xfe' * (pair_size // 2)
+        reader = self.reader_cls(bytes(corrupt))
+        with self.assertRaises(OSError):
+            reader.get(b'1')
+
+    def test_convert(self):
+        with io.BytesIO() as f:
+            with self.base_writer_cls(f) as writer:
+                writer.put_many(self.items)
+                writer.delete(b'gone')
+            reader = self.reader_cls(f.getvalue())
+        self.assertIsNone(reader._perfect)
+
+        with io.BytesIO() as f:
+            convert(reader, f, writer_cls=self.writer_cls)
+            converted = self.reader_cls(f.getvalue())
+        self.assertIsNotNone(converted._perfect)
+        self.assertEqual(converted.tombstones, {b'gone'})
+        self.check(converted)
+
+
+    def test_convert_memory(self):
+        # Records are streamed, so large values aren't all held in memory
+        file_path = join(self.temp_dir, 'large.cdb')
+        with open(file_path, 'wb') as f:
+            with self.base_writer_cls(f) as writer:
+                for i in range(200):
+                    writer.put(str(i).encode('ascii'), bytes([i]) * 100000)
+
+        converted_path = join(self.temp_dir, 'converted.cdb')
+        with self.base_reader_cls.from_file_path(file_path) as reader:
+            with open(converted_path, 'wb') as f:
+                tracemalloc.start()
+                try:
+                    convert(reader, f, writer_cls=self.writer_cls)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+        self.assertLess(peak, 4000000)
+
+        with self.reader_cls.from_file_path(converted_path) as converted:
+            self.assertIsNotNone(converted._perfect)
+            self.assertEqual(converted.get(b'199'), bytes([199]) * 100000)
+
+
+class PerfectTestCase(PerfectTestBase, unittest.TestCase):
+    reader_cls = cdblib.PerfectReader
+    writer_cls = cdblib.PerfectWriter
+    base_reader_cls = cdblib.Reader
+    base_writer_cls = cdblib.Writer
+
+
+class Perfect64TestCase(PerfectTestBase, unittest.TestCase):
+    reader_cls = cdblib.PerfectReader64
+    writer_cls = cdblib.PerfectWriter64
+    base_reader_cls = cdblib.Reader64
+    base_writer_cls = cdblib.Writer64
+
+
+class Perfect48TestCase(PerfectTestBase, unittest.TestCase):
+    reader_cls = cdblib.PerfectReader48
+    writer_cls = cdblib.PerfectWriter48
+    base_reader_cls = cdblib.Reader48
+    base_writer_cls = cdblib.Writer48
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+import io
+import os
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import cdblib
+
+from cdblib.pread import PreadFile
+from tests.test_cdblib import testdata_path
+
+
+class PreadFileTests(unittest.TestCase):
+    def setUp(self):
+        self.data = bytes(range(256)) * 64
+        self.temp_dir = mkdtemp()
+        file_path = join(self.temp_dir, 'data')
+        with open(file_path, 'wb') as f:
+            f.write(self.data)
+        self.f = open(file_path, 'rb')
+        self.pread_file = PreadFile(self.f.fileno(), cache_blocks=2)
+
+    def tearDown(self):
+        self.f.close()
+        rmtree(self.temp_dir, ignore_errors=False)
+
+    def test_slices(self):
+        pread_file = self.pread_file
+        self.assertEqual(len(pread_file), len(self.data))
+        for start, stop in [
+            (0, 8), (4090, 4100), (100, 100), (0, 5000), (16000, 17000),
+            (-10, None), (None, None),
+        ]:
+            self.assertEqual(
+                pread_file[start:stop], self.data[start:stop], (start, stop)
+            )
+        self.assertEqual(pread_file[1:100:7], self.data[1:100:7])
+
+    def test_index(self):
+        self.assertEqual(self.pread_file[5000], self.data[5000])
+        self.assertEqual(self.pread_file[-1], self.data[-1])
+        with self.assertRaises(IndexError):
+            self.pread_file[len(self.data)]
+
+    def test_cache(self):
+        pread_file = self.pread_file
+        pread_file[0:8]
+        pread_file[8:16]
+        self.assertEqual((pread_file.hits, pread_file.misses), (1, 1))
+
+        # The least recently used block is evicted
+        pread_file[4096:4104]
+        pread_file[0:8]
+        pread_file[8192:8200]
+        self.assertEqual(list(pread_file._cache), [0, 2])
+
+        # Large reads, and reads before cache_from, aren't cached
+        pread_file.cache_from = 4096
+        pread_file.close()
+        pread_file[0:8]
+        pread_file[4096:9000]
+        self.assertEqual(len(pread_file._cache), 0)
+
+    def test_short_reads(self):
+        # os.pread() may return less than was asked for
+        pread = os.pread
+
+        def short_pread(fd, length, pos):
+            return pread(fd, min(length, 3), pos)
+
+        os.pread = short_pread
+        try:
+            self.assertEqual(self.pread_file[10:5000], self.data[10:5000])
+            self.assertEqual(
+                self.pread_file[-2:len(self.data) + 10], self.data[-2:]
+            )
+        finally:
+            os.pread = pread
+
+
+class PreadReaderTestBase(object):
+    def test_lookups(self):
+        with open(self.file_path, 'rb') as f:
+            data = f.read()
+        expected = self.reader_cls(data)
+
+        with self.reader_cls.from_file_path(
+            self.file_path, backend='pread', cache_blocks=4
+        ) as reader:
+            self.assertIsInstance(reader.data, PreadFile)
+            self.assertEqual(reader.items(), expected.items())
+            self.assertEqual(len(reader), len(expected))
+            for key in expected.iterkeys():
+                self.assertEqual(
+                    list(reader.gets(key)), list(expected.gets(key))
+                )
+            for key in (b'missing', b'', b'r00t'):
+                self.assertIsNone(reader.get(key))
+            keys = expected.keys() + [b'missing']
+            self.assertEqual(
+                reader.get_many(keys), expected.get_many(keys)
+            )
+
+            reader.warm('all')
+            self.assertFalse(reader.advise('random'))
+
+        with open(self.file_path, 'rb') as f:
+            with self.reader_cls.from_file_obj(f, backend='pread') as reader:
+                self.assertEqual(reader.items(), expected.items())
+
+    def test_bloom(self):
+        with io.BytesIO() as f:
+            with self.writer_cls(f, bloom_fp_rate=0.01) as writer:
+                for i in range(100):
+                    writer.putint(str(i), i)
+            data = f.getvalue()
+
+        temp_dir = mkdtemp()
+        try:
+            file_path = join(temp_dir, 'bloom.cdb')
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            with self.reader_cls.from_file_path(
+                file_path, backend='pread'
+            ) as reader:
+                self.assertIsNotNone(reader.bloom)
+                self.assertEqual(reader.getint('99'), 99)
+                self.assertIsNone(reader.get('100'))
+        finally:
+            rmtree(temp_dir, ignore_errors=False)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            self.reader_cls.from_file_path(self.file_path, backend='junk')
+        with self.assertRaises(ValueError):
+            self.reader_cls.from_file_path(
+                self.file_path, backend='pread', zero_copy=True
+            )
+
+
+class PreadReaderTestCase(PreadReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
+    file_path = testdata_path('pwdump.cdb')
+
+
+class PreadReader64TestCase(PreadReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+    file_path = testdata_path('pwdump.cdb64')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+import os
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event, Thread
+from unittest.mock import patch
+
+import cdblib
+
+
+class ReloadingReaderTestBase(object):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.cdb_path = join(self.temp_dir, 'database.cdb')
+        self.write(b'1')
+
+        self.reader = cdblib.ReloadingReader(
+            self.cdb_path,
+            check_interval=0,
+            background=False,
+            reader_cls=self.reader_cls,
+        )
+
+    def tearDown(self):
+        self.reader.close()
+        rmtree(self.temp_dir, ignore_errors=False)
+
+    def write(self, version):
+        # Replace the database atomically, like cdbmake does
+        tmp_path = join(self.temp_dir, 'database.tmp')
+        with open(tmp_path, 'wb') as f:
+            with self.writer_cls(f) as writer:
+                writer.put(b'version', version)
+                writer.puts(b'dave', [version, b'2'])
+        os.rename(tmp_path, self.cdb_path)
+
+    def test_reload(self):
+        self.assertEqual(self.reader.get(b'version'), b'1')
+        self.assertFalse(self.reader.check())
+
+        old_reader = self.reader.reader
+        old_get = self.reader.get
+        self.write(b'2')
+        self.assertEqual(self.reader.get(b'version'), b'2')
+        self.assertEqual(self.reader.reloads, 1)
+        self.assertIsNot(self.reader.reader, old_reader)
+
+        # Lookups that started with the old version still work
+        self.assertEqual(old_get(b'version'), b'1')
+
+    def test_check_interval(self):
+        self.reader.check_interval = 3600
+        self.reader.check()
+        self.write(b'2')
+        self.assertEqual(self.reader.get(b'version'), b'1')
+        self.assertTrue(self.reader.check())
+        self.assertEqual(self.reader.get(b'version'), b'2')
+
+    def test_background(self):
+        self.reader.background = True
+        self.write(b'2')
+        self.assertTrue(self.reader.check())
+
+        # Wait for the reload thread
+        with self.reader._lock:
+            pass
+        self.assertEqual(self.reader.get(b'version'), b'2')
+
+    def test_missing_file(self):
+        os.remove(self.cdb_path)
+        self.assertEqual(self.reader.get(b'version'), b'1')
+        self.assertIsInstance(self.reader.last_error, OSError)
+
+    def test_bad_file(self):
+        tmp_path = join(self.temp_dir, 'database.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(b'junk')
+        os.rename(tmp_path, self.cdb_path)
+
+        self.assertEqual(self.reader.get(b'version'), b'1')
+        self.assertIsNotNone(self.reader.last_error)
+        self.assertEqual(self.reader.reloads, 0)
+
+    def test_reload_in_progress(self):
+        self.write(b'2')
+        with self.reader._lock:
+            self.assertFalse(self.reader.check())
+        self.assertTrue(self.reader.check())
+
+    def test_close(self):
+        self.write(b'2')
+        self.reader.close()
+        self.assertFalse(self.reader.check())
+
+        # A reload that finishes after closing is discarded
+        self.reader._lock.acquire()
+        self.reader._reload()
+        self.assertEqual(self.reader.reloads, 0)
+
+    def test_close_during_reload(self):
+        # Closing waits for a reload in progress, and closes its reader
+        self.reader.background = True
+        self.write(b'2')
+        started = Event()
+        finish = Event()
+        open_reader = self.reader._open
+
+        def slow_open():
+            started.set()
+            finish.wait()
+            return open_reader()
+
+        with patch.object(self.reader, '_open', slow_open):
+            self.assertTrue(self.reader.check())
+            started.wait()
+            closer = Thread(target=self.reader.close)
+            closer.start()
+            finish.set()
+            closer.join()
+
+        self.assertEqual(self.reader.reloads, 1)
+        self.assertTrue(self.reader.reader.data.closed)
+
+    def test_cached(self):
+        # A CachedReader drops its results when the file is reloaded
+        cached = cdblib.CachedReader(self.reader)
+        self.assertEqual(cached.get(b'version'), b'1')
+        self.assertEqual(cached.get_many([b'dave']), [b'1'])
+        self.write(b'2')
+        self.assertEqual(cached.get(b'version'), b'2')
+        self.assertEqual(cached.misses, 3)
+        self.write(b'3')
+        self.assertEqual(cached.get_many([b'dave', b'version']), [b'3', b'3'])
+        self.assertEqual(cached.misses, 5)
+
+    def test_dict_like(self):
+        self.assertEqual(self.reader[b'dave'], b'1')
+        self.assertIn(b'dave', self.reader)
+        self.assertEqual(len(self.reader), 3)
+        self.assertEqual(list(self.reader), [b'version', b'dave', b'dave'])
+
+        with self.reader as reader:
+            self.assertEqual(list(reader.gets(b'dave')), [b'1', b'2'])
+
+
+class ReloadingReaderTestCase(ReloadingReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
+
+
+class ReloadingReader64TestCase(ReloadingReaderTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,7 @@ import cdblib
 
 from cdblib.cdbmake import main as python_pure_cdbmake
 from cdblib.cdbdump import main as python_pure_cdbdump
+from cdblib.cdbcompact import main as python_pure_cdbcompact
 
 from .test_cdblib import testdata_path
 
@@ -259,6 +260,39 @@ class ScriptsTests(unittest.TestCase):
     def test_make_then_dump_64(self):
         self._make_then_dump(use_64=True)
 
+    def _compact(self, use_64=False):
+        # Merging a base database with a delta produces a database with the
+        # records that the delta doesn't replace or delete. The destination
+        # can be one of the layers.
+        writer_cls = cdblib.Writer64 if use_64 else cdblib.Writer
+        base_path = os.path.join(self.temp_dir, 'base.cdb')
+        delta_path = os.path.join(self.temp_dir, 'delta.cdb')
+        tmp_path = os.path.join(self.temp_dir, 'tmp.cdb')
+        with open(base_path, 'wb') as f:
+            with writer_cls(f) as writer:
+                writer.put(b'a', b'1')
+                writer.put(b'b', b'2')
+                writer.put(b'c', b'3')
+        with open(delta_path, 'wb') as f:
+            with writer_cls(f) as writer:
+                writer.delete(b'a')
+                writer.put(b'b', b'4')
+
+        args = ['-64'] if use_64 else []
+        args += [base_path, tmp_path, base_path, delta_path]
+        python_pure_cdbcompact(args)
+
+        self.assertFalse(os.path.exists(tmp_path))
+        reader_cls = cdblib.Reader64 if use_64 else cdblib.Reader
+        with reader_cls.from_file_path(base_path) as reader:
+            self.assertEqual(reader.items(), [(b'c', b'3'), (b'b', b'4')])
+
+    def test_compact(self):
+        self._compact()
+
+    def test_compact_64(self):
+        self._compact(use_64=True)
+
 
 if __name__ == '__main__':
     unittest.main()
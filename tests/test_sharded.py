@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+import json
+import os
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import cdblib
+
+from cdblib.sharded import read_manifest, shard_for_hash, write_manifest
+from tests.test_cdblib import testdata_path
+
+
+class ShardForHashTests(unittest.TestCase):
+    def test_balance(self):
+        counts = [0] * 4
+        for i in range(10000):
+            counts[shard_for_hash(cdblib.djb_hash(str(i).encode()), 4)] += 1
+        self.assertTrue(all(2300 < count < 2700 for count in counts), counts)
+
+    def test_stable(self):
+        # Files on disk depend on these, so they mustn't change
+        hashes = [0, 1, 12345, 0xffffffff]
+        self.assertEqual([shard_for_hash(h, 7) for h in hashes], [0, 4, 4, 2])
+        self.assertEqual([shard_for_hash(h, 2) for h in hashes], [0, 1, 1, 0])
+        self.assertEqual([shard_for_hash(h, 1) for h in hashes], [0] * 4)
+
+
+class ManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.manifest_path = join(self.temp_dir, 'info.json')
+
+    def tearDown(self):
+        rmtree(self.temp_dir, ignore_errors=False)
+
+    def test_relative_paths(self):
+        os.mkdir(join(self.temp_dir, 'shards'))
+        file_paths = [join(self.temp_dir, 'shards', str(i)) for i in range(2)]
+        write_manifest(self.manifest_path, file_paths, cdblib.Writer64)
+
+        with open(self.manifest_path) as f:
+            self.assertEqual(
+                json.load(f)['shards'],
+                [join('shards', '0'), join('shards', '1')]
+            )
+        self.assertEqual(
+            read_manifest(self.manifest_path), (file_paths, 16)
+        )
+        self.assertEqual(
+            sorted(os.listdir(self.temp_dir)), ['info.json', 'shards']
+        )
+
+    def test_reader_classes(self):
+        # Shards are opened with the reader class for their writer class
+        for writer_cls, reader_cls in (
+            (cdblib.Writer, cdblib.Reader),
+            (cdblib.Writer48, cdblib.Reader48),
+            (cdblib.Writer64, cdblib.Reader64),
+        ):
+            with cdblib.ShardedWriter(
+                self.manifest_path, 2, writer_cls=writer_cls
+            ) as writer:
+                writer.put(b'key', b'value')
+            with cdblib.ShardedReader(self.manifest_path) as reader:
+                self.assertIsInstance(reader.readers[0], reader_cls)
+                self.assertEqual(reader.get(b'key'), b'value')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            write_manifest(self.manifest_path, [])
+
+        for manifest in (
+            [], {}, {'format': 'pure-cdb-shards', 'shards': []},
+            {'format': 'junk', 'shards': ['x.cdb']},
+        ):
+            with open(self.manifest_path, 'w') as f:
+                json.dump(manifest, f)
+            with self.assertRaises(ValueError):
+                cdblib.ShardedReader(self.manifest_path)
+
+        # A pair size that isn't supported
+        write_manifest(self.manifest_path, ['x.cdb'])
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        manifest['pair_size'] = 10
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        with self.assertRaises(ValueError):
+            cdblib.ShardedReader(self.manifest_path)
+
+    def test_missing_shard(self):
+        # Shards that were opened are closed again
+        file_path = join(self.temp_dir, 'info-0.cdb')
+        with open(file_path, 'wb') as f:
+            cdblib.Writer(f).finalize()
+        write_manifest(self.manifest_path, [file_path, file_path + 'x'])
+        with self.assertRaises(OSError):
+            cdblib.ShardedReader(self.manifest_path)
+
+
+class ShardedTestBase(object):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.manifest_path = join(self.temp_dir, 'info.json')
+        with self.reader_cls.from_file_path(self.data_path) as reader:
+            self.items = reader.items()
+
+        with cdblib.ShardedWriter(
+            self.manifest_path, 3, writer_cls=self.writer_cls
+        ) as writer:
+            writer.put_many(self.items[:100])
+            for key, value in self.items[100:]:
+                writer.put(key, value)
+        self.reader = cdblib.ShardedReader(self.manifest_path)
+
+    def tearDown(self):
+        self.reader.close()
+        rmtree(self.temp_dir, ignore_errors=False)
+
+    def test_shards(self):
+        self.assertEqual(
+            sorted(os.listdir(self.temp_dir)),
+            ['info-0.cdb', 'info-1.cdb', 'info-2.cdb', 'info.json']
+        )
+        self.assertIsInstance(self.reader.readers[0], self.reader_cls)
+
+        # Each shard holds the records for its keys, in order
+        for i, reader in enumerate(self.reader.readers):
+            expected = [
+                (key, value) for key, value in self.items
+                if shard_for_hash(cdblib.djb_hash(key), 3) == i
+            ]
+            self.assertTrue(expected)
+            self.assertEqual(reader.items(), expected)
+
+    def test_iteration(self):
+        items = self.reader.items()
+        self.assertEqual(sorted(items), sorted(self.items))
+        self.assertEqual(len(self.reader), len(self.items))
+        self.assertEqual(self.reader.keys(), [k for k, v in items])
+        self.assertEqual(list(self.reader), [k for k, v in items])
+        self.assertEqual(self.reader.values(), [v for k, v in items])
+        self.assertEqual(
+            sum(self.reader.iter_batches(7), []), items
+        )
+        self.assertEqual(
+            sum(self.reader.iter_batches(keys_only=True), []),
+            [k for k, v in items]
+        )
+
+    def test_lookups(self):
+        reader = self.reader
+        with self.reader_cls.from_file_path(self.data_path) as expected:
+            for key in expected.iterkeys():
+                self.assertEqual(reader.get(key), expected.get(key))
+                self.assertEqual(reader[key], expected[key])
+                self.assertEqual(
+                    list(reader.gets(key)), list(expected.gets(key))
+                )
+                self.assertEqual(reader.count(key), expected.count(key))
+                self.assertEqual(
+                    reader.value_length(key), expected.value_length(key)
+                )
+                self.assertIn(key, reader)
+
+            keys = expected.keys()[::3] + [b'missing'] + expected.keys()[:5]
+            self.assertEqual(
+                reader.get_many(keys, b''), expected.get_many(keys, b'')
+            )
+            self.assertEqual(reader.gets_many(keys), expected.gets_many(keys))
+
+        self.assertIsNone(reader.get(b'missing'))
+        self.assertEqual(reader.get(b'missing', b'x'), b'x')
+        self.assertNotIn(b'missing', reader)
+        self.assertEqual(reader.count(b'missing'), 0)
+        with self.assertRaises(KeyError):
+            reader[b'missing']
+
+    def test_conversions(self):
+        with cdblib.ShardedWriter(
+            self.manifest_path, 2, writer_cls=self.writer_cls
+        ) as writer:
+            writer.putint('one', 1)
+            writer.putints('ints', [1, 2])
+            writer.putstring('string', u'☃')
+            writer.putstrings('strings', [u'a', u'b'])
+            writer.puts(b'list', [b'1', b'2'])
+            writer.put_many_columns([b'k1', b'k2'], [b'v1', b'v2'])
+
+        with cdblib.ShardedReader(self.manifest_path) as reader:
+            self.assertEqual(len(reader.readers), 2)
+            self.assertEqual(reader.getint('one'), 1)
+            self.assertEqual(list(reader.getints('ints')), [1, 2])
+            self.assertEqual(reader.getstring('string'), u'☃')
+            self.assertEqual(list(reader.getstrings('strings')), [u'a', u'b'])
+            self.assertEqual(list(reader.gets(b'list')), [b'1', b'2'])
+            self.assertEqual(reader.get_many([b'k2', b'k1']), [b'v2', b'v1'])
+
+    def test_writer(self):
+        writer = cdblib.ShardedWriter(
+            self.manifest_path, 2, writer_cls=self.writer_cls
+        )
+        with self.assertRaises(ValueError):
+            writer.put_many_columns([b'k1', b'k2'], [b'v1'])
+        with self.assertRaises(TypeError):
+            writer.put(b'key', 1)
+        writer.put(b'k1', b'v1')
+
+        # Finalizing twice does nothing
+        writer.finalize()
+        writer.finalize()
+        with cdblib.ShardedReader(self.manifest_path) as reader:
+            self.assertEqual(reader.get(b'k1'), b'v1')
+
+        with self.assertRaises(ValueError):
+            cdblib.ShardedWriter(self.manifest_path, 0)
+
+    def test_writer_kwargs(self):
+        # Options are passed on to the writers and readers
+        with cdblib.ShardedWriter(
+            self.manifest_path, 2, writer_cls=self.writer_cls,
+            hashfn=lambda key: 0, bloom_fp_rate=0.1,
+        ) as writer:
+            writer.put(b'key', b'value')
+
+        with cdblib.ShardedReader(
+            self.manifest_path, hashfn=lambda key: 0, strict=True
+        ) as reader:
+            self.assertEqual(reader.get(b'key'), b'value')
+            self.assertIsNotNone(reader.readers[0].bloom)
+            with self.assertRaises(TypeError):
+                reader.get(u'key')
+
+        with self.assertRaises(TypeError):
+            cdblib.ShardedWriter(self.manifest_path, 2, bad_option=True)
+
+    def test_parallel_build_shards(self):
+        # Shards written in parallel can be read with a manifest
+        file_paths = [join(self.temp_dir, str(i)) for i in range(3)]
+        cdblib.parallel_build_shards(
+            file_paths, [self.items[:100], self.items[100:]], processes=1,
+            writer_cls=self.writer_cls,
+        )
+        write_manifest(self.manifest_path, file_paths, self.writer_cls)
+        with cdblib.ShardedReader(self.manifest_path) as reader:
+            self.assertEqual(reader.items(), self.reader.items())
+
+
+class ShardedTestCase(ShardedTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader
+    writer_cls = cdblib.Writer
+    data_path = testdata_path('pwdump.cdb')
+
+
+class Sharded64TestCase(ShardedTestBase, unittest.TestCase):
+    reader_cls = cdblib.Reader64
+    writer_cls = cdblib.Writer64
+    data_path = testdata_path('pwdump.cdb64')
+
+
+if __name__ == '__main__':
+    unittest.main()